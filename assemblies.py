@@ -0,0 +1,110 @@
+"""
+Scanning the input against several assemblies (e.g. GRCh37 and GRCh38) in a single pass of find_mismatch_positions.py
+(--assembly).
+
+Each input row names one chromosome accession. The row is expanded into one row per assembly, for the chromosome of
+the same name in it (see bioutils.assemblies), and the rows of a transcript are scanned one after the other. The
+transcript side of the data is the same for all of them: a RecentTxUTA serves the mapping options and transcript
+sequence windows of the later rows from memory, so they are only fetched once. Results are split by assembly again
+for output.
+"""
+
+from collections import Counter, OrderedDict
+
+from uta_provider import UTAProxy
+
+
+def assembly_chr_acs(assemblies):
+    """
+    Map each of the named assemblies to a dict of its chromosome names (e.g. "1", "X") to their accessions.
+    """
+    import bioutils.assemblies
+
+    return {a: bioutils.assemblies.make_name_ac_map(a) for a in assemblies}
+
+
+def expand_assemblies(txlist, chr_acs):
+    """
+    Expand each row of txlist into one row per assembly of chr_acs (as returned by assembly_chr_acs()), whose chr_ac
+    is the accession of the chromosome with the same name as the row's in that assembly, or None if it has none. The
+    rows of an input row are adjacent, indexed by "<id>@<assembly>", with the input row id and the assembly in
+    columns row_id and assembly.
+    """
+    import numpy as np
+    import pandas as pd
+
+    names = {ac: name for acs in chr_acs.values() for name, ac in acs.items()}
+    expanded = txlist.iloc[np.repeat(np.arange(len(txlist)), len(chr_acs))].copy()
+    assemblies = list(chr_acs) * len(txlist)
+    expanded["chr_ac"] = [
+        chr_acs[a].get(names.get(chr_ac))
+        for a, chr_ac in zip(assemblies, expanded["chr_ac"])
+    ]
+    expanded["row_id"] = expanded.index
+    expanded["assembly"] = assemblies
+    expanded.index = pd.Index(
+        [f"{id}@{a}" for id, a in zip(expanded.index, assemblies)],
+        name=txlist.index.name,
+    )
+    return expanded
+
+
+def split_assemblies(expanded):
+    """
+    Split a txlist expanded by expand_assemblies() into one per assembly, indexed by input row id again.
+    """
+    return {
+        a: part.set_index("row_id")
+        .rename_axis(expanded.index.name)
+        .drop(columns="assembly")
+        for a, part in expanded.groupby("assembly", sort=False)
+    }
+
+
+class RecentTxUTA(UTAProxy):
+    """
+    Data provider that keeps the results of the max_entries most recent get_tx_mapping_options() and get_seq() calls
+    in memory, for the rows of the same transcript that follow each other. Hits and misses are counted in stats as
+    cache_hits.recent_<method> and cache_misses.recent_<method>.
+    """
+
+    def __init__(self, hdp, max_entries=1024):
+        super().__init__(hdp)
+        self.max_entries = max_entries
+        self.stats = Counter()
+        self._recent = OrderedDict()
+
+    def _recent_call(self, method, *args):
+        key = (method,) + args
+        if key in self._recent:
+            self._recent.move_to_end(key)
+            self.stats[f"cache_hits.recent_{method}"] += 1
+            return self._recent[key]
+        self.stats[f"cache_misses.recent_{method}"] += 1
+        result = getattr(self.hdp, method)(*args)
+        self._recent[key] = result
+        if len(self._recent) > self.max_entries:
+            self._recent.popitem(last=False)
+        return result
+
+    def get_tx_mapping_options(self, tx_ac):
+        return self._recent_call("get_tx_mapping_options", tx_ac)
+
+    def get_seq(self, ac, start_i=None, end_i=None):
+        return self._recent_call("get_seq", ac, start_i, end_i)
+
+
+def split_records(mm):
+    """
+    Split the records of MismatchBuffer mm, found for a txlist expanded by expand_assemblies(), into one
+    MismatchBuffer per assembly, under the input row ids.
+    """
+    rows = {}
+    for i, id in enumerate(mm.index):
+        rows.setdefault(id.rpartition("@")[2], []).append(i)
+    parts = {}
+    for assembly, positions in rows.items():
+        part = parts[assembly] = type(mm)()
+        part.index = [mm.index[i].rpartition("@")[0] for i in positions]
+        part.columns = {c: [v[i] for i in positions] for c, v in mm.columns.items()}
+    return parts
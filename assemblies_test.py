@@ -0,0 +1,82 @@
+from pathlib import Path
+
+import pandas as pd
+
+import find_mismatch_positions
+from assemblies import RecentTxUTA, expand_assemblies, split_assemblies
+from find_mismatch_positions import main
+from find_mismatch_positions_test import synthetic_hdp, synthetic_txlist
+from incremental_test import read_output
+
+CHR_ACS = {
+    "A1": {"1": "NC_1.1", "2": "NC_2.1"},
+    "A2": {"1": "NC_1.2", "2": "NC_2.2"},
+}
+
+
+def two_assembly_hdp():
+    hdp = synthetic_hdp()
+    hdp.copy_chromosome("NC_1.1", "NC_1.2", 500)
+    hdp.copy_chromosome("NC_2.1", "NC_2.2", 300)
+    return hdp
+
+
+def test_expand_assemblies():
+    txlist = synthetic_txlist().iloc[:2]
+    txlist["gene"] = ["G0", "G1"]
+    expanded = expand_assemblies(txlist, {**CHR_ACS, "A3": {"2": "NC_2.3"}})
+    assert expanded.index.tolist() == [
+        f"{id}@{a}" for id in txlist.index for a in ["A1", "A2", "A3"]
+    ]
+    assert expanded["chr_ac"].tolist() == ["NC_1.1", "NC_1.2", None] * 2
+    assert expanded["gene"].tolist() == ["G0"] * 3 + ["G1"] * 3
+    parts = split_assemblies(expanded)
+    assert list(parts) == ["A1", "A2", "A3"]
+    pd.testing.assert_frame_equal(parts["A1"], txlist)
+    assert parts["A2"]["chr_ac"].tolist() == ["NC_1.2"] * 2
+
+
+def test_recent_tx():
+    hdp = RecentTxUTA(two_assembly_hdp(), max_entries=2)
+    for args in [("NM_1.1", 0, 10), ("NM_1.1", 0, 10), ("NM_2.1", 0, 10)]:
+        assert hdp.get_seq(*args) == hdp.hdp.get_seq(*args)
+    hdp.get_seq("NM_3.1", 0, 10)
+    hdp.get_seq("NM_1.1", 0, 10)
+    assert hdp.stats == {
+        "cache_hits.recent_get_seq": 1,
+        "cache_misses.recent_get_seq": 4,
+    }
+
+
+def test_assemblies_run(tmp_path, monkeypatch):
+    hdps = {}
+    # Through make_hdp(), which wraps the provider for --assembly
+    monkeypatch.setattr(
+        find_mismatch_positions,
+        "UTAMismatchProvider",
+        lambda conn: hdps.setdefault(Path.cwd().name, two_assembly_hdp()),
+    )
+    monkeypatch.setattr(
+        find_mismatch_positions, "assembly_chr_acs", lambda assemblies: CHR_ACS
+    )
+    txlist = synthetic_txlist()
+    for d, chr_acs in [("A1", CHR_ACS["A1"]), ("A2", CHR_ACS["A2"])]:
+        (tmp_path / d).mkdir()
+        names = {ac: name for name, ac in CHR_ACS["A1"].items()}
+        txlist.assign(chr_ac=txlist["chr_ac"].map(names).map(chr_acs)).to_csv(
+            tmp_path / d / "txlist.tsv", sep="\t"
+        )
+        monkeypatch.chdir(tmp_path / d)
+        main(["txlist.tsv"])
+
+    (tmp_path / "both").mkdir()
+    txlist.to_csv(tmp_path / "both" / "txlist.tsv", sep="\t")
+    monkeypatch.chdir(tmp_path / "both")
+    main(["--assembly", "A1", "--assembly", "A2", "txlist.tsv"])
+    for a in ["A1", "A2"]:
+        for f in ["mismatches.tsv", "mismatches.vcf"]:
+            assert read_output(f"txlist.{a}.{f}") == read_output(f"../{a}/txlist.{f}")
+    # Transcript sequence windows are fetched once for both assemblies
+    assert (
+        hdps["both"].get_seq_calls < hdps["A1"].get_seq_calls + hdps["A2"].get_seq_calls
+    )
@@ -0,0 +1,72 @@
+"""
+Benchmark deriving mismatch records for a transcript with many non-perfect exons, comparing the batch engine
+cigar_batch.cigar_batch_to_records() with calling uta_cigar_to_mismatch_records() on each exon.
+
+Usage: python benchmarks/bench_cigar_batch.py [--exons 10 100 1000] [--repeat 3]
+"""
+
+import argparse as ap
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from cigar_batch import cigar_batch_to_records  # noqa: E402
+from cigar_reference import uta_cigar_to_mismatch_records  # noqa: E402
+from find_mismatch_positions import MismatchBuffer, uta_get_tx_exons_df  # noqa: E402
+from synthetic_uta import SyntheticUTA  # noqa: E402
+
+parser = ap.ArgumentParser(description=__doc__.splitlines()[1])
+parser.add_argument("--exons", type=int, nargs="+", default=[10, 100, 1000])
+parser.add_argument("--repeat", type=int, default=3)
+
+# Mismatches, insertions and deletions on both strands
+CIGARS = ["20=1X30=2I20=1X10=", "15=3D40=1X5=1X20=", "50=1I2=1X30="]
+
+
+def best_of(repeat, fn):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        res = fn()
+        times.append(time.perf_counter() - t0)
+    return min(times), res
+
+
+def main():
+    args = parser.parse_args()
+    print("exons\tevents\tper_exon_s\tbatch_s\tspeedup")
+    for n in args.exons:
+        hdp = SyntheticUTA()
+        cigars = [CIGARS[i % len(CIGARS)] for i in range(n)]
+        hdp.add_transcript("NM_1.1", "NC_1.1", cigars, alt_strand=1)
+        hdp.add_transcript("NM_2.1", "NC_1.1", cigars, alt_strand=-1)
+        exons = [
+            uta_get_tx_exons_df(hdp, tx_ac, "NC_1.1", "splign")
+            for tx_ac in ["NM_1.1", "NM_2.1"]
+        ]
+
+        def per_exon():
+            mm = MismatchBuffer()
+            for df in exons:
+                for i, row in df.iterrows():
+                    uta_cigar_to_mismatch_records(hdp, "ABC", row, mm)
+            return mm.to_df()
+
+        def batch():
+            mm = MismatchBuffer()
+            for df in exons:
+                cigar_batch_to_records(hdp, ["ABC"] * len(df), df, mm)
+            return mm.to_df()
+
+        t_exon, expected = best_of(args.repeat, per_exon)
+        t_batch, mm = best_of(args.repeat, batch)
+        assert mm.astype(str).equals(expected.astype(str))
+        print(
+            f"{2 * n}\t{len(mm)}\t{t_exon:.4f}\t{t_batch:.4f}\t{t_exon / t_batch:.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Benchmark collecting mismatch records for exons with many X ops, comparing the MismatchBuffer used by
+uta_cigar_to_mismatch_records() with the previous approach of pd.concat-ing a one-row DataFrame per event.
+
+Usage: python benchmarks/bench_mismatch_buffer.py [--events 20 100 500 1000] [--repeat 3]
+"""
+
+import argparse as ap
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from cigar_reference import uta_cigar_to_mismatch_records  # noqa: E402
+from find_mismatch_positions import (  # noqa: E402
+    MISMATCH_COLUMNS,
+    MismatchBuffer,
+    uta_get_tx_exons_df,
+)
+from synthetic_uta import SyntheticUTA  # noqa: E402
+
+parser = ap.ArgumentParser(description=__doc__.splitlines()[1])
+parser.add_argument("--events", type=int, nargs="+", default=[20, 100, 500, 1000])
+parser.add_argument("--repeat", type=int, default=3)
+
+
+def concat_collect(records):
+    """
+    Rebuild the records of DataFrame records the way uta_cigar_to_mismatch_vcf() used to: one DataFrame per event, concatenated onto the result.
+    """
+    mm = pd.DataFrame(columns=MISMATCH_COLUMNS)
+    for i, id in enumerate(records.index):
+        mismatch = pd.DataFrame(
+            {c: records[c].iat[i] for c in MISMATCH_COLUMNS}, index=[id]
+        )
+        mm = pd.concat([mm, mismatch], ignore_index=False)
+    return mm
+
+
+def best_of(repeat, fn):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        res = fn()
+        times.append(time.perf_counter() - t0)
+    return min(times), res
+
+
+def main():
+    args = parser.parse_args()
+    print("events\tbuffer_s\tbuffer_events_per_s\tconcat_s\tconcat_events_per_s")
+    for n in args.events:
+        hdp = SyntheticUTA()
+        hdp.add_transcript("NM_1.1", "NC_1.1", ["3=1X" * n + "3="])
+        row = uta_get_tx_exons_df(hdp, "NM_1.1", "NC_1.1", "splign").squeeze()
+        # Time full record derivation into a MismatchBuffer, then the collection step alone with pd.concat
+        t_buf, buf = best_of(
+            args.repeat,
+            lambda: uta_cigar_to_mismatch_records(
+                hdp, "ABC", row, MismatchBuffer()
+            ).to_df(),
+        )
+        records = uta_cigar_to_mismatch_records(
+            hdp, "ABC", row, MismatchBuffer()
+        ).to_df()
+        t_concat, mm = best_of(args.repeat, lambda: concat_collect(records))
+        assert mm.astype(str).equals(buf.astype(str))
+        print(f"{n}\t{t_buf:.4f}\t{n / t_buf:.0f}\t{t_concat:.4f}\t{n / t_concat:.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,407 @@
+"""
+Benchmark the mismatch scan end to end on recorded fixtures, reporting transcripts/sec, events/sec and peak RSS
+per execution mode.
+
+Fixtures are UTA snapshots (see uta_snapshot.py) of synthetic alignments, i.e. the exon rows and exact sequence
+windows a scan needs, so runs are reproducible and need no database:
+- scenarios: one transcript per scenario of uta_cigar_to_vcf_test.py (same accessions, strands, exon ordinals and
+  CIGAR strings), each in a list with the other exons of the transcript aligned perfectly;
+- genome: --transcripts synthetic transcripts on both strands of several contigs, aligned with two methods, whose
+  exons have long CIGAR strings with many mismatches and indels.
+Fixtures are built deterministically on first use and kept in --fixture-dir. A recorded snapshot of real data
+(written by find_mismatch_positions.py export-snapshot) can be added with --snapshot PATH --txlist PATH.
+
+Every mode runs in a fresh subprocess, so peak RSS (including worker processes) is measured per mode. Startup is
+measured too, in fresh interpreters: the import time of find_mismatch_positions as reported by python -X importtime,
+with the slowest modules it imports, and the wall time of find_mismatch_positions.py --help. Results can be saved
+with --json and compared with a previous run with --baseline.
+
+Usage: python benchmarks/bench_pipeline.py [--fixtures scenarios genome] [--modes serial workers async main]
+    [--transcripts 2000] [--workers 4] [--concurrency 8] [--json results.json] [--baseline results.json]
+"""
+
+import argparse as ap
+from functools import partial
+import json
+import os
+from pathlib import Path
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from find_mismatch_positions import (  # noqa: E402
+    main as run_main,
+    read_txlist,
+    scan_txlist,
+    scan_txlist_async,
+    scan_txlist_parallel,
+)
+from instrumentation import configure_logging  # noqa: E402
+from synthetic_uta import SyntheticUTA  # noqa: E402
+from uta_snapshot import RecordingUTA, SnapshotUTA  # noqa: E402
+from vcf_writer import read_vcf  # noqa: E402
+
+MODES = ["serial", "workers", "async", "main"]
+
+# Scenario, tx_ac, chr_ac, alt_aln_method, alt_strand, exon ordinal and CIGAR of the tests in uta_cigar_to_vcf_test.py
+SCENARIOS = [
+    (name, tx_ac, chr_ac, method, int(strand), int(ord), cigar)
+    for name, tx_ac, chr_ac, method, strand, ord, cigar in (line.split() for line in """
+single_mismatch_pos_strand NM_000090.3 NC_000002.12 splign 1 49 47=1X195=
+single_mismatch_pos_strand_2 NM_000059.3 NC_000013.11 splign 1 13 389=1X38=
+single_mismatch_min_strand NM_000384.2 NC_000002.12 splign -1 25 2720=1X4851=
+single_mismatch_min_strand_2 NM_000130.4 NC_000001.10 splign -1 9 204=1X10=
+two_contig_mismatches_pos_strand NM_001300891.2 NC_000001.10 splign 1 3 21=1X116=1X54=1X79=2X27=1X54=1X6=1X13=1X2=1X34=1X69=1X7=1X3=2X216=1X50=1X9=1X32=1X83=
+two_contig_mismatches_min_strand NR_110761.1 NC_000001.10 splign -1 2 21=1X116=1X54=1X79=2X27=1X54=1X6=1X13=1X2=1X34=1X69=1X7=1X3=2X216=1X50=1X9=1X32=1X83=
+single_bp_del_pos_strand NM_014487.4 NC_000004.11 blat 1 9 980=1D2=
+single_bp_del_min_strand NM_004657.5 NC_000002.11 blat -1 1 2410=1D2=
+multi_bp_del_pos_strand NM_001366994.1 NC_000014.8 splign 1 3 4=9D149=
+multi_bp_del_pos_strand_2 NM_001256326.1 NC_000017.10 blat 1 35 1453=3D2=
+multi_bp_del_min_strand NM_001291642.2 NC_000017.10 splign -1 13 459=14D1318=
+single_bp_ins_pos_strand NM_001171654.1 NC_000004.11 splign 1 0 136=1I129=
+multi_bp_ins_pos_strand NM_001039703.6 NC_000001.10 splign 1 34 14=1X11=6I26=
+multi_bp_ins_pos_strand_2 NM_001788.5 NC_000007.13 blat 1 0 284=3I1=
+single_bp_ins_neg_strand NM_001160329.1 NC_000019.9 splign -1 10 428=1I76=
+multi_bp_ins_neg_strand NM_001290207.2 NC_000003.11 splign -1 5 52=6I14=
+two_noncontig_single_bp_events NM_000314.4 NC_000010.10 splign 1 0 666=1I39=1X404=
+multiple_indels_min_strand NM_001280560.2 NC_000001.10 splign -1 4 498=1D37=3I1809=
+""".strip().splitlines())
+]
+
+parser = ap.ArgumentParser(description=__doc__.splitlines()[1])
+parser.add_argument(
+    "--fixtures",
+    nargs="+",
+    default=["scenarios", "genome"],
+    choices=["scenarios", "genome"],
+)
+parser.add_argument("--modes", nargs="+", default=MODES, choices=MODES)
+parser.add_argument(
+    "--transcripts", type=int, default=2000, help="Transcripts of the genome fixture"
+)
+parser.add_argument(
+    "--workers", type=int, default=4, help="Worker processes of the workers mode"
+)
+parser.add_argument(
+    "--concurrency", type=int, default=8, help="Concurrent queries of the async mode"
+)
+parser.add_argument(
+    "--fixture-dir", type=str, default=str(ROOT / "benchmarks" / "fixtures")
+)
+parser.add_argument(
+    "--rebuild", action="store_true", help="Rebuild the fixtures even if they exist"
+)
+parser.add_argument(
+    "--snapshot", type=str, help="Recorded snapshot of real data to benchmark too"
+)
+parser.add_argument(
+    "--txlist", type=str, help="Input list the --snapshot was recorded for"
+)
+parser.add_argument(
+    "--startup-repeat",
+    type=int,
+    default=5,
+    help="Runs to take the best startup times of (0 skips measuring startup)",
+)
+parser.add_argument("--json", type=str, help="Write the results to this JSON file")
+parser.add_argument(
+    "--baseline", type=str, help="JSON results of a previous run to compare with"
+)
+# Internal: run one mode on one fixture and print its result as JSON
+parser.add_argument(
+    "--run", nargs=3, metavar=("MODE", "SNAPSHOT", "TXLIST"), help=ap.SUPPRESS
+)
+
+
+def random_cigar(rng, events):
+    """
+    A CIGAR string with events mismatches and indels, separated by matches so every event is converted.
+    """
+    ops = [f"{rng.randint(20, 200)}="]
+    for _ in range(events):
+        op = rng.choice("XXXXID")
+        ops.append(f"{rng.randint(1, 3 if op == 'X' else 12)}{op}")
+        ops.append(f"{rng.randint(5, 200)}=")
+    return "".join(ops)
+
+
+def scenario_fixture():
+    hdp = SyntheticUTA(seed=18)
+    rows = []
+    for name, tx_ac, chr_ac, method, strand, ord, cigar in SCENARIOS:
+        cigars = ["100="] * ord + [cigar, "100="]
+        hdp.add_transcript(
+            tx_ac, chr_ac, cigars, strand, alt_aln_method=method, gene=name
+        )
+        rows.append((f"{name}|{tx_ac}|{chr_ac}", tx_ac, chr_ac))
+    return hdp, rows
+
+
+def genome_fixture(n_transcripts):
+    rng = random.Random(18)
+    hdp = SyntheticUTA(seed=18)
+    rows = []
+    for i in range(n_transcripts):
+        tx_ac = f"NM_{i:06d}.1"
+        chr_ac = f"NC_{i % 24 + 1:06d}.11"
+        cigars = [
+            random_cigar(rng, rng.choice([0, 0, 1, 4, 16]))
+            for _ in range(rng.randint(2, 12))
+        ]
+        strand = rng.choice([1, -1])
+        for method in ["splign", "blat"]:
+            hdp.add_transcript(
+                tx_ac, chr_ac, cigars, strand, alt_aln_method=method, gene=f"G{i}"
+            )
+        rows.append((f"G{i}|{tx_ac}|{chr_ac}", tx_ac, chr_ac))
+    return hdp, rows
+
+
+def build_fixture(name, args):
+    """
+    Record the named fixture into a snapshot and input list in --fixture-dir, unless they exist, and return their
+    paths.
+    """
+    suffix = f"_{args.transcripts}" if name == "genome" else ""
+    snapshot = Path(args.fixture_dir) / f"{name}{suffix}.snapshot.json.gz"
+    txlist_path = Path(args.fixture_dir) / f"{name}{suffix}.txlist.tsv"
+    if snapshot.exists() and txlist_path.exists() and not args.rebuild:
+        return snapshot, txlist_path
+    snapshot.parent.mkdir(parents=True, exist_ok=True)
+    hdp, rows = (
+        scenario_fixture() if name == "scenarios" else genome_fixture(args.transcripts)
+    )
+    txlist = pd.DataFrame(rows, columns=["id", "tx_ac", "chr_ac"]).set_index("id")
+    recording = RecordingUTA(hdp)
+    scan_txlist(recording, txlist)
+    recording.save(snapshot, "synthetic")
+    txlist.to_csv(txlist_path, sep="\t")
+    return snapshot, txlist_path
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux; the children's is the largest of any worker process
+    return (
+        max(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+        )
+        / 1024
+    )
+
+
+def run_mode(mode, snapshot, txlist_path, workers, concurrency):
+    """
+    Scan the fixture in the given mode and return the number of transcripts and events and the elapsed seconds.
+    """
+    txlist = read_txlist(txlist_path)
+    if mode == "main":
+        with tempfile.TemporaryDirectory() as tmp:
+            infile = os.path.join(tmp, "txlist.tsv")
+            txlist.to_csv(infile, sep="\t")
+            cwd = os.getcwd()
+            os.chdir(tmp)
+            try:
+                t0 = time.perf_counter()
+                run_main(["--snapshot", str(Path(cwd, snapshot)), infile])
+                elapsed = time.perf_counter() - t0
+                events = len(read_vcf("txlist.mismatches.vcf"))
+            finally:
+                os.chdir(cwd)
+        return len(txlist), events, elapsed
+    if mode == "serial":
+        hdp = SnapshotUTA(snapshot)
+        t0 = time.perf_counter()
+        _, mm, _ = scan_txlist(hdp, txlist)
+    elif mode == "workers":
+        t0 = time.perf_counter()
+        _, mm, _ = scan_txlist_parallel(
+            partial(SnapshotUTA, snapshot), txlist, workers, 100
+        )
+    else:
+        t0 = time.perf_counter()
+        _, mm, _ = scan_txlist_async(
+            partial(SnapshotUTA, snapshot), txlist, concurrency
+        )
+    return len(txlist), len(mm), time.perf_counter() - t0
+
+
+def measure(mode, fixture, snapshot, txlist_path, args):
+    out = subprocess.run(
+        [
+            sys.executable,
+            __file__,
+            "--workers",
+            str(args.workers),
+            "--concurrency",
+            str(args.concurrency),
+            "--run",
+            mode,
+            str(snapshot),
+            str(txlist_path),
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    return {"fixture": fixture, "mode": mode, **result}
+
+
+def import_times():
+    """
+    Import time of find_mismatch_positions in a fresh interpreter, in seconds, and the cumulative import times of
+    the modules it imports directly, from python -X importtime.
+    """
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import find_mismatch_positions"],
+        cwd=ROOT,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    # Lines are "import time: <self us> | <cumulative us> | <indented module name>", children before parents
+    modules = {}
+    total = None
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        seconds = int(cumulative) / 1e6
+        if name.strip() == "find_mismatch_positions":
+            total = seconds
+        elif name.startswith("   ") and not name.startswith("    "):
+            modules[name.strip()] = seconds
+    return total, modules
+
+
+def measure_startup(repeat):
+    """
+    Best of repeat runs of the import time of find_mismatch_positions and the wall time of its --help.
+    """
+    imports = min((import_times() for _ in range(repeat)), key=lambda r: r[0])
+    helps = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        subprocess.run(
+            [sys.executable, str(ROOT / "find_mismatch_positions.py"), "--help"],
+            check=True,
+            capture_output=True,
+        )
+        helps.append(time.perf_counter() - t0)
+    slowest = sorted(imports[1].items(), key=lambda m: -m[1])[:5]
+    return [
+        {
+            "fixture": "startup",
+            "mode": "import",
+            "seconds": round(imports[0], 4),
+            "slowest_imports": {name: round(t, 4) for name, t in slowest},
+        },
+        {"fixture": "startup", "mode": "help", "seconds": round(min(helps), 4)},
+    ]
+
+
+def main():
+    args = parser.parse_args()
+    if args.run:
+        mode, snapshot, txlist_path = args.run
+        # Log as in a real run, but to /dev/null (also for worker processes, which inherit stdout), and report the
+        # result on the original stdout
+        result_fd = os.dup(1)
+        os.dup2(os.open(os.devnull, os.O_WRONLY), 1)
+        configure_logging()
+        transcripts, events, elapsed = run_mode(
+            mode, snapshot, txlist_path, args.workers, args.concurrency
+        )
+        result = (
+            json.dumps(
+                {
+                    "transcripts": transcripts,
+                    "events": events,
+                    "seconds": round(elapsed, 4),
+                    "transcripts_per_s": round(transcripts / elapsed, 1),
+                    "events_per_s": round(events / elapsed, 1),
+                    "peak_rss_mb": round(peak_rss_mb(), 1),
+                }
+            )
+            + "\n"
+        )
+        os.write(result_fd, result.encode())
+        return
+
+    fixtures = [(name, *build_fixture(name, args)) for name in args.fixtures]
+    if args.snapshot:
+        fixtures.append(("snapshot", Path(args.snapshot), Path(args.txlist)))
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {(r["fixture"], r["mode"]): r for r in json.load(f)}
+    columns = [
+        "fixture",
+        "mode",
+        "transcripts",
+        "events",
+        "seconds",
+        "transcripts_per_s",
+        "events_per_s",
+        "peak_rss_mb",
+    ]
+    print("\t".join(columns + (["events_per_s_vs_baseline"] if baseline else [])))
+    results = []
+    for fixture, snapshot, txlist_path in fixtures:
+        for mode in args.modes:
+            result = measure(mode, fixture, snapshot, txlist_path, args)
+            results.append(result)
+            line = [str(result[c]) for c in columns]
+            if baseline:
+                base = baseline.get((fixture, mode))
+                line.append(
+                    f"{result['events_per_s'] / base['events_per_s']:.2f}x"
+                    if base and base["events_per_s"]
+                    else "-"
+                )
+            print("\t".join(line), flush=True)
+    if args.startup_repeat > 0:
+        print()
+        print(
+            "\t".join(
+                ["startup", "seconds", "slowest_imports"]
+                + (["seconds_vs_baseline"] if baseline else [])
+            )
+        )
+        for result in measure_startup(args.startup_repeat):
+            results.append(result)
+            line = [
+                result["mode"],
+                str(result["seconds"]),
+                ", ".join(
+                    f"{name} {t:.3f}"
+                    for name, t in result.get("slowest_imports", {}).items()
+                )
+                or "-",
+            ]
+            if baseline:
+                base = baseline.get(("startup", result["mode"]))
+                line.append(
+                    f"{result['seconds'] / base['seconds']:.2f}x"
+                    if base and base["seconds"]
+                    else "-"
+                )
+            print("\t".join(line), flush=True)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
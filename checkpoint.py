@@ -0,0 +1,102 @@
+"""
+Checkpoints of a find_mismatch_positions.py run over a transcript list, so a run that dies partway through can be
+resumed without scanning the finished rows again.
+
+The checkpoint is an append-only JSON lines journal: a header line identifying the input, then one line per chunk
+of consecutive rows scanned, with their has_aln values and mismatch records. The scan functions hand over results in
+input order, so the journal always covers a prefix of the input. It is fsync-ed at most every interval seconds and
+when closed; a line cut short by a crash is ignored and overwritten on resume.
+"""
+
+import json
+import os
+import time
+
+CHECKPOINT_VERSION = 2
+
+
+class Checkpoint:
+    """
+    Journal of the results of the first rows of input file infile, which has n_rows rows, at path. Unless resume
+    is set, any existing journal is discarded.
+    """
+
+    def __init__(self, path, infile, n_rows, resume=False, interval=30.0):
+        self.path = str(path)
+        self.interval = interval
+        self.header = {
+            "checkpoint": CHECKPOINT_VERSION,
+            "infile": os.path.abspath(infile),
+            "rows": n_rows,
+        }
+        self.rows_done = 0
+        self._chunks = []
+        good_size = 0
+        if resume and os.path.exists(self.path):
+            good_size = self._load()
+        if good_size:
+            self._f = open(self.path, "r+b")
+            self._f.seek(good_size)
+            self._f.truncate()
+        else:
+            self._f = open(self.path, "wb")
+            self._write(self.header)
+            self.sync()
+        self._last_sync = time.monotonic()
+
+    def _load(self):
+        """
+        Read the chunks of an existing journal and return the size of its intact part.
+        """
+        with open(self.path, "rb") as f:
+            lines = f.readlines()
+        if not lines or not lines[0].endswith(b"\n"):
+            return 0
+        header = json.loads(lines[0])
+        if header != self.header:
+            raise ValueError(
+                f"Checkpoint {self.path} is for {header['infile']} ({header['rows']} rows), not {self.header['infile']} ({self.header['rows']} rows)"
+            )
+        size = len(lines[0])
+        for line in lines[1:]:
+            if not line.endswith(b"\n"):
+                break
+            chunk = json.loads(line)
+            self._chunks.append(chunk)
+            self.rows_done += len(chunk["has_aln"])
+            size += len(line)
+        return size
+
+    def replay(self, fn, buffer_cls):
+        """
+        Call fn(has_aln, mm) with the has_aln values and a buffer_cls (i.e. MismatchBuffer) of the records of each
+        chunk read from the journal, in order.
+        """
+        for chunk in self._chunks:
+            mm = buffer_cls()
+            mm.index = chunk["index"]
+            mm.columns = chunk["columns"]
+            fn(chunk["has_aln"], mm)
+        self._chunks = []
+
+    def _write(self, obj):
+        # default=int converts the numpy integers UTA values may have been turned into by pandas
+        self._f.write(json.dumps(obj, default=int).encode() + b"\n")
+
+    def add(self, has_aln, mm):
+        """
+        Append the has_aln values and MismatchBuffer of the next chunk of rows.
+        """
+        self._write({"has_aln": has_aln, "index": mm.index, "columns": mm.columns})
+        self.rows_done += len(has_aln)
+        if time.monotonic() - self._last_sync >= self.interval:
+            self.sync()
+
+    def sync(self):
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        self.sync()
+        self._f.close()
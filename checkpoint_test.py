@@ -0,0 +1,120 @@
+import os
+
+import pytest
+
+import find_mismatch_positions
+from checkpoint import Checkpoint
+from find_mismatch_positions import MismatchBuffer, main, scan_txlist
+from find_mismatch_positions_test import synthetic_hdp, synthetic_txlist
+from uta_snapshot import RecordingUTA
+
+# INFO field values of a record, in vcf_writer.INFO_KEYS order
+INFO = ("NM_1.1", "10=1X", "splign", 0, 1, 2, 0, 11, 10, 100, 111, 1)
+
+
+@pytest.fixture
+def snapshot_run(tmp_path, monkeypatch):
+    hdp = RecordingUTA(synthetic_hdp())
+    scan_txlist(hdp, synthetic_txlist())
+    hdp.save(tmp_path / "snapshot.json.gz", "uta_test")
+    synthetic_txlist().to_csv(tmp_path / "txlist.tsv", sep="\t")
+    monkeypatch.chdir(tmp_path)
+    return ["--snapshot", "snapshot.json.gz", "txlist.tsv"]
+
+
+def read_output(ext):
+    with open(f"txlist.mismatches.{ext}") as f:
+        return [line for line in f if not line.startswith("##fileDate")]
+
+
+def test_resume(snapshot_run, monkeypatch):
+    main(snapshot_run)
+    expected = {f: read_output(f) for f in ["tsv", "vcf"]}
+    assert not os.path.exists("txlist.checkpoint.jsonl")
+
+    # A run that dies after 3 rows leaves a checkpoint of them
+    scan_transcript = find_mismatch_positions.scan_transcript
+    scanned = []
+
+    def failing_scan_transcript(hdp, id, *args):
+        if len(scanned) == 3:
+            raise RuntimeError("connection lost")
+        scanned.append(id)
+        return scan_transcript(hdp, id, *args)
+
+    monkeypatch.setattr(
+        find_mismatch_positions, "scan_transcript", failing_scan_transcript
+    )
+    with pytest.raises(RuntimeError):
+        main(snapshot_run)
+    assert os.path.exists("txlist.checkpoint.jsonl")
+
+    # Resuming only scans the remaining rows and gives the same output
+    resumed = []
+    monkeypatch.setattr(
+        find_mismatch_positions,
+        "scan_transcript",
+        lambda hdp, id, *args: resumed.append(id) or scan_transcript(hdp, id, *args),
+    )
+    main(snapshot_run + ["--resume"])
+    assert resumed == list(synthetic_txlist().index[3:])
+    for f, content in expected.items():
+        assert read_output(f) == content
+    assert not os.path.exists("txlist.checkpoint.jsonl")
+
+
+def test_resume_async(snapshot_run, monkeypatch):
+    main(snapshot_run)
+    expected = {f: read_output(f) for f in ["tsv", "vcf"]}
+
+    # Rows finished before the failure are checkpointed although the scan doesn't end
+    scan_transcript = find_mismatch_positions.scan_transcript
+    scanned = []
+
+    def failing_scan_transcript(hdp, id, *args):
+        if len(scanned) == 5:
+            raise RuntimeError("connection lost")
+        scanned.append(id)
+        return scan_transcript(hdp, id, *args)
+
+    monkeypatch.setattr(
+        find_mismatch_positions, "scan_transcript", failing_scan_transcript
+    )
+    with pytest.raises(RuntimeError):
+        main(snapshot_run + ["--async-queries", "1"])
+
+    resumed = []
+    monkeypatch.setattr(
+        find_mismatch_positions,
+        "scan_transcript",
+        lambda hdp, id, *args: resumed.append(id) or scan_transcript(hdp, id, *args),
+    )
+    main(snapshot_run + ["--async-queries", "1", "--resume"])
+    assert resumed == list(synthetic_txlist().index[5:])
+    for f, content in expected.items():
+        assert read_output(f) == content
+
+
+def test_truncated_checkpoint(tmp_path):
+    path = tmp_path / "run.checkpoint.jsonl"
+    mm = MismatchBuffer()
+    mm.append("G0", "NC_1.1", 10, "ev", "A", "C", INFO)
+    checkpoint = Checkpoint(path, "txlist.tsv", 5)
+    checkpoint.add([True], mm)
+    checkpoint.add([False, True], MismatchBuffer())
+    checkpoint.close()
+    with open(path, "a") as f:
+        f.write('{"has_aln": [tr')
+
+    checkpoint = Checkpoint(path, "txlist.tsv", 5, resume=True)
+    assert checkpoint.rows_done == 3
+    chunks = []
+    checkpoint.replay(lambda has_aln, mm: chunks.append((has_aln, mm)), MismatchBuffer)
+    assert [has_aln for has_aln, _ in chunks] == [[True], [False, True]]
+    assert chunks[0][1].to_df().equals(mm.to_df())
+    checkpoint.add([True], MismatchBuffer())
+    checkpoint.close()
+    assert Checkpoint(path, "txlist.tsv", 5, resume=True).rows_done == 4
+
+    with pytest.raises(ValueError):
+        Checkpoint(path, "other.tsv", 5, resume=True)
@@ -0,0 +1,389 @@
+"""
+Vectorized derivation of VCF records from the CIGAR strings of a batch of exons, equivalent to calling
+cigar_reference.uta_cigar_to_mismatch_records() on each exon in turn.
+
+The CIGAR strings of all exons are tokenized at once into flat NumPy arrays of op codes and lengths, and the
+transcript and genomic cursor positions before every op are computed with cumulative sums, for both strands. Each
+exon's sequences are still fetched with one get_seq() call per sequence, and REF/ALT are sliced from their
+concatenation.
+
+The same genomic exon is often aligned with the same CIGAR string to many transcripts (versions, and the splign and
+blat alignments of each). Data providers wrapped in an EventMemoUTA remember the events derived for an exon, keyed
+by its genomic interval, strand, CIGAR string and transcript exon sequence, so they are only derived once.
+"""
+
+from collections import Counter, OrderedDict
+import functools
+import hashlib
+
+import numpy as np
+
+from normalize import left_normalize
+from uta_provider import UTAProxy
+
+OP_MATCH, OP_X, OP_I, OP_D, OP_OTHER = range(5)
+
+
+@functools.cache
+def _op_codes():
+    """
+    Op code of every byte value, -1 for characters that are not CIGAR ops. Built on first use so importing this
+    module stays cheap.
+    """
+    op_codes = np.full(256, -1, dtype=np.int8)
+    op_codes[np.frombuffer(b"ABCDEFGHIJKLMNOPQRSTUVWXYZ=", dtype=np.uint8)] = OP_OTHER
+    op_codes[np.frombuffer(b"=M", dtype=np.uint8)] = OP_MATCH
+    op_codes[ord("X")] = OP_X
+    op_codes[ord("I")] = OP_I
+    op_codes[ord("D")] = OP_D
+    return op_codes
+
+
+def tokenize_cigars(cigars):
+    """
+    Tokenize CIGAR strings into flat arrays of op characters (as uint8), op codes, op lengths and the index in cigars
+    of the CIGAR string each op belongs to. Raises ValueError for strings that aren't a sequence of <length><op>.
+    """
+    op_codes = _op_codes()
+    cigar_ends = np.cumsum([len(c) for c in cigars], dtype=np.int64)
+    chars = np.frombuffer("".join(cigars).encode("ascii"), dtype=np.uint8)
+    is_digit = (chars >= ord("0")) & (chars <= ord("9"))
+    op_pos = np.flatnonzero(~is_digit)
+    cigar_i = np.searchsorted(cigar_ends, op_pos, side="right")
+    cigar_starts = cigar_ends - [len(c) for c in cigars]
+    # Every op must be a known character preceded by a length, and every CIGAR string must end with an op
+    malformed = (op_codes[chars[op_pos]] < 0) | (op_pos == cigar_starts[cigar_i])
+    malformed |= ~is_digit[np.maximum(op_pos - 1, 0)]
+    bad_end = (cigar_ends > cigar_starts) & is_digit[np.maximum(cigar_ends - 1, 0)]
+    if malformed.any() or bad_end.any():
+        i = cigar_i[np.argmax(malformed)] if malformed.any() else np.argmax(bad_end)
+        raise ValueError(f"Malformed CIGAR string: {cigars[i]}")
+
+    # Each op's length is the sum of its digits times powers of 10 by their distance from the op
+    digit_pos = np.flatnonzero(is_digit)
+    owner = np.searchsorted(op_pos, digit_pos)
+    digits = (chars[digit_pos] - ord("0")).astype(np.int64)
+    values = digits * 10 ** (op_pos[owner] - 1 - digit_pos).astype(np.int64)
+    lengths = (
+        np.add.reduceat(values, np.searchsorted(owner, np.arange(len(op_pos))))
+        if len(op_pos)
+        else np.zeros(0, dtype=np.int64)
+    )
+    return chars[op_pos], op_codes[chars[op_pos]], lengths, cigar_i
+
+
+class _Windows:
+    """
+    Sequence windows of a batch of exons, concatenated into a single string so events can be sliced by offset.
+    """
+
+    def __init__(self, hdp, acs, start_i, end_i):
+        self.hdp = hdp
+        self.acs = acs
+        self.start_i = np.maximum(start_i, 0)
+        self.end_i = end_i
+        seqs = [
+            hdp.get_seq(ac, int(s), int(e))
+            for ac, s, e in zip(acs, self.start_i, end_i)
+        ]
+        self.lengths = np.array([len(s) for s in seqs], dtype=np.int64)
+        self.offsets = np.cumsum(self.lengths) - self.lengths
+        self.seq = "".join(seqs)
+        self._seq_rc = None
+
+    def get(self, w, start_i, end_i):
+        """
+        The sequence of [start_i, end_i) of window w, or None if the window doesn't hold all of it.
+        """
+        ws = self.start_i[w]
+        if not ws <= start_i <= end_i <= ws + self.lengths[w]:
+            return None
+        return self.seq[self.offsets[w] + start_i - ws : self.offsets[w] + end_i - ws]
+
+    def slices(self, w, start_i, end_i, rc=False):
+        """
+        Return the (reverse-complemented if rc) sequence of [start_i, end_i) of window w for each event, like
+        cigar_reference.SeqWindow, i.e. fetching intervals outside of the window with hdp.get_seq().
+        """
+        ws = self.start_i[w]
+        contained = (ws <= start_i) & (start_i <= end_i) & (end_i <= self.end_i[w])
+        n = self.lengths[w]
+        b0 = self.offsets[w] + np.minimum(start_i - ws, n)
+        b1 = self.offsets[w] + np.minimum(end_i - ws, n)
+        if rc:
+            if self._seq_rc is None:
+                self._seq_rc = reverse_complement(self.seq)
+            seq, total = self._seq_rc, len(self.seq)
+            b0, b1 = total - b1, total - b0
+        else:
+            seq = self.seq
+        result = [seq[i:j] for i, j in zip(b0.tolist(), b1.tolist())]
+        for k in np.flatnonzero(~contained):
+            s = self.hdp.get_seq(self.acs[w[k]], int(start_i[k]), int(end_i[k]))
+            result[k] = reverse_complement(s) if rc else s
+        return result
+
+
+def reverse_complement(seq):
+    """
+    Reverse complement of sequence string seq. Bio.Seq is only imported once a minus strand alignment needs it.
+    """
+    from Bio.Seq import reverse_complement
+
+    return reverse_complement(seq)
+
+
+def _str_array(values):
+    return np.array([str(v) for v in values], dtype=object)
+
+
+class EventMemoUTA(UTAProxy):
+    """
+    Data provider that memoizes the events cigar_batch_to_records() derives for an exon, for reuse by all transcripts
+    and alignment methods with an identical exon alignment. Holds the events of up to max_exons exons, evicting the
+    least recently used. Hits and misses are counted in stats as cache_hits.exon_events and cache_misses.exon_events.
+    """
+
+    def __init__(self, hdp, max_exons=100000):
+        super().__init__(hdp)
+        self.max_exons = max_exons
+        self.stats = Counter()
+        self._events = OrderedDict()
+
+    def lookup_events(self, keys):
+        """
+        Look up the events of a batch of exons by key. Returns the memoized events of each exon (None if there are
+        none) and the index of the first exon in the batch with the same key, whose events an exon can reuse once
+        they are derived. A key of None is never memoized.
+        """
+        cached, first, seen = [], [], {}
+        for j, key in enumerate(keys):
+            events = self._events.get(key) if key is not None else None
+            if events is not None:
+                self._events.move_to_end(key)
+            f = seen.setdefault(key, j) if key is not None else j
+            cached.append(events)
+            first.append(f)
+            if events is not None or f != j:
+                self.stats["cache_hits.exon_events"] += 1
+            else:
+                self.stats["cache_misses.exon_events"] += 1
+        return cached, first
+
+    def store_events(self, key, events):
+        if key is None:
+            return
+        self._events[key] = events
+        if len(self._events) > self.max_exons:
+            self._events.popitem(last=False)
+
+
+def cigar_batch_to_records(hdp, ids, exons, mm, ref_windows=None):
+    """
+    Derive VCF records for every mismatch/indel in the CIGAR strings of the exons in DataFrame exons (with the columns
+    of find_mismatch_positions.uta_get_tx_exons_df()) and append them to MismatchBuffer mm, which is returned. ids
+    gives the input row id of each exon. Records are identical to, and in the same order as, those of
+    uta_cigar_to_mismatch_records() called on each exon in order, including merging runs of adjacent mismatches and
+    indels into a single delins record.
+
+    If ref_windows (a normalize.ReferenceWindows) is given, indel records are left-aligned and trimmed with
+    normalize.left_normalize(), reading the reference from the exons' genomic windows and beyond them from
+    ref_windows. Their IDs are built from the normalized records; tx_pos remains the position in the CIGAR string.
+    """
+    n_exons = len(exons)
+    if n_exons == 0:
+        return mm
+    cigars = exons["cigar"].tolist()
+    op_chars, op, length, exon = tokenize_cigars(cigars)
+    tx_start = exons["tx_start_i"].to_numpy(np.int64)
+    alt_start = exons["alt_start_i"].to_numpy(np.int64)
+    alt_end = exons["alt_end_i"].to_numpy(np.int64)
+    plus = exons["alt_strand"].to_numpy() == 1
+
+    # Cursors before each op: the transcript is consumed by all ops but I, the genome by all ops but D, in the
+    # direction of the strand
+    tx_step = np.where(op == OP_I, 0, length)
+    chr_step = np.where(op == OP_D, 0, length)
+    tx_done = np.cumsum(tx_step) - tx_step
+    chr_done = np.cumsum(chr_step) - chr_step
+    first_op = np.searchsorted(exon, np.arange(n_exons))[exon]
+    tx_done -= tx_done[first_op]
+    chr_done -= chr_done[first_op]
+    op_plus = plus[exon]
+    tx_cursor = tx_start[exon] + tx_done
+    chr_cursor = np.where(op_plus, alt_start[exon] + chr_done, alt_end[exon] - chr_done)
+
+    tx_acs = exons["tx_ac"].tolist()
+    chr_acs = exons["alt_ac"].tolist()
+    methods = exons["alt_aln_method"].tolist()
+    unknown = np.flatnonzero(op == OP_OTHER)
+    if len(unknown):
+        k = unknown[0]
+        e = exon[k]
+        raise ValueError(
+            f"Unexpected CIGAR operation: {chr(op_chars[k])} for tx {tx_acs[e]}, chr {chr_acs[e]}, alt_aln_method {methods[e]}"
+        )
+
+    # Each run of adjacent mismatches and indels within an exon is one event, starting at its first op
+    non_match = np.flatnonzero(op != OP_MATCH)
+    if len(non_match) == 0:
+        return mm
+    run_start = np.ones(len(non_match), dtype=bool)
+    run_start[1:] = (non_match[1:] != non_match[:-1] + 1) | (
+        exon[non_match[1:]] != exon[non_match[:-1]]
+    )
+    runs = np.flatnonzero(run_start)
+    ev = non_match[runs]
+    ev_exon = exon[ev]
+    ev_plus = op_plus[ev]
+    tx0 = tx_cursor[ev]
+    chr0 = chr_cursor[ev]
+    tx1 = tx0 + np.add.reduceat(tx_step[non_match], runs)
+    chr1 = chr0 + np.where(ev_plus, 1, -1) * np.add.reduceat(chr_step[non_match], runs)
+    # Runs with an indel are anchored on the preceding genomic base
+    anchor = np.maximum.reduceat((op[non_match] != OP_X).astype(np.int64), runs)
+    pos = np.where(ev_plus, chr0, chr1) + (1 - anchor)
+
+    # Fetch the sequences of the exons with events once each, transcript first, as the per-exon engine does
+    with_events, w = np.unique(ev_exon, return_inverse=True)
+    tx_end = exons["tx_end_i"].to_numpy(np.int64)
+    tx_win = _Windows(
+        hdp,
+        [tx_acs[e] for e in with_events],
+        tx_start[with_events] - 1,
+        tx_end[with_events] + 1,
+    )
+    # Exons whose events are derived here rather than reused from the memo
+    derive = np.ones(len(with_events), dtype=bool)
+    lookup_events = getattr(hdp, "lookup_events", None)
+    if lookup_events is not None:
+        keys = []
+        for j, e in enumerate(with_events):
+            tx_seq = tx_win.get(j, tx_start[e], tx_end[e])
+            keys.append(
+                (
+                    chr_acs[e],
+                    int(alt_start[e]),
+                    int(alt_end[e]),
+                    bool(plus[e]),
+                    cigars[e],
+                    ref_windows is not None,
+                    hashlib.md5(tx_seq.encode()).digest(),
+                )
+                if tx_seq is not None
+                else None
+            )
+        cached, first = lookup_events(keys)
+        derive[:] = [
+            c is None and f == j for j, (c, f) in enumerate(zip(cached, first))
+        ]
+        keep = derive[w]
+        w, ev_plus, tx0, tx1, chr0, chr1, anchor, pos = (
+            a[keep] for a in (w, ev_plus, tx0, tx1, chr0, chr1, anchor, pos)
+        )
+    # Index of each exon's window in chr_win, which only holds those of the exons whose events are derived
+    cw = np.cumsum(derive) - 1
+    chr_win = _Windows(
+        hdp,
+        [chr_acs[e] for e in with_events[derive]],
+        alt_start[with_events[derive]] - 1,
+        alt_end[with_events[derive]],
+    )
+    ref = np.empty(len(w), dtype=object)
+    alt = np.empty(len(w), dtype=object)
+    p = np.flatnonzero(ev_plus)
+    m = np.flatnonzero(~ev_plus)
+    ref[p] = chr_win.slices(cw[w[p]], chr0[p] - anchor[p], chr1[p])
+    alt[p] = tx_win.slices(w[p], tx0[p], tx1[p])
+    ref[m] = chr_win.slices(cw[w[m]], chr1[m] - anchor[m], chr0[m])
+    alt[m] = tx_win.slices(w[m], tx0[m], tx1[m], rc=True)
+    # The anchor base is the genomic one in both REF and ALT
+    a = np.flatnonzero(anchor)
+    alt[a] = _str_array(r[:1] for r in ref[a]) + alt[a]
+
+    if ref_windows is not None:
+        for k in np.flatnonzero(anchor == 1):
+            e = with_events[w[k]]
+
+            def get_ref(start_i, end_i, w=cw[w[k]], ac=chr_acs[e]):
+                seq = chr_win.get(w, start_i, end_i)
+                return (
+                    seq if seq is not None else ref_windows.get_seq(ac, start_i, end_i)
+                )
+
+            pos[k], ref[k], alt[k] = left_normalize(
+                int(pos[k]), ref[k], alt[k], get_ref
+            )
+
+    if lookup_events is not None:
+        # Memoize the derived events of each exon as (POS, REF, ALT, offset of tx_pos in the exon), and gather the
+        # events of all exons in order
+        events = list(cached)
+        bounds = np.searchsorted(w, np.arange(len(with_events) + 1))
+        for j in np.flatnonzero(derive):
+            sl = slice(bounds[j], bounds[j + 1])
+            events[j] = tuple(
+                zip(
+                    pos[sl].tolist(),
+                    ref[sl].tolist(),
+                    alt[sl].tolist(),
+                    (tx0[sl] - tx_start[with_events[j]]).tolist(),
+                )
+            )
+            hdp.store_events(keys[j], events[j])
+        events = [
+            evs if evs is not None else events[f] for evs, f in zip(events, first)
+        ]
+        w = np.repeat(np.arange(len(with_events)), [len(evs) for evs in events])
+        flat = [ev for evs in events for ev in evs]
+        pos = np.array([ev[0] for ev in flat], dtype=np.int64)
+        ref = np.array([ev[1] for ev in flat], dtype=object)
+        alt = np.array([ev[2] for ev in flat], dtype=object)
+        tx0 = tx_start[with_events[w]] + [ev[3] for ev in flat]
+        ev_exon = with_events[w]
+
+    # INFO fields, as typed columns, and IDs built from per-exon parts
+    ev_with = with_events[w]
+    exon_cols = {
+        c: exons[c].to_numpy()[ev_with].tolist()
+        for c in [
+            "cigar",
+            "ord",
+            "tx_exon_id",
+            "alt_exon_id",
+            "tx_start_i",
+            "tx_end_i",
+            "alt_start_i",
+            "alt_end_i",
+            "alt_strand",
+        ]
+    }
+    ev_tx = np.array(tx_acs, dtype=object)[ev_with]
+    ev_chr = np.array(chr_acs, dtype=object)[ev_with]
+    ev_method = np.array(methods, dtype=object)[ev_with]
+    pos_str = _str_array(pos.tolist())
+    vcf_id = ev_chr + "|" + pos_str + ref + ">" + alt + "|" + ev_tx + "|" + ev_method
+    ev_ids = np.asarray(ids, dtype=object)[ev_exon]
+    mm.extend_columns(
+        ev_ids.tolist(),
+        ev_chr.tolist(),
+        pos.tolist(),
+        vcf_id.tolist(),
+        ref.tolist(),
+        alt.tolist(),
+        [
+            ev_tx.tolist(),
+            exon_cols["cigar"],
+            ev_method.tolist(),
+            exon_cols["ord"],
+            exon_cols["tx_exon_id"],
+            exon_cols["alt_exon_id"],
+            exon_cols["tx_start_i"],
+            exon_cols["tx_end_i"],
+            tx0.tolist(),
+            exon_cols["alt_start_i"],
+            exon_cols["alt_end_i"],
+            exon_cols["alt_strand"],
+        ],
+    )
+    return mm
@@ -0,0 +1,126 @@
+import random
+
+import pandas as pd
+import pytest
+
+from cigar_batch import EventMemoUTA, cigar_batch_to_records, tokenize_cigars
+from cigar_reference import uta_cigar_to_mismatch_records
+from find_mismatch_positions import MismatchBuffer, uta_get_tx_exons_df
+from normalize import ReferenceWindows
+from synthetic_uta import SyntheticUTA
+from uta_cigar_to_vcf_synthetic_test import CIGARS
+
+
+def random_cigar(rng):
+    ops = []
+    for _ in range(rng.randint(1, 12)):
+        op = rng.choice("====MXXXID")
+        ops.append(f"{rng.randint(1, 30 if op in '=M' else 4)}{op}")
+    return "".join(ops)
+
+
+def reference_records(hdp, ids, exons):
+    mm = MismatchBuffer()
+    for id, (_, row) in zip(ids, exons.iterrows()):
+        uta_cigar_to_mismatch_records(hdp, id, row, mm)
+    return mm.to_df()
+
+
+def test_tokenize_cigars():
+    op_chars, op, length, cigar_i = tokenize_cigars(["10=1X", "", "123=4I"])
+    assert bytes(op_chars) == b"=X=I"
+    assert list(length) == [10, 1, 123, 4]
+    assert list(cigar_i) == [0, 0, 2, 2]
+    for bad in ["10", "=10=", "10=X", "10=1x"]:
+        with pytest.raises(ValueError):
+            tokenize_cigars(["5=", bad])
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("flank_len", [0, 100])
+def test_batch_matches_per_exon_engine(seed, flank_len):
+    rng = random.Random(seed)
+    hdp = SyntheticUTA(seed)
+    ids = []
+    exons = []
+    for t in range(8):
+        cigars = [random_cigar(rng) for _ in range(rng.randint(1, 4))]
+        if t == 0:
+            cigars += CIGARS
+        alt_strand = rng.choice([1, -1])
+        hdp.add_transcript(
+            f"NM_{t}.1", f"NC_{t % 2}.1", cigars, alt_strand, flank_len=flank_len
+        )
+        exdf = uta_get_tx_exons_df(hdp, f"NM_{t}.1", f"NC_{t % 2}.1", "splign")
+        exons.append(exdf)
+        ids += [f"G{t}"] * len(exdf)
+    exons = pd.concat(exons, ignore_index=True)
+
+    hdp.get_seq_calls = 0
+    expected = reference_records(hdp, ids, exons)
+    reference_calls = hdp.get_seq_calls
+    hdp.get_seq_calls = 0
+    result = cigar_batch_to_records(hdp, ids, exons, MismatchBuffer()).to_df()
+    assert result.to_csv(sep="\t") == expected.to_csv(sep="\t")
+    assert (result.index == expected.index).all()
+    # One fetch per sequence of each exon with events, plus the same out-of-window fetches
+    assert hdp.get_seq_calls == reference_calls
+
+
+def test_merged_runs():
+    hdp = SyntheticUTA()
+    hdp.add_transcript("NM_1.1", "NC_1.1", ["10=2I1X10=1X5=", "5=1D1I5="], -1)
+    exons = uta_get_tx_exons_df(hdp, "NM_1.1", "NC_1.1", "splign")
+    result = cigar_batch_to_records(hdp, ["A"] * 2, exons, MismatchBuffer()).to_df()
+    assert result.to_csv() == reference_records(hdp, ["A"] * 2, exons).to_csv()
+    assert len(result) == 3
+
+    # Unknown ops are reported wherever they are
+    hdp.add_transcript("NM_2.1", "NC_1.1", ["5=1D2N5="])
+    exons = uta_get_tx_exons_df(hdp, "NM_2.1", "NC_1.1", "splign")
+    with pytest.raises(ValueError, match="Unexpected CIGAR operation: N"):
+        cigar_batch_to_records(hdp, ["A"], exons, MismatchBuffer())
+
+
+@pytest.mark.parametrize("normalize", [False, True])
+def test_event_memo(normalize):
+    hdp = SyntheticUTA()
+    hdp.add_transcript("NM_1.1", "NC_1.1", ["10=2I1X10=1X5=", "5=1D1I5=", "20="], -1)
+    hdp.add_transcript("NM_2.1", "NC_1.1", CIGARS[:3])
+    # NM_1.2 is an identical new version of NM_1.1, NM_1.3 one with a different sequence
+    hdp._seqs["NM_1.2"] = hdp.get_seq("NM_1.1")
+    hdp._seqs["NM_1.3"] = hdp.get_seq("NM_1.1").translate(str.maketrans("AC", "CA"))
+    exdf = uta_get_tx_exons_df(hdp, "NM_1.1", "NC_1.1", "splign")
+    exons = pd.concat(
+        [
+            exdf,
+            exdf.assign(alt_aln_method="blat"),
+            uta_get_tx_exons_df(hdp, "NM_2.1", "NC_1.1", "splign"),
+            exdf.assign(tx_ac="NM_1.2"),
+            exdf.assign(tx_ac="NM_1.3"),
+        ],
+        ignore_index=True,
+    )
+    ids = [f"G{i}" for i in range(len(exons))]
+
+    def records(hdp):
+        ref_windows = ReferenceWindows(hdp) if normalize else None
+        mm = cigar_batch_to_records(hdp, ids, exons, MismatchBuffer(), ref_windows)
+        return mm.to_df().to_csv(sep="\t")
+
+    expected = records(hdp)
+    memo = EventMemoUTA(hdp)
+    hdp.get_seq_calls = 0
+    assert records(memo) == expected
+    # NM_1.1's two exons with events are derived once for splign, blat and NM_1.2, and again for NM_1.3
+    assert memo.stats == {"cache_hits.exon_events": 4, "cache_misses.exon_events": 7}
+    # One transcript sequence fetch per exon with events, one genomic one per derived exon
+    assert hdp.get_seq_calls == 11 + 7
+
+    assert records(memo) == expected
+    assert memo.stats["cache_hits.exon_events"] == 4 + 11
+
+    memo = EventMemoUTA(hdp, max_exons=2)
+    assert records(memo) == expected
+    assert records(memo) == expected
+    assert len(memo._events) == 2
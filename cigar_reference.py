@@ -0,0 +1,140 @@
+"""
+Per-exon reference implementation of cigar_batch.cigar_batch_to_records(), which the scans use: walks the CIGAR
+string of one exon op by op, slicing REF/ALT from sequence windows fetched once per exon. Kept for the tests and
+benchmarks that check the batch engine against it.
+"""
+
+from itertools import groupby
+import re
+
+from cigar_batch import reverse_complement
+
+
+class SeqWindow:
+    """
+    An interval of a sequence fetched once with hdp.get_seq() and sliced locally. Slices that fall outside of the
+    fetched interval are passed through to hdp.get_seq(), so results are always identical to calling it directly.
+    """
+
+    def __init__(self, hdp, ac, start_i, end_i):
+        self.hdp = hdp
+        self.ac = ac
+        self.start_i = max(start_i, 0)
+        self.end_i = end_i
+        self.seq = hdp.get_seq(ac, self.start_i, end_i)
+        self._seq_rc = None
+
+    def _contains(self, start_i, end_i):
+        return self.start_i <= start_i <= end_i <= self.end_i
+
+    def get_seq(self, start_i, end_i):
+        if not self._contains(start_i, end_i):
+            return self.hdp.get_seq(self.ac, start_i, end_i)
+        return self.seq[start_i - self.start_i : end_i - self.start_i]
+
+    def get_seq_rc(self, start_i, end_i):
+        """
+        Reverse complement of get_seq(start_i, end_i). The whole interval is reverse-complemented once, on first use.
+        """
+        if not self._contains(start_i, end_i):
+            return reverse_complement(self.hdp.get_seq(self.ac, start_i, end_i))
+        if self._seq_rc is None:
+            self._seq_rc = reverse_complement(self.seq)
+        # get_seq() truncates at the end of the sequence, which may be shorter than the requested interval
+        n = len(self.seq)
+        return self._seq_rc[
+            n - min(end_i - self.start_i, n) : n - min(start_i - self.start_i, n)
+        ]
+
+
+def uta_cigar_to_mismatch_records(hdp, id, row, mm):
+    """
+    Derive VCF records for every mismatch/indel in an exon's CIGAR string and append them to MismatchBuffer mm, which is returned.
+    """
+    # Get all match groups
+    alngrps = [
+        {
+            "cigar_str_start": m.start(),
+            "cigar_str_end": m.end(),
+            "cigar_len": m.group(1),
+            "cigar_op": m.group(2),
+        }
+        for m in re.finditer(r"([0-9]+)([A-Z=])", row["cigar"])
+    ]
+    tx_ac = row["tx_ac"]
+    chr_ac = row["alt_ac"]
+    alt_aln_method = row["alt_aln_method"]
+    tx_cursor_i = row["tx_start_i"]
+    chr_cursor_i = row["alt_start_i"] if row["alt_strand"] == 1 else row["alt_end_i"]
+    tx_seq = chr_seq = None
+    # Iterate through runs of alignment groups: matches only advance the cursors, while a run of adjacent
+    # mismatches and indels becomes a single record (a delins if it has more than one op)
+    for is_match, run in groupby(alngrps, key=lambda m: m["cigar_op"] in ("=", "M")):
+        run = list(run)
+        if is_match:
+            n = sum(int(m["cigar_len"]) for m in run)
+            tx_cursor_i += n
+            chr_cursor_i += n if row["alt_strand"] == 1 else -n
+            continue
+        tx_len = chr_len = 0
+        indel = False
+        for m in run:
+            if m["cigar_op"] == "X":
+                tx_len += int(m["cigar_len"])
+                chr_len += int(m["cigar_len"])
+            elif m["cigar_op"] == "I":
+                chr_len += int(m["cigar_len"])
+                indel = True
+            elif m["cigar_op"] == "D":
+                tx_len += int(m["cigar_len"])
+                indel = True
+            else:
+                raise ValueError(
+                    f"Unexpected CIGAR operation: {m['cigar_op']} for tx {tx_ac}, chr {chr_ac}, alt_aln_method {alt_aln_method}"
+                )
+        tx_cursor_i_new = tx_cursor_i + tx_len
+        chr_cursor_i_new = chr_cursor_i + (
+            chr_len if row["alt_strand"] == 1 else -chr_len
+        )
+        # Records with an indel are anchored on the preceding genomic base, in both REF and ALT
+        anchor = 1 if indel else 0
+        # Fetch the exon's transcript and genomic sequence once, on the first event, and slice it locally from then on
+        if tx_seq is None:
+            tx_seq = SeqWindow(hdp, tx_ac, row["tx_start_i"] - 1, row["tx_end_i"] + 1)
+            chr_seq = SeqWindow(hdp, chr_ac, row["alt_start_i"] - 1, row["alt_end_i"])
+        tx_pos = tx_cursor_i
+        if row["alt_strand"] == 1:
+            vcf_pos = chr_cursor_i + 1 - anchor
+            vcf_ref = chr_seq.get_seq(chr_cursor_i - anchor, chr_cursor_i_new)
+            vcf_alt = tx_seq.get_seq(tx_cursor_i, tx_cursor_i_new)
+        else:
+            vcf_pos = chr_cursor_i_new + 1 - anchor
+            vcf_ref = chr_seq.get_seq(chr_cursor_i_new - anchor, chr_cursor_i)
+            vcf_alt = tx_seq.get_seq_rc(tx_cursor_i, tx_cursor_i_new)
+        vcf_alt = vcf_ref[:anchor] + vcf_alt
+        mm.append(
+            id,
+            chr_ac,
+            vcf_pos,
+            f"{chr_ac}|{vcf_pos}{vcf_ref}>{vcf_alt}|{tx_ac}|{alt_aln_method}",
+            vcf_ref,
+            vcf_alt,
+            (
+                tx_ac,
+                row["cigar"],
+                alt_aln_method,
+                row["ord"],
+                row["tx_exon_id"],
+                row["alt_exon_id"],
+                row["tx_start_i"],
+                row["tx_end_i"],
+                tx_pos,
+                row["alt_start_i"],
+                row["alt_end_i"],
+                row["alt_strand"],
+            ),
+        )
+        # Advance the cursor for the next iteration
+        tx_cursor_i = tx_cursor_i_new
+        chr_cursor_i = chr_cursor_i_new
+    return mm
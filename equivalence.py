@@ -0,0 +1,148 @@
+"""
+Reuse of results across equivalent transcripts in find_mismatch_positions.py runs (--similar-tx).
+
+Two transcripts with the same sequence whose alignments to a chromosome have the same methods and fingerprints (see
+uta_provider.aln_fingerprint()), i.e. the same exon coordinates and CIGAR strings, have the same mismatches against
+it. Candidate pairs are looked up in bulk in UTA's tx_similarity_v, and the fingerprints of the run confirm them.
+Of the input rows of equivalent transcripts and the same chromosome, only the first is scanned. Its records are
+copied to the others with their own transcript accession, record IDs and UTA exon ids.
+"""
+
+from incremental import row_alignments
+from uta_provider import uta_bulk_similar_transcripts, uta_bulk_tx_exons
+
+SIMILAR_COLUMNS = ["tx_ac1", "tx_ac2"]
+EXON_ID_COLUMNS = [
+    "tx_ac",
+    "#CHROM",
+    "alt_aln_method",
+    "uta_tx_exon_ord",
+    "uta_tx_exon_id",
+    "uta_alt_exon_id",
+]
+
+
+def fetch_similar_transcripts(hdp, tx_acs, chunk_size=1000):
+    """
+    Get the pairs of transcripts of tx_acs with the same exon structure and sequence from UTA as a DataFrame,
+    chunk_size transcripts per query.
+    """
+    import pandas as pd
+
+    tx_acs = sorted(set(tx_acs))
+    rows = []
+    for i in range(0, len(tx_acs), chunk_size):
+        rows.extend(
+            list(r)
+            for r in uta_bulk_similar_transcripts(
+                hdp, tx_acs[i : i + chunk_size], tx_acs
+            )
+        )
+    return pd.DataFrame(rows, columns=SIMILAR_COLUMNS)
+
+
+def plan_equivalents(txlist, fingerprints, similar):
+    """
+    Find the rows of txlist whose results can be copied from an earlier row: one of a transcript in the same class
+    of similar transcripts (joining the pairs of DataFrame similar transitively) with the same chr_ac, whose
+    alignments to it have the same methods and fingerprints (from DataFrame fingerprints). Rows of the same
+    transcript and chr_ac are equivalent too.
+
+    Returns, for each row of txlist, the position of the row to copy from, or -1 if the row has to be scanned.
+    """
+    import numpy as np
+
+    parent = {}
+
+    def find(tx_ac):
+        root = tx_ac
+        while parent.get(root, root) != root:
+            root = parent[root]
+        parent[tx_ac] = root
+        return root
+
+    for tx_ac1, tx_ac2 in similar[SIMILAR_COLUMNS].itertuples(index=False):
+        root1, root2 = find(tx_ac1), find(tx_ac2)
+        if root1 != root2:
+            parent[max(root1, root2)] = min(root1, root2)
+
+    alignments = row_alignments(fingerprints)
+    first = {}
+    representative = np.full(len(txlist), -1)
+    for i, (tx_ac, chr_ac) in enumerate(
+        txlist[["tx_ac", "chr_ac"]].itertuples(index=False)
+    ):
+        key = (find(tx_ac), chr_ac, frozenset(alignments.get((tx_ac, chr_ac), ())))
+        j = first.setdefault(key, i)
+        if j != i:
+            representative[i] = j
+    return representative
+
+
+def fetch_exon_ids(hdp, tx_alt_acs, chunk_size=1000):
+    """
+    Get the UTA exon ids of the non-perfect exons of all alignments of the (tx_ac, alt_ac) pairs tx_alt_acs, as a
+    DataFrame with EXON_ID_COLUMNS, chunk_size pairs per query.
+    """
+    import pandas as pd
+
+    tx_alt_acs = sorted(set(tx_alt_acs))
+    rows = []
+    for i in range(0, len(tx_alt_acs), chunk_size):
+        rows.extend(
+            [
+                r["tx_ac"],
+                r["alt_ac"],
+                r["alt_aln_method"],
+                r["ord"],
+                r["tx_exon_id"],
+                r["alt_exon_id"],
+            ]
+            for r in uta_bulk_tx_exons(
+                hdp, tx_alt_acs[i : i + chunk_size], nonperfect_only=True
+            )
+        )
+    return pd.DataFrame(rows, columns=EXON_ID_COLUMNS)
+
+
+def copy_records(records, txlist, representative, exon_ids):
+    """
+    Copy the records of the rows that others are equivalent to, given as a DataFrame of MismatchBuffer columns
+    indexed by row id, to the rows of txlist with a representative (see plan_equivalents()). The copies get the
+    row's id, transcript accession and the exon ids of its alignments, from DataFrame exon_ids (see
+    fetch_exon_ids()). Returns them as a DataFrame of the same columns, in txlist order.
+    """
+    import numpy as np
+    import pandas as pd
+
+    members = np.flatnonzero(representative >= 0)
+    pairs = pd.DataFrame(
+        {
+            "member": txlist.index[members],
+            "member_tx_ac": txlist["tx_ac"].to_numpy()[members],
+            "rep": txlist.index[representative[members]],
+        }
+    )
+    copies = pairs.merge(
+        records.rename_axis("rep").reset_index(), on="rep", how="inner", sort=False
+    )
+    copies["tx_ac"] = copies["member_tx_ac"]
+    copies = copies.drop(columns=["uta_tx_exon_id", "uta_alt_exon_id"]).merge(
+        exon_ids,
+        on=["tx_ac", "#CHROM", "alt_aln_method", "uta_tx_exon_ord"],
+        how="left",
+        sort=False,
+    )
+    copies["ID"] = (
+        copies["#CHROM"]
+        + "|"
+        + copies["POS"].astype(str)
+        + copies["REF"]
+        + ">"
+        + copies["ALT"]
+        + "|"
+        + copies["tx_ac"]
+        + "|"
+        + copies["alt_aln_method"]
+    )
+    return copies.set_index("member").rename_axis(None)[records.columns]
@@ -0,0 +1,99 @@
+import pandas as pd
+
+import find_mismatch_positions
+from equivalence import fetch_similar_transcripts, plan_equivalents
+from find_mismatch_positions import main
+from find_mismatch_positions_test import synthetic_hdp, synthetic_txlist
+from incremental import FINGERPRINT_COLUMNS
+from incremental_test import read_output
+
+
+def equivalent_hdp():
+    hdp = synthetic_hdp()
+    hdp.add_equivalent_transcript("NM_1.2", "NM_1.1")
+    hdp.add_equivalent_transcript("NM_5.2", "NM_5.1")
+    hdp.add_equivalent_transcript("NM_5.3", "NM_5.2")
+    # Similar exon structure, but a different sequence
+    hdp.add_similar_transcripts("NM_2.1", "NM_3.1")
+    return hdp
+
+
+def equivalent_txlist():
+    txlist = synthetic_txlist()
+    extra = pd.DataFrame(
+        [
+            ("G10|NM_5.3|NC_1.1", "NM_5.3", "NC_1.1"),
+            ("G11|NM_1.2|NC_1.1", "NM_1.2", "NC_1.1"),
+            ("G12|NM_1.2|NC_2.1", "NM_1.2", "NC_2.1"),
+            ("G13|NM_5.2|NC_1.1", "NM_5.2", "NC_1.1"),
+            ("G14|NM_3.1|NC_2.1", "NM_3.1", "NC_2.1"),
+        ],
+        columns=["id", "tx_ac", "chr_ac"],
+    ).set_index("id")
+    return pd.concat([txlist, extra])
+
+
+def test_fetch_similar_transcripts():
+    similar = fetch_similar_transcripts(
+        equivalent_hdp(), ["NM_1.1", "NM_1.2", "NM_2.1", "NM_3.1", "NM_5.2"], 2
+    )
+    assert similar.values.tolist() == [["NM_1.1", "NM_1.2"], ["NM_1.2", "NM_1.1"]]
+
+
+def test_plan_equivalents():
+    txlist = pd.DataFrame(
+        [("A", "NC_1"), ("B", "NC_1"), ("C", "NC_1"), ("B", "NC_2"), ("D", "NC_1")],
+        columns=["tx_ac", "chr_ac"],
+    )
+    fingerprints = pd.DataFrame(
+        [
+            ("A", "NC_1", "splign", "f1", 3),
+            ("B", "NC_1", "splign", "f1", 3),
+            ("C", "NC_1", "splign", "f1", 3),
+            ("C", "NC_1", "blat", "f2", 3),
+            ("D", "NC_1", "splign", "f1", 3),
+        ],
+        columns=FINGERPRINT_COLUMNS,
+    )
+    similar = pd.DataFrame(
+        [("B", "A"), ("C", "A"), ("D", "B")], columns=["tx_ac1", "tx_ac2"]
+    )
+    # C has another alignment, B no alignment to NC_2; D is similar to A through B
+    assert plan_equivalents(txlist, fingerprints, similar).tolist() == [
+        -1,
+        0,
+        -1,
+        -1,
+        0,
+    ]
+
+
+def test_similar_tx_run(tmp_path, monkeypatch):
+    for d in ["full", "similar"]:
+        (tmp_path / d).mkdir()
+        equivalent_txlist().to_csv(tmp_path / d / "txlist.tsv", sep="\t")
+    monkeypatch.setattr(
+        find_mismatch_positions, "make_hdp", lambda args: equivalent_hdp()
+    )
+    monkeypatch.chdir(tmp_path / "full")
+    main(["txlist.tsv"])
+
+    monkeypatch.chdir(tmp_path / "similar")
+    scan_transcript = find_mismatch_positions.scan_transcript
+    scanned = []
+    monkeypatch.setattr(
+        find_mismatch_positions,
+        "scan_transcript",
+        lambda hdp, id, *args: scanned.append(id) or scan_transcript(hdp, id, *args),
+    )
+    main(["--similar-tx", "txlist.tsv"])
+    assert scanned == [
+        "G0|NM_1.1|NC_1.1",
+        "G1|NM_2.1|NC_1.1",
+        "G2|NM_3.1|NC_2.1",
+        "G3|NM_4.1|NC_2.1",
+        "G4|NM_5.1|NC_1.1",
+        "G9|NM_1.1|NC_2.1",
+    ]
+    for f in ["mismatches.tsv", "mismatches.vcf"]:
+        assert read_output(f"txlist.{f}") == read_output(f"../full/txlist.{f}")
@@ -1,19 +1,125 @@
 import argparse as ap
+from collections import Counter, deque
+from contextlib import ExitStack, nullcontext
+from functools import partial
+from itertools import groupby
+import logging
+import os
 from pathlib import Path
-
-import pandas as pd
+import sys
+import time
 
 import re
 
-from Bio.Seq import Seq
+from uta_provider import (
+    DeferredUTA,
+    UTABatchPrefetch,
+    UTAMismatchProvider,
+    check_tx_exons,
+    provider_stats,
+)
+from seq_providers import LocalSeqUTA, open_seq_sources
+from uta_cache import CachedUTA, SQLiteCache, format_cache_stats
+from uta_snapshot import RecordingUTA, SnapshotUTA
+from sharding import (
+    assign_shards,
+    merge_shards,
+    parse_shard,
+    row_weights,
+    shard_name,
+    write_manifest,
+)
+from assemblies import (
+    RecentTxUTA,
+    assembly_chr_acs,
+    expand_assemblies,
+    split_assemblies,
+    split_records,
+)
+from checkpoint import Checkpoint
+from normalize import ReferenceWindows
+from equivalence import (
+    copy_records,
+    fetch_exon_ids,
+    fetch_similar_transcripts,
+    plan_equivalents,
+)
+from incremental import (
+    fetch_fingerprints,
+    plan_rescan,
+    previous_records,
+    read_fingerprints,
+    write_fingerprints,
+)
+from vcf_writer import INFO_KEYS, SortedVCFWriter, format_info, parse_info
+from instrumentation import (
+    InstrumentedUTA,
+    Progress,
+    configure_logging,
+    record_stage,
+    stage,
+    stats_report,
+    write_stats_report,
+)
+
+log = logging.getLogger("find_mismatch_positions")
+
+# Options shared by the scan and its subcommands
+logging_parser = ap.ArgumentParser(add_help=False)
+logging_parser.add_argument(
+    "--log-format",
+    choices=["plain", "json"],
+    default="plain",
+    help="Log messages as plain lines (default) or as JSON objects, one per line, with structured fields.",
+)
 
-import hgvs.parser
-import hgvs.assemblymapper
-import hgvs.dataproviders.uta
-import hgvs.exceptions
+# Options selecting where UTA data and sequences come from, shared by the scan and export-snapshot
+source_parser = ap.ArgumentParser(add_help=False)
+source_parser.add_argument(
+    "--cache",
+    type=str,
+    help="SQLite file to cache UTA query results and sequences in across runs. Entries are keyed by UTA schema, so a second run against the same UTA release doesn't query the database again.",
+)
+source_parser.add_argument(
+    "--cache-max-mb",
+    type=int,
+    default=2048,
+    help="Size cap of the --cache file in MB; least recently used entries are evicted beyond it (default: 2048).",
+)
+source_parser.add_argument(
+    "--uta-schema",
+    type=str,
+    help="UTA schema (release, e.g. uta_20210129b) to key --cache entries by (default: the schema of the UTA URL, from UTA_DB_URL or the hgvs configuration).",
+)
+source_parser.add_argument(
+    "--fasta",
+    type=str,
+    action="append",
+    default=[],
+    help="faidx-indexed FASTA file (plain or bgzip-compressed) to read genome or transcript sequences from instead of the hgvs sequence source. May be given multiple times.",
+)
+source_parser.add_argument(
+    "--seqrepo-dir",
+    type=str,
+    action="append",
+    default=[],
+    help="Local seqrepo directory to read sequences from instead of the hgvs sequence source. May be given multiple times; searched after any --fasta files.",
+)
+source_parser.add_argument(
+    "--local-seq-only",
+    action="store_true",
+    help="Fail instead of falling back to the hgvs sequence source when a sequence is not found in the --fasta/--seqrepo-dir sources.",
+)
+source_parser.add_argument(
+    "--snapshot",
+    type=str,
+    help="Snapshot file written by export-snapshot to read all UTA data and sequences from, instead of connecting to UTA.",
+)
 
 parser = ap.ArgumentParser(
-    description="Check all positions in a given transcript for genome-transcript discrepancies."
+    description="Check all positions in a given transcript for genome-transcript discrepancies.",
+    epilog="Run '%(prog)s export-snapshot -h' for writing a snapshot of the UTA data and sequences an input needs, '%(prog)s scan-all -h' for scanning all alignments to given contigs, and '%(prog)s merge -h' for combining the outputs of a run with --shard.",
+    parents=[source_parser, logging_parser],
 )
 parser.add_argument(
     "infile",
@@ -21,6 +127,175 @@ parser.add_argument(
     nargs=1,
     help="TSV file of genes and reference transcripts to analyze. First 3 columns must be: [id string] [transcript acc] [chr acc] ...",
 )
+parser.add_argument(
+    "--bgzip",
+    action="store_true",
+    help="Write the mismatches bgzip-compressed and tabix-indexed (.mismatches.vcf.gz and .tbi) instead of as plain VCF.",
+)
+parser.add_argument(
+    "--parquet",
+    action="store_true",
+    help="Also write the mismatches as a Parquet dataset with typed columns, partitioned by contig (<infile stem>.mismatches.parquet/alt_ac=<contig>/). Requires pyarrow.",
+)
+parser.add_argument(
+    "--normalize",
+    action="store_true",
+    help="Left-align and trim indel records, as bcftools norm would. Runs resumed with --resume or reusing the results of a --previous-run must use the same setting.",
+)
+parser.add_argument(
+    "--event-memo",
+    type=int,
+    default=100000,
+    help="Number of exons whose derived mismatch records are kept in memory, to reuse them for every transcript and alignment method with the identical genomic exon, CIGAR string and sequence. 0 disables this.",
+)
+parser.add_argument(
+    "--stats",
+    action="store_true",
+    help="Time the UTA queries, sequence fetches and scan stages and write a report of call counts, wall time histograms, bytes of sequence fetched and the slowest transcripts to <infile stem>.stats.json.",
+)
+parser.add_argument(
+    "--progress",
+    type=float,
+    default=0,
+    metavar="SECONDS",
+    help="Log the number of rows scanned, rows/sec and estimated time left every SECONDS seconds. 0 (default) disables.",
+)
+parser.add_argument(
+    "--previous-run",
+    type=str,
+    help="Output prefix (path and infile stem, e.g. runs/2021/mane_grch38_txlist) of a previous run, e.g. against an older UTA release. Only rows whose alignments were added, removed or changed since then are scanned; the results of the others are reused. Changes are reported in <infile stem>.changes.tsv. The previous run must have been run with --write-fingerprints.",
+)
+parser.add_argument(
+    "--write-fingerprints",
+    action="store_true",
+    help="Write the fingerprints of the alignments of the input transcripts to <infile stem>.fingerprints.tsv, so that the run can be the --previous-run of later incremental runs. Takes an extra query over the alignments of all input transcripts.",
+)
+parser.add_argument(
+    "--similar-tx",
+    action="store_true",
+    help="Only scan the first of the input rows of transcripts with the same sequence and alignments to the same chromosome (looked up in UTA's tx_similarity_v), and copy its results to the others. Runs resumed with --resume must use the same setting.",
+)
+parser.add_argument(
+    "--assembly",
+    type=str,
+    action="append",
+    dest="assemblies",
+    help="Scan every input row against the chromosome of the same name in this assembly (e.g. GRCh38). May be given multiple times to scan against several assemblies in a single pass, fetching each transcript's data once for all of them. Results are written per assembly, to <infile stem>.<assembly>.mismatches.* files. Can't be combined with --previous-run.",
+)
+parser.add_argument(
+    "--shard",
+    type=parse_shard,
+    metavar="I/N",
+    help="Only scan the I-th of N shards (1 <= I <= N) of the input, for spreading a run over N nodes. All shards assign rows to shards the same way, keeping the rows of a transcript together and balancing their exon counts. Outputs are named <infile stem>.shard-I-of-N.* and combined with the merge subcommand.",
+)
+parser.add_argument(
+    "--resume",
+    action="store_true",
+    help="Resume an interrupted run from its checkpoint (<infile stem>.checkpoint.jsonl), skipping the rows it had finished.",
+)
+parser.add_argument(
+    "--checkpoint-interval",
+    type=float,
+    default=30,
+    help="Seconds between fsyncs of the checkpoint of finished rows (default: 30). The checkpoint is removed when the run completes.",
+)
+parser.add_argument(
+    "--batch-size",
+    type=int,
+    default=0,
+    help="Prefetch mapping options and exon alignments for this many input rows at a time with set-based UTA queries, instead of querying once per transcript. 0 (default) disables prefetching.",
+)
+parser.add_argument(
+    "--workers",
+    type=int,
+    default=1,
+    help="Number of worker processes to scan the input with. Each worker opens its own UTA connection and sequence sources and processes shards of --batch-size (default 100) rows; results are merged in input order.",
+)
+parser.add_argument(
+    "--async-queries",
+    type=int,
+    default=0,
+    help="Scan the input in a single process with up to this many transcripts' UTA and sequence queries in flight at once, each over its own connection. 0 (default) disables.",
+)
+
+export_parser = ap.ArgumentParser(
+    prog=f"{Path(sys.argv[0]).name} export-snapshot",
+    description="Write the UTA data and sequences needed to analyze an input file to a snapshot file, for runs with --snapshot where there is no database access.",
+    parents=[source_parser, logging_parser],
+)
+export_parser.add_argument(
+    "infile",
+    type=str,
+    nargs=1,
+    help="TSV file of genes and reference transcripts, as for the scan.",
+)
+export_parser.add_argument(
+    "outfile", type=str, nargs=1, help="Snapshot file to write (gzip-compressed)."
+)
+
+scan_all_parser = ap.ArgumentParser(
+    prog=f"{Path(sys.argv[0]).name} scan-all",
+    description="Check every alignment in UTA to the given contigs for genome-transcript discrepancies, streaming the non-perfect exons from the database instead of reading an input file.",
+    parents=[source_parser, logging_parser],
+)
+scan_all_parser.add_argument(
+    "--alt-ac",
+    type=str,
+    action="append",
+    required=True,
+    help="Contig accession (e.g. NC_000001.11) whose alignments to scan. May be given multiple times.",
+)
+scan_all_parser.add_argument(
+    "--alt-aln-method",
+    type=str,
+    action="append",
+    help="Alignment method to scan (default: splign). May be given multiple times.",
+)
+scan_all_parser.add_argument(
+    "--out-prefix",
+    type=str,
+    default="uta_alignments",
+    help="Write the mismatches to <out-prefix>.mismatches.vcf (default: uta_alignments).",
+)
+scan_all_parser.add_argument(
+    "--bgzip",
+    action="store_true",
+    help="Write the mismatches bgzip-compressed and tabix-indexed (.mismatches.vcf.gz and .tbi) instead of as plain VCF.",
+)
+scan_all_parser.add_argument(
+    "--normalize",
+    action="store_true",
+    help="Left-align and trim indel records, as bcftools norm would.",
+)
+scan_all_parser.add_argument(
+    "--event-memo",
+    type=int,
+    default=100000,
+    help="Number of exons whose derived mismatch records are kept in memory, to reuse them for every transcript and alignment method with the identical genomic exon, CIGAR string and sequence. 0 disables this.",
+)
+scan_all_parser.add_argument(
+    "--parquet",
+    action="store_true",
+    help="Also write the mismatches as a Parquet dataset with typed columns, partitioned by contig (<out-prefix>.mismatches.parquet/alt_ac=<contig>/). Requires pyarrow.",
+)
+
+merge_parser = ap.ArgumentParser(
+    prog=f"{Path(sys.argv[0]).name} merge",
+    description="Combine the outputs of all shards of a run with --shard into the outputs of a single run over the input (<infile stem>.mismatches.* and .fingerprints.tsv), streaming the shards' records.",
+    parents=[logging_parser],
+)
+merge_parser.add_argument(
+    "infile",
+    type=str,
+    nargs=1,
+    help="Input file the shards were run over.",
+)
+merge_parser.add_argument(
+    "--shard-dir",
+    type=str,
+    default=".",
+    help="Directory holding the shards' outputs and manifests (default: the current directory).",
+)
 
 
 def uta_tx_mapping_options_df(hdp, tx_ac):
@@ -42,6 +317,8 @@ def uta_tx_mapping_options_df(hdp, tx_ac):
     res = cur.fetchall()
 
     """
+    import pandas as pd
+
     mapopts = hdp.get_tx_mapping_options(tx_ac)
     return pd.DataFrame(mapopts, columns=["tx_ac", "alt_ac", "method"])
 
@@ -65,6 +342,8 @@ def uta_get_similar_tx_df(hdp, tx_ac):
     res = cur.fetchall()
 
     """
+    import pandas as pd
+
     similar_tx_res = hdp.get_similar_transcripts(tx_ac)
     return pd.DataFrame(
         similar_tx_res,
@@ -80,10 +359,36 @@ def uta_get_similar_tx_df(hdp, tx_ac):
     )
 
 
-def uta_get_tx_exons_df(hdp, tx_ac, alt_ac, alt_aln_method):
+# Column names of the DataFrames of tx_exon_aln_v rows
+TX_EXON_DF_COLUMNS = [
+    "gene",
+    "tx_ac",
+    "alt_ac",
+    "alt_aln_method",
+    "alt_strand",
+    "ord",
+    "tx_start_i",
+    "tx_end_i",
+    "alt_start_i",
+    "alt_end_i",
+    "cigar",
+    "unknown1",
+    "unknown2",
+    "tes_exon_set_id",
+    "aes_exon_set_id",
+    "tx_exon_id",
+    "alt_exon_id",
+    "unknown3",
+]
+
+
+def uta_get_tx_exons_df(hdp, tx_ac, alt_ac, alt_aln_method, nonperfect_only=False):
     """
     Get the exons for a transcript accession and alternate accession from UTA and return as a DataFrame.
 
+    If nonperfect_only is set, hdp must provide get_tx_nonperfect_exons() (see uta_provider.UTAMismatchProvider) and
+    exons whose CIGAR string is a single match run are filtered out by the database instead of being returned.
+
 
     If querying UTA directly, similar information would be retrieved as follows:
 
@@ -101,178 +406,580 @@ def uta_get_tx_exons_df(hdp, tx_ac, alt_ac, alt_aln_method):
     res = cur.fetchall()
 
     """
-    txex = hdp.get_tx_exons(tx_ac, alt_ac, alt_aln_method)
-    return pd.DataFrame(
-        txex,
-        columns=[
-            "gene",
-            "tx_ac",
-            "alt_ac",
-            "alt_aln_method",
-            "alt_strand",
-            "ord",
-            "tx_start_i",
-            "tx_end_i",
-            "alt_start_i",
-            "alt_end_i",
-            "cigar",
-            "unknown1",
-            "unknown2",
-            "tes_exon_set_id",
-            "aes_exon_set_id",
-            "tx_exon_id",
-            "alt_exon_id",
-            "unknown3",
-        ],
+    import pandas as pd
+
+    txex = (
+        hdp.get_tx_nonperfect_exons(tx_ac, alt_ac, alt_aln_method)
+        if nonperfect_only
+        else hdp.get_tx_exons(tx_ac, alt_ac, alt_aln_method)
     )
+    return pd.DataFrame(txex, columns=TX_EXON_DF_COLUMNS)
 
 
-def uta_cigar_to_mismatch_vcf(hdp, id, row):
-    # Initialize dataframe of detected mismatches
-    mm = pd.DataFrame(
-        columns=[
-            "#CHROM",
-            "POS",
-            "ID",
-            "REF",
-            "ALT",
-            "INFO",
-        ],
-    )
+MISMATCH_COLUMNS = [
+    "#CHROM",
+    "POS",
+    "ID",
+    "REF",
+    "ALT",
+    "INFO",
+]
+# Columns of a MismatchBuffer: the VCF columns, with INFO split into its fields
+BUFFER_COLUMNS = MISMATCH_COLUMNS[:-1] + INFO_KEYS
 
-    # Get all match groups
-    alngrps = [
-        {
-            "cigar_str_start": m.start(),
-            "cigar_str_end": m.end(),
-            "cigar_len": m.group(1),
-            "cigar_op": m.group(2),
-        }
-        for m in re.finditer(r"([0-9]+)([A-Z=])", row["cigar"])
-    ]
-    tx_ac = row["tx_ac"]
-    chr_ac = row["alt_ac"]
-    alt_aln_method = row["alt_aln_method"]
-    tx_cursor_i = row["tx_start_i"]
-    chr_cursor_i = row["alt_start_i"] if row["alt_strand"] == 1 else row["alt_end_i"]
-    # Iterate through the alignment groups. For each group:
-    contiguous_delins = False
-    for m in alngrps:
-        if m["cigar_op"] == "=" or m["cigar_op"] == "M":
-            contiguous_delins = False
-            tx_cursor_i += int(m["cigar_len"])
-            chr_cursor_i += (
-                int(m["cigar_len"])
-                if row["alt_strand"] == 1
-                else (-int(m["cigar_len"]))
+
+class MismatchBuffer:
+    """
+    Append-only, column-oriented collector of mismatch records. Records are appended to per-column lists
+    and only turned into a DataFrame (indexed by input row id) once, by to_df().
+
+    The INFO fields are kept as typed columns (keyed by vcf_writer.INFO_KEYS) rather than as INFO strings, which
+    are only rendered when the records are written out.
+    """
+
+    def __init__(self):
+        self.index = []
+        self.columns = {c: [] for c in BUFFER_COLUMNS}
+
+    def __len__(self):
+        return len(self.index)
+
+    def append(self, id, chrom, pos, vcf_id, ref, alt, info):
+        """
+        Append a record. info holds the values of the INFO fields, in vcf_writer.INFO_KEYS order.
+        """
+        self.index.append(id)
+        for c, value in zip(BUFFER_COLUMNS, (chrom, pos, vcf_id, ref, alt, *info)):
+            self.columns[c].append(value)
+
+    def extend_columns(self, ids, chroms, poss, vcf_ids, refs, alts, info):
+        """
+        Append many records at once, given as one list per column. info holds one list per INFO field, in
+        vcf_writer.INFO_KEYS order.
+        """
+        self.index.extend(ids)
+        for c, values in zip(
+            BUFFER_COLUMNS, [chroms, poss, vcf_ids, refs, alts, *info]
+        ):
+            self.columns[c].extend(values)
+
+    def extend(self, other):
+        self.index.extend(other.index)
+        for c in BUFFER_COLUMNS:
+            self.columns[c].extend(other.columns[c])
+
+    def to_df(self):
+        import pandas as pd
+
+        df = pd.DataFrame(
+            {c: self.columns[c] for c in MISMATCH_COLUMNS[:-1]}, index=self.index
+        )
+        df["INFO"] = format_info(self.columns)
+        return df
+
+
+class MismatchSummary:
+    """
+    Per input row summary of the mismatches found: the unique 0-based ordinals of the exons with mismatches and the
+    mismatch IDs, each as a ';'-delimited string. Built incrementally from MismatchBuffers with add(), so the
+    records themselves don't have to be kept.
+    """
+
+    def __init__(self):
+        self.exons = []
+        self.ids = {}
+
+    def add(self, mm):
+        # Unique (id, exon ordinal) pairs of each buffer, deduplicated across buffers by mismatch_exons()
+        import numpy as np
+        import pandas as pd
+
+        self.exons.append(
+            pd.DataFrame(
+                {
+                    "id": mm.index,
+                    "ord": np.asarray(mm.columns["uta_tx_exon_ord"], dtype=np.int64),
+                }
+            ).drop_duplicates()
+        )
+        for id, vcf_id in zip(mm.index, mm.columns["ID"]):
+            self.ids.setdefault(id, []).append(vcf_id)
+
+    def mismatch_exons(self):
+        import pandas as pd
+
+        if not self.exons:
+            return {}
+        exons = pd.concat(self.exons, ignore_index=True).drop_duplicates()
+        # Ordinals are sorted as strings, as they always have been
+        exons["ord"] = exons["ord"].astype(str)
+        return (
+            exons.sort_values("ord", kind="stable")
+            .groupby("id", sort=False)["ord"]
+            .agg(";".join)
+            .to_dict()
+        )
+
+    def mismatches(self):
+        return {id: ";".join(ids) for id, ids in self.ids.items()}
+
+
+def uta_cigar_to_mismatch_vcf(hdp, id, row, normalize=False):
+    """
+    Derive VCF records for every mismatch/indel in an exon's CIGAR string and return them as a DataFrame indexed by id.
+    If normalize is set, indels are left-aligned and trimmed (see normalize.left_normalize()).
+    """
+    from cigar_batch import cigar_batch_to_records
+
+    return cigar_batch_to_records(
+        hdp,
+        [id],
+        row.to_frame().T,
+        MismatchBuffer(),
+        ReferenceWindows(hdp) if normalize else None,
+    ).to_df()
+
+
+def connect_uta():
+    """
+    Connect to UTA with hgvs, which is only imported when a run needs the database.
+    """
+    import hgvs.dataproviders.uta
+
+    return hgvs.dataproviders.uta.connect()
+
+
+def uta_schema():
+    """
+    Get the schema of the UTA database connect_uta() connects to from its URL, without connecting.
+    """
+    import hgvs.dataproviders.uta
+
+    return hgvs.dataproviders.uta._get_uta_db_url().rstrip("/").rsplit("/", 1)[1]
+
+
+def make_hdp(args):
+    """
+    Set up the connection to UTA, which is opened on first use, or open the snapshot, and wrap the data provider
+    according to the command line arguments.
+    """
+    from cigar_batch import EventMemoUTA
+
+    if args.snapshot:
+        hdp = SnapshotUTA(args.snapshot)
+    else:
+        hdp = UTAMismatchProvider(DeferredUTA(connect_uta))
+    # Cache query results and sequences on disk, if requested. The schema is taken from the configuration rather than
+    # the database, so that a run whose answers are all cached doesn't connect
+    if args.cache:
+        schema = args.uta_schema or (
+            hdp.data_version() if args.snapshot else uta_schema()
+        )
+        hdp = CachedUTA(
+            hdp, SQLiteCache(args.cache, args.cache_max_mb * 1024**2), schema
+        )
+    # Serve sequences from local files, if any were given
+    if args.fasta or args.seqrepo_dir:
+        hdp = LocalSeqUTA(
+            hdp,
+            open_seq_sources(args.fasta, args.seqrepo_dir),
+            fallback=not args.local_seq_only,
+        )
+    # Keep the transcript data of the row just scanned for the next assemblies' rows of the transcript
+    if getattr(args, "assemblies", None):
+        hdp = RecentTxUTA(hdp)
+    # Derive the records of identical exon alignments once
+    if getattr(args, "event_memo", 0) > 0:
+        hdp = EventMemoUTA(hdp, args.event_memo)
+    # Time everything the scan asks of the data provider, if requested
+    if getattr(args, "stats", False):
+        hdp = InstrumentedUTA(hdp)
+    return hdp
+
+
+def scan_transcript(hdp, id, tx_ac, chr_ac, mm, ref_windows=None):
+    """
+    Find all genome-transcript discrepancies between transcript tx_ac and chromosome chr_ac, appending them
+    to MismatchBuffer mm under input row id. Returns whether UTA has an alignment of tx_ac to chr_ac.
+    If ref_windows (a normalize.ReferenceWindows) is given, indels are left-aligned and trimmed.
+    """
+    import pandas as pd
+
+    from cigar_batch import cigar_batch_to_records
+
+    log.info(
+        f"Now processing: {id}",
+        extra={"event": "processing", "id": id, "tx_ac": tx_ac, "alt_ac": chr_ac},
+    )
+    with stage(hdp, "transcript", id):
+        # Check to see if target transcript is in UTA
+        mapoptsdf = uta_tx_mapping_options_df(hdp, tx_ac)
+        # if not res:
+        if chr_ac not in mapoptsdf["alt_ac"].values:
+            return False
+        # Exons of all alignment methods, converted in one batch
+        nonperfect = []
+        for alt_aln_method in mapoptsdf[mapoptsdf["alt_ac"] == chr_ac]["method"]:
+            # Only exons with a non-perfect alignment are returned by the database
+            txexdf = uta_get_tx_exons_df(
+                hdp, tx_ac, chr_ac, alt_aln_method, nonperfect_only=True
             )
-            continue
-        else:
-            # If the previous iteration was a mismatch, skip processing the rest of the exon because the VCF will be incorrect
-            if contiguous_delins:
-                print(
-                    f"Can't derive VCF for exon {row["ord"]} (CIGAR {row['cigar']}) for tx {tx_ac}, chr {chr_ac}, alt_aln_method {alt_aln_method}"
+            # Get rows that don't have a perfect alignment according to CIGAR string
+            if txexdf.empty:
+                log.info(
+                    f"No exons found for tx {tx_ac}, chr {chr_ac}, alt_aln_method {alt_aln_method}",
+                    extra={
+                        "event": "no_exons",
+                        "tx_ac": tx_ac,
+                        "alt_ac": chr_ac,
+                        "alt_aln_method": alt_aln_method,
+                    },
                 )
-                break
-            if m["cigar_op"] == "X":
-                contiguous_delins = False
-                tx_cursor_i_new = tx_cursor_i + int(m["cigar_len"])
-                chr_cursor_i_new = chr_cursor_i + (
-                    int(m["cigar_len"])
-                    if row["alt_strand"] == 1
-                    else (-int(m["cigar_len"]))
+                continue
+            nonperfect.append(txexdf[~txexdf["cigar"].str.fullmatch("^[0-9]+=$")])
+        if nonperfect:
+            with stage(hdp, "concat"):
+                exons = pd.concat(nonperfect, ignore_index=True)
+            with stage(hdp, "cigar_to_records"):
+                cigar_batch_to_records(hdp, [id] * len(exons), exons, mm, ref_windows)
+        return True
+
+
+def scan_txlist(hdp, txlist, batch_size=0, sink=None, normalize=False):
+    """
+    Run scan_transcript() on every row of txlist, in order. If batch_size > 0, the UTA data for each batch of
+    batch_size rows is prefetched with set-based queries (see uta_provider.UTABatchPrefetch).
+
+    Returns a list of has_aln values, one per row of txlist, a MismatchBuffer of the detected mismatches and a
+    Counter of the stats (e.g. cache hits) the data provider collected during the scan. If sink is given, it is
+    called with the has_aln values and a MismatchBuffer of the mismatches of each row (as a list of one value)
+    instead, in input order, and the returned buffer is empty. If normalize is set, indels are left-aligned and
+    trimmed, with the reference beyond the exons cached in a normalize.ReferenceWindows.
+    """
+    stats_before = provider_stats(hdp)
+    ref_windows = ReferenceWindows(hdp) if normalize else None
+    has_aln = []
+    mm = MismatchBuffer()
+    step = batch_size if batch_size > 0 else max(len(txlist), 1)
+    for batch_start in range(0, len(txlist), step):
+        batch = txlist.iloc[batch_start : batch_start + step]
+        batch_hdp = hdp
+        if batch_size > 0:
+            with stage(hdp, "prefetch"):
+                batch_hdp = UTABatchPrefetch(
+                    hdp, batch["tx_ac"], batch["chr_ac"], nonperfect_only=True
                 )
-                tx_anchor_offset = 0
-                chr_anchor_offset = 0
-                chr_cursor_vcf_pos_3p_offset = 1
-            elif m["cigar_op"] == "I":
-                contiguous_delins = True
-                tx_cursor_i_new = tx_cursor_i
-                chr_cursor_i_new = chr_cursor_i + (
-                    int(m["cigar_len"])
-                    if row["alt_strand"] == 1
-                    else (-int(m["cigar_len"]))
+        for id, row in batch.iterrows():
+            row_mm = mm if sink is None else MismatchBuffer()
+            has_aln.append(
+                scan_transcript(
+                    batch_hdp, id, row["tx_ac"], row["chr_ac"], row_mm, ref_windows
                 )
-                tx_anchor_offset = 1
-                chr_anchor_offset = 1
-                chr_cursor_vcf_pos_3p_offset = 0
-            elif m["cigar_op"] == "D":
-                contiguous_delins = True
-                tx_cursor_i_new = tx_cursor_i + int(m["cigar_len"])
-                chr_cursor_i_new = chr_cursor_i
-                tx_anchor_offset = 1
-                chr_anchor_offset = 1
-                chr_cursor_vcf_pos_3p_offset = 0
+            )
+            if sink is not None:
+                sink(has_aln[-1:], row_mm)
+    return has_aln, mm, provider_stats(hdp) - stats_before
+
+
+# Data provider of each worker process in scan_txlist_parallel()
+_worker_hdp = None
+
+
+def _init_worker(hdp_factory, log_format):
+    global _worker_hdp
+    configure_logging(log_format)
+    _worker_hdp = hdp_factory()
+
+
+def _scan_shard(shard, batch_size, normalize):
+    return scan_txlist(_worker_hdp, shard, batch_size, normalize=normalize)
+
+
+def scan_txlist_parallel(
+    hdp_factory,
+    txlist,
+    workers,
+    shard_size,
+    batch_size=0,
+    sink=None,
+    log_format="plain",
+    normalize=False,
+):
+    """
+    Like scan_txlist(), but shards txlist into chunks of shard_size rows that are scanned by a pool of worker
+    processes. Each worker creates its own data provider (UTA connection, sequence handles) by calling
+    hdp_factory, which must be picklable. Results are merged in input order, so they are identical to scan_txlist().
+    If sink is given, it is called with each shard's has_aln values and MismatchBuffer as they are merged.
+    Workers log in log_format (see instrumentation.configure_logging()).
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+
+    has_aln = []
+    mm = MismatchBuffer()
+    stats = Counter()
+    shards = [
+        txlist.iloc[i : i + shard_size] for i in range(0, len(txlist), shard_size)
+    ]
+    # Start workers with "spawn" rather than forking a parent that may hold open connections or threads
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(hdp_factory, log_format),
+    ) as pool:
+        for shard_has_aln, shard_mm, shard_stats in pool.map(
+            _scan_shard,
+            shards,
+            [batch_size] * len(shards),
+            [normalize] * len(shards),
+        ):
+            has_aln.extend(shard_has_aln)
+            if sink is None:
+                mm.extend(shard_mm)
             else:
-                raise ValueError(
-                    f"Unexpected CIGAR operation: {m['cigar_op']} for tx {tx_ac}, chr {chr_ac}, alt_aln_method {alt_aln_method}"
-                )
-            tx_mm_seq = (
-                hdp.get_seq(tx_ac, tx_cursor_i - tx_anchor_offset, tx_cursor_i_new)
-                if row["alt_strand"] == 1
-                else hdp.get_seq(tx_ac, tx_cursor_i, tx_cursor_i_new + tx_anchor_offset)
+                sink(shard_has_aln, shard_mm)
+            stats.update(shard_stats)
+    return has_aln, mm, stats
+
+
+# Rows an async scan keeps started per data provider, ahead of the oldest row still being scanned
+ASYNC_WINDOW_PER_PROVIDER = 4
+
+
+async def _scan_txlist_async(hdps, txlist, batch_size, sink, normalize):
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+
+    loop = asyncio.get_running_loop()
+    # Data providers not currently in use by a query chain, each with its own reference window cache
+    idle = asyncio.Queue()
+    for hdp in hdps:
+        idle.put_nowait((hdp, ReferenceWindows(hdp) if normalize else None))
+
+    async def scan_row(executor, batch_hdp, id, row):
+        slot_hdp, ref_windows = await idle.get()
+        try:
+            hdp = slot_hdp if batch_hdp is None else batch_hdp.bind(slot_hdp)
+            mm = MismatchBuffer()
+            has_aln = await loop.run_in_executor(
+                executor,
+                scan_transcript,
+                hdp,
+                id,
+                row["tx_ac"],
+                row["chr_ac"],
+                mm,
+                ref_windows,
             )
-            chr_mm_seq = (
-                hdp.get_seq(
-                    chr_ac,
-                    chr_cursor_i - chr_anchor_offset,
-                    chr_cursor_i_new,
-                )
-                if row["alt_strand"] == 1
-                else hdp.get_seq(
-                    chr_ac,
-                    chr_cursor_i_new - chr_anchor_offset,
-                    chr_cursor_i,
+            return has_aln, mm
+        finally:
+            idle.put_nowait((slot_hdp, ref_windows))
+
+    has_aln = []
+    mm = MismatchBuffer()
+
+    def emit(row_has_aln, row_mm):
+        has_aln.append(row_has_aln)
+        if sink is None:
+            mm.extend(row_mm)
+        else:
+            sink([row_has_aln], row_mm)
+
+    window = ASYNC_WINDOW_PER_PROVIDER * len(hdps)
+    step = batch_size if batch_size > 0 else max(len(txlist), 1)
+    with ThreadPoolExecutor(max_workers=len(hdps)) as executor:
+        for batch_start in range(0, len(txlist), step):
+            batch = txlist.iloc[batch_start : batch_start + step]
+            batch_hdp = None
+            if batch_size > 0:
+                slot = await idle.get()
+                hdp = slot[0]
+                try:
+                    batch_hdp = await loop.run_in_executor(
+                        executor,
+                        partial(
+                            UTABatchPrefetch,
+                            hdp,
+                            batch["tx_ac"],
+                            batch["chr_ac"],
+                            nonperfect_only=True,
+                        ),
+                    )
+                finally:
+                    idle.put_nowait(slot)
+            # Rows are passed on in input order as they finish, so that results reach sink (and the checkpoint) while
+            # the scan goes on, with at most window rows started and held in memory
+            pending = deque()
+            for id, row in batch.iterrows():
+                pending.append(
+                    asyncio.ensure_future(scan_row(executor, batch_hdp, id, row))
                 )
-            )
-            tx_pos = tx_cursor_i
-            vcf_pos = (
-                chr_cursor_i + chr_cursor_vcf_pos_3p_offset
-                if row["alt_strand"] == 1
-                else chr_cursor_i_new + chr_cursor_vcf_pos_3p_offset
-            )
-            vcf_ref = chr_mm_seq
-            vcf_alt = str(
-                tx_mm_seq
-                if row["alt_strand"] == 1
-                else Seq(tx_mm_seq).reverse_complement()
-            )
-            mismatch = pd.DataFrame(
-                {
-                    "#CHROM": chr_ac,
-                    "POS": vcf_pos,
-                    "ID": f"{chr_ac}|{vcf_pos}{vcf_ref}>{vcf_alt}|{tx_ac}|{alt_aln_method}",
-                    "REF": vcf_ref,
-                    "ALT": vcf_alt,
-                    "INFO": f"tx_ac={tx_ac};cigar='{row["cigar"]}';alt_aln_method={alt_aln_method};uta_tx_exon_ord={row['ord']};uta_tx_exon_id={row['tx_exon_id']};uta_alt_exon_id={row['alt_exon_id']};uta_tx_start_i={row['tx_start_i']};uta_tx_end_i={row['tx_end_i']};tx_pos={tx_pos};uta_alt_start_i={row['alt_start_i']};uta_alt_end_i={row['alt_end_i']};strand={row['alt_strand']}",
-                },
-                index=[id],
-            )
-            mm = pd.concat(
-                [
-                    mm,
-                    mismatch,
-                ],
-                ignore_index=False,
-            )
-        # Advance the cursor for the next iteration
-        tx_cursor_i = tx_cursor_i_new
-        chr_cursor_i = chr_cursor_i_new
-    return mm
+                if len(pending) >= window:
+                    emit(*await pending.popleft())
+            while pending:
+                emit(*await pending.popleft())
+    return has_aln, mm, sum((provider_stats(hdp) for hdp in hdps), Counter())
 
 
-def main():
-    args = parser.parse_args()
+def scan_txlist_async(
+    hdp_factory, txlist, concurrency, batch_size=0, sink=None, normalize=False
+):
+    """
+    Like scan_txlist(), but keeps up to concurrency transcripts' mapping options -> tx_exons -> get_seq query
+    chains in flight at once, overlapping their I/O within a single process. Each in-flight chain runs in a thread
+    with exclusive use of one of concurrency data providers (i.e. UTA connections and sequence handles) created
+    by calling hdp_factory. Results are merged in input order, so they are identical to scan_txlist(), and passed
+    to sink per row as soon as the rows before it are finished, if it is given.
+    """
+    import asyncio
 
-    infile = args.infile[0]  # 'mane_grch38_txlist.tsv'
-    outfilebase = Path(infile).stem
+    hdps = [hdp_factory() for _ in range(concurrency)]
+    return asyncio.run(_scan_txlist_async(hdps, txlist, batch_size, sink, normalize))
+
+
+def format_throughput(stats, elapsed):
+    return (
+        f"Scanned {stats['rows']} rows, {stats['alignments']} alignments, {stats['events']} events"
+        f" in {elapsed:.0f}s ({stats['rows'] / max(elapsed, 1e-9):.0f} rows/sec)"
+    )
+
+
+def scan_alignments(
+    hdp,
+    alt_acs,
+    alt_aln_methods,
+    vcf,
+    flush_events=10000,
+    report_interval=30,
+    batch_exons=5000,
+    parquet=None,
+    normalize=False,
+):
+    """
+    Find the genome-transcript discrepancies in every alignment to one of alt_acs with one of alt_aln_methods.
+    Exons are streamed from UTA one alignment at a time (see uta_provider.UTAMismatchProvider.stream_nonperfect_exons())
+    and converted batch_exons at a time with cigar_batch.cigar_batch_to_records(). The records are passed to
+    vcf_writer.SortedVCFWriter vcf, and parquet_writer.ParquetMismatchWriter parquet if given, in chunks of
+    flush_events, so memory use is bounded.
+    Progress is logged every report_interval seconds. If normalize is set, indels are left-aligned and trimmed.
+
+    Records are identified as "<gene>|<tx_ac>|<alt_ac>". Returns a Counter of rows, alignments, incomplete alignments
+    (skipped, as in hdp.get_tx_exons()) and events.
+    """
+    import pandas as pd
+
+    from cigar_batch import cigar_batch_to_records
+    from hgvs.exceptions import HGVSDataNotAvailableError
+
+    stats = Counter()
+    mm = MismatchBuffer()
+    batch, batch_ids = [], []
+    perfect = re.compile("[0-9]+=")
+    ref_windows = ReferenceWindows(hdp) if normalize else None
+
+    def write(mm):
+        stats["events"] += len(mm)
+        vcf.write_records(mm)
+        if parquet is not None:
+            parquet.write_records(mm)
+
+    def flush():
+        nonlocal mm
+        cigar_batch_to_records(
+            hdp,
+            batch_ids,
+            pd.DataFrame(batch, columns=TX_EXON_DF_COLUMNS),
+            mm,
+            ref_windows,
+        )
+        batch.clear()
+        batch_ids.clear()
+        if len(mm) >= flush_events:
+            write(mm)
+            mm = MismatchBuffer()
+
+    t0 = last_report = time.monotonic()
+    rows = hdp.stream_nonperfect_exons(alt_acs, alt_aln_methods)
+    for (tx_ac, alt_ac, alt_aln_method), exons in groupby(
+        rows, key=lambda r: (r["tx_ac"], r["alt_ac"], r["alt_aln_method"])
+    ):
+        exons = list(exons)
+        stats["rows"] += len(exons)
+        stats["alignments"] += 1
+        try:
+            check_tx_exons(exons, tx_ac, alt_ac, alt_aln_method)
+        except HGVSDataNotAvailableError:
+            stats["incomplete_alignments"] += 1
+            continue
+        id = f"{exons[0]['hgnc']}|{tx_ac}|{alt_ac}"
+        batch.extend(e for e in exons if not perfect.fullmatch(e["cigar"]))
+        batch_ids.extend([id] * (len(batch) - len(batch_ids)))
+        if len(batch) >= batch_exons:
+            flush()
+        if time.monotonic() - last_report >= report_interval:
+            last_report = time.monotonic()
+            log.info(format_throughput(stats, last_report - t0), extra=dict(stats))
+    flush()
+    write(mm)
+    log.info(format_throughput(stats, time.monotonic() - t0), extra=dict(stats))
+    cache_stats = format_cache_stats(provider_stats(hdp))
+    if cache_stats:
+        log.info(cache_stats)
+    return stats
 
-    outvcf = outfilebase + ".mismatches.vcf"
-    outfile = outfilebase + ".mismatches.tsv"
+
+def scan_all(argv):
+    """
+    scan-all subcommand: scan every alignment to the given contigs without an input file.
+    """
+    args = scan_all_parser.parse_args(argv)
+    configure_logging(args.log_format)
+    if args.snapshot:
+        scan_all_parser.error("--snapshot can't be used with scan-all")
+    outvcf = f"{args.out_prefix}.mismatches.vcf" + (".gz" if args.bgzip else "")
+    parquet = (
+        open_parquet_writer(f"{args.out_prefix}.mismatches.parquet")
+        if args.parquet
+        else None
+    )
+    with SortedVCFWriter(outvcf) as vcf, parquet or nullcontext():
+        scan_alignments(
+            make_hdp(args),
+            args.alt_ac,
+            args.alt_aln_method or ["splign"],
+            vcf,
+            parquet=parquet,
+            normalize=args.normalize,
+        )
+
+
+def open_parquet_writer(path):
+    """
+    Open a parquet_writer.ParquetMismatchWriter at path. pyarrow is only imported when Parquet output is requested.
+    """
+    from parquet_writer import ParquetMismatchWriter
+
+    return ParquetMismatchWriter(path)
+
+
+def previous_vcf(prefix):
+    """
+    Path of the VCF of the run with output prefix prefix, which may have been bgzip-compressed.
+    """
+    path = prefix + ".mismatches.vcf"
+    return path if os.path.exists(path) else path + ".gz"
+
+
+def read_txlist(infile):
+    """
+    Read the input TSV, naming its transcript and chromosome accession columns tx_ac and chr_ac.
+    """
+    import pandas as pd
 
     txlist = pd.read_csv(infile, sep="\t", index_col=0)
 
-    txlist = txlist.rename(
+    return txlist.rename(
         {
             txlist.columns[0]: "tx_ac",
             txlist.columns[1]: "chr_ac",
@@ -280,75 +987,349 @@ def main():
         axis=1,
     )
 
+
+def export_snapshot(argv):
+    """
+    export-snapshot subcommand: scan the input through a RecordingUTA and save everything it fetched.
+    """
+    args = export_parser.parse_args(argv)
+    configure_logging(args.log_format)
+    txlist = read_txlist(args.infile[0])
+    hdp = RecordingUTA(make_hdp(args))
+    # Without batch prefetching, so that results are recorded per transcript rather than per batch query
+    scan_txlist(hdp, txlist)
+    hdp.save(args.outfile[0], hdp.data_version())
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] in subcommands:
+        return subcommands[argv[0]](argv[1:])
+    args = parser.parse_args(argv)
+
+    import numpy as np
+    import pandas as pd
+
+    configure_logging(args.log_format)
+    if args.snapshot:
+        # A snapshot holds per-transcript results only, and prefetching from local data gains nothing
+        args.batch_size = 0
+
+    infile = args.infile[0]  # 'mane_grch38_txlist.tsv'
+    outfilebase = Path(infile).stem
+    if args.shard:
+        # Outputs of a shard are named <infile stem>.shard-<i>-of-<N>.*, to be combined with the merge subcommand
+        outfilebase = shard_name(outfilebase, *args.shard)
+
+    # Results go to one set of mismatch files per assembly with --assembly, named <infile stem>.<assembly>.*
+    assemblies = args.assemblies or [None]
+    outbases = {a: outfilebase + (f".{a}" if a else "") for a in assemblies}
+    checkpoint_file = outfilebase + ".checkpoint.jsonl"
+    fingerprints_file = outfilebase + ".fingerprints.tsv"
+    stats_file = outfilebase + ".stats.json"
+
+    txlist = read_txlist(infile)
+
+    if args.workers > 1 and args.async_queries > 0:
+        parser.error("--workers and --async-queries can't be combined")
+    if args.assemblies and args.previous_run:
+        parser.error("--assembly and --previous-run can't be combined")
+    hdp = make_hdp(args)
+    # Stages timed outside of the data providers
+    run_stats = Counter()
+    t_start = time.monotonic()
+
+    # Fingerprint the alignments of the input, only for the options that use them: to compare with the previous run,
+    # to find equivalent transcripts, to weigh rows for sharding and for incremental runs later on
+    fingerprints = None
+    if args.write_fingerprints or args.previous_run or args.similar_tx or args.shard:
+        if args.snapshot:
+            log.info("Alignment fingerprints are not available from a snapshot")
+        else:
+            t0 = time.perf_counter()
+            fingerprints = fetch_fingerprints(hdp, txlist["tx_ac"])
+            record_stage(run_stats, "fingerprints", time.perf_counter() - t0)
+
+    # Every shard assigns all rows to shards the same way, and keeps its own
+    if args.shard:
+        i, n = args.shard
+        shard_rows = np.flatnonzero(
+            assign_shards(txlist, row_weights(txlist, fingerprints), n) == i - 1
+        )
+        txlist = txlist.iloc[shard_rows].copy()
+        if fingerprints is not None:
+            fingerprints = fingerprints[fingerprints["tx_ac"].isin(txlist["tx_ac"])]
+        log.info(f"Shard {i} of {n}: {len(txlist)} rows")
+
+    if args.assemblies:
+        txlist = expand_assemblies(txlist, assembly_chr_acs(args.assemblies))
+        unmapped = txlist["chr_ac"].isna()
+        if unmapped.any():
+            log.warning(
+                f"{unmapped.sum()} rows have no chromosome of the same name in their assembly"
+            )
+
     # Initialize columns for results
     txlist["has_aln"] = None
     txlist["mismatch_exons"] = None
     txlist["mismatches"] = None
     txlist["errors"] = None
 
-    # Initialize UTA connection
-    hdp = hgvs.dataproviders.uta.connect()
+    scan_mask = np.ones(len(txlist), dtype=bool)
+    if args.previous_run:
+        if fingerprints is None:
+            parser.error("--previous-run can't be used with --snapshot")
+        previous_fingerprints = args.previous_run + ".fingerprints.tsv"
+        if not os.path.exists(previous_fingerprints):
+            parser.error(
+                f"{previous_fingerprints} not found; the previous run must have been run with --write-fingerprints"
+            )
+        # As strings, which are copied to the rows that aren't scanned again as they are; read by type, e.g. a column
+        # of single exon ordinals would become floats
+        previous_txlist = pd.read_csv(
+            args.previous_run + ".mismatches.tsv",
+            sep="\t",
+            index_col=0,
+            dtype={c: str for c in ["has_aln", "mismatch_exons", "mismatches"]},
+        )
+        scan_mask, changes = plan_rescan(
+            txlist,
+            fingerprints,
+            read_fingerprints(previous_fingerprints),
+            previous_txlist,
+        )
+        changes.to_csv(outfilebase + ".changes.tsv", sep="\t", index=False)
+        log.info(
+            f"{(~scan_mask).sum()} rows unchanged since {args.previous_run}, {scan_mask.sum()} to scan; "
+            + ", ".join(
+                f"{n} alignments {change}"
+                for change, n in changes["change"].value_counts().items()
+            )
+        )
 
-    # Initialize dataframe of detected mismatches
-    mm = pd.DataFrame(
-        columns=[
-            "#CHROM",
-            "POS",
-            "ID",
-            "REF",
-            "ALT",
-            "INFO",
-        ],
+    # Rows of transcripts equivalent to an earlier row's are not scanned, but get copies of its results
+    representative = np.full(len(txlist), -1)
+    if args.similar_tx:
+        if fingerprints is None:
+            parser.error("--similar-tx can't be used with --snapshot")
+        t0 = time.perf_counter()
+        scan_pos = np.flatnonzero(scan_mask)
+        scan_rep = plan_equivalents(
+            txlist[scan_mask],
+            fingerprints,
+            fetch_similar_transcripts(hdp, txlist.loc[scan_mask, "tx_ac"]),
+        )
+        representative[scan_pos[scan_rep >= 0]] = scan_pos[scan_rep[scan_rep >= 0]]
+        record_stage(run_stats, "similar_tx", time.perf_counter() - t0)
+        log.info(
+            f"{(representative >= 0).sum()} rows are equivalent to an earlier row and get copies of its results"
+        )
+    copied = representative >= 0
+    representative_ids = set(txlist.index[representative[copied]])
+    representative_records = []
+
+    # Mismatches are written to the VCF and summarized per input row as they are found, rather than kept
+    has_aln = []
+    summary = MismatchSummary()
+    vcfs = {
+        a: SortedVCFWriter(outbase + ".mismatches.vcf" + (".gz" if args.bgzip else ""))
+        for a, outbase in outbases.items()
+    }
+    parquets = (
+        {
+            a: open_parquet_writer(outbase + ".mismatches.parquet")
+            for a, outbase in outbases.items()
+        }
+        if args.parquet
+        else {}
     )
 
-    for id, row in txlist.iterrows():
-        print(f"Now processing: {id}")
-        tx_ac = row["tx_ac"]
-        chr_ac = row["chr_ac"]
-        # Check to see if target transcript is in UTA
-        mapoptsdf = uta_tx_mapping_options_df(hdp, tx_ac)
-        # if not res:
-        if chr_ac not in mapoptsdf["alt_ac"].values:
-            txlist.loc[id, "has_aln"] = False
-            continue
-        txlist.loc[id, "has_aln"] = True
-        # Get transcript sequence
-        for alt_aln_method in mapoptsdf[mapoptsdf["alt_ac"] == chr_ac]["method"]:
-            txexdf = uta_get_tx_exons_df(hdp, tx_ac, chr_ac, alt_aln_method)
-            # Get rows that don't have a perfect alignment according to CIGAR string
-            if txexdf.empty:
-                print(
-                    f"No exons found for tx {tx_ac}, chr {chr_ac}, alt_aln_method {alt_aln_method}"
+    def write(mm):
+        for a, part in split_records(mm).items() if args.assemblies else [(None, mm)]:
+            vcfs[a].write_records(part)
+            if a in parquets:
+                parquets[a].write_records(part)
+
+    def collect(chunk_has_aln, mm):
+        has_aln.extend(chunk_has_aln)
+        write(mm)
+        summary.add(mm)
+        # Keep the records of the rows that others get copies of
+        keep = [i for i, id in enumerate(mm.index) if id in representative_ids]
+        if keep:
+            representative_records.append(
+                pd.DataFrame(
+                    {c: [mm.columns[c][i] for i in keep] for c in BUFFER_COLUMNS},
+                    index=[mm.index[i] for i in keep],
                 )
-                continue
-            # For each exon that isn't perfectly aligned to the reference
-            for i, row in txexdf[
-                ~txexdf["cigar"].str.fullmatch("^[0-9]+=$")
-            ].iterrows():
-                mm = pd.concat(
-                    [
-                        mm,
-                        uta_cigar_to_mismatch_vcf(hdp, id, row),
-                    ],
-                    ignore_index=False,
+            )
+
+    # Results are also journaled, so that an interrupted run can be resumed after the rows it had finished
+    scan_rows = txlist[scan_mask & ~copied]
+    checkpoint = Checkpoint(
+        checkpoint_file,
+        infile,
+        len(scan_rows),
+        resume=args.resume,
+        interval=args.checkpoint_interval,
+    )
+
+    progress = Progress(len(scan_rows), args.progress, checkpoint.rows_done)
+
+    def sink(chunk_has_aln, mm):
+        t0 = time.perf_counter()
+        collect(chunk_has_aln, mm)
+        checkpoint.add(chunk_has_aln, mm)
+        record_stage(run_stats, "write", time.perf_counter() - t0)
+        progress.update(len(chunk_has_aln))
+
+    # Scan every transcript in the list, sharded across worker processes or with concurrent queries if requested
+    try:
+        with ExitStack() as outputs:
+            for writer in [*vcfs.values(), *parquets.values()]:
+                outputs.enter_context(writer)
+            if args.previous_run:
+                # Records of the rows that are reused
+                reused = previous_records(
+                    previous_vcf(args.previous_run), txlist[~scan_mask]
                 )
-    if not mm.empty:
-        # Get the unique 0-based exon ordinal numbers for each mismatch in this transcript as ';'-delimited string
-        txlist["mismatch_exons"] = (
-            mm.groupby(mm.index)["INFO"]
-            .agg("|".join)
-            .str.extractall("uta_tx_exon_ord=([0-9]+);")
-            .reset_index(level=0, names=["id"])
-            .drop_duplicates(["id", 0])
-            .sort_values(["id", 0])
-            .groupby("id")
-            .agg(";".join)
+                mm = MismatchBuffer()
+                mm.extend_columns(
+                    reused.index,
+                    reused["#CHROM"],
+                    reused["POS"].tolist(),
+                    reused["ID"],
+                    reused["REF"],
+                    reused["ALT"],
+                    parse_info(reused["INFO"]),
+                )
+                write(mm)
+            if checkpoint.rows_done:
+                log.info(f"Resuming after {checkpoint.rows_done} finished rows")
+            checkpoint.replay(collect, MismatchBuffer)
+            todo = scan_rows.iloc[checkpoint.rows_done :]
+            if args.async_queries > 0:
+                _, _, stats = scan_txlist_async(
+                    partial(make_hdp, args),
+                    todo,
+                    args.async_queries,
+                    args.batch_size,
+                    sink,
+                    args.normalize,
+                )
+            elif args.workers > 1:
+                _, _, stats = scan_txlist_parallel(
+                    partial(make_hdp, args),
+                    todo,
+                    args.workers,
+                    args.batch_size if args.batch_size > 0 else 100,
+                    args.batch_size,
+                    sink,
+                    args.log_format,
+                    args.normalize,
+                )
+            else:
+                _, _, stats = scan_txlist(
+                    hdp, todo, args.batch_size, sink, args.normalize
+                )
+            if copied.any():
+                copies = copy_records(
+                    (
+                        pd.concat(representative_records)
+                        if representative_records
+                        else pd.DataFrame(columns=BUFFER_COLUMNS)
+                    ),
+                    txlist,
+                    representative,
+                    fetch_exon_ids(
+                        hdp,
+                        zip(txlist.loc[copied, "tx_ac"], txlist.loc[copied, "chr_ac"]),
+                    ),
+                )
+                mm = MismatchBuffer()
+                mm.extend_columns(
+                    copies.index,
+                    copies["#CHROM"],
+                    copies["POS"].tolist(),
+                    copies["ID"],
+                    copies["REF"],
+                    copies["ALT"],
+                    [copies[k].tolist() for k in INFO_KEYS],
+                )
+                write(mm)
+                summary.add(mm)
+    finally:
+        checkpoint.close()
+    cache_stats = format_cache_stats(stats)
+    if cache_stats:
+        log.info(cache_stats)
+    if args.stats:
+        elapsed = time.monotonic() - t_start
+        write_stats_report(
+            {
+                "rows": len(txlist),
+                "rows_scanned": len(todo),
+                "elapsed_seconds": round(elapsed, 3),
+                "rows_per_sec": round(len(todo) / max(elapsed, 1e-9), 3),
+                **stats_report(stats + run_stats),
+                "cache": {k: v for k, v in stats.items() if k.startswith("cache_")},
+            },
+            stats_file,
+        )
+    txlist.loc[scan_mask & ~copied, "has_aln"] = has_aln
+    txlist.loc[copied, "has_aln"] = txlist["has_aln"].to_numpy()[representative[copied]]
+    txlist.loc[scan_mask, "mismatch_exons"] = txlist.index[scan_mask].map(
+        summary.mismatch_exons()
+    )
+    txlist.loc[scan_mask, "mismatches"] = txlist.index[scan_mask].map(
+        summary.mismatches()
+    )
+    if not scan_mask.all():
+        reused = previous_txlist[~previous_txlist.index.duplicated()].reindex(
+            txlist.index[~scan_mask]
         )
-        # Get the unique mismatch IDs for each mismatch in this transcript as ';'-delimited string
-        txlist["mismatches"] = mm.groupby(mm.index)["ID"].agg(";".join)
+        for c in ["has_aln", "mismatch_exons", "mismatches"]:
+            txlist.loc[~scan_mask, c] = reused[c].values
     # Write output
-    mm.to_csv(outvcf, sep="\t", index=False)
-    txlist.to_csv(outfile, sep="\t")
+    for a, part in (
+        split_assemblies(txlist).items() if args.assemblies else [(None, txlist)]
+    ):
+        part.to_csv(outbases[a] + ".mismatches.tsv", sep="\t")
+    if args.write_fingerprints and fingerprints is not None:
+        write_fingerprints(fingerprints, fingerprints_file)
+    os.remove(checkpoint_file)
+    # The manifest marks the shard as finished
+    if args.shard:
+        write_manifest(
+            outfilebase + ".json",
+            args.shard,
+            shard_rows,
+            assemblies=args.assemblies,
+            bgzip=args.bgzip,
+            parquet=args.parquet,
+            normalize=args.normalize,
+        )
+
+
+def merge(argv):
+    """
+    merge subcommand: combine the outputs of the shards of a run with --shard.
+    """
+    args = merge_parser.parse_args(argv)
+    configure_logging(args.log_format)
+    stem = Path(args.infile[0]).stem
+    try:
+        manifests = merge_shards(stem, args.shard_dir, stem)
+    except ValueError as e:
+        merge_parser.error(str(e))
+    log.info(f"Merged {len(manifests)} shards of {stem}")
+
+
+subcommands = {
+    "export-snapshot": export_snapshot,
+    "scan-all": scan_all,
+    "merge": merge,
+}
 
 
 if __name__ == "__main__":
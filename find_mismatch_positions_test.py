@@ -0,0 +1,154 @@
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+
+from find_mismatch_positions import (
+    MismatchBuffer,
+    MismatchSummary,
+    scan_alignments,
+    scan_txlist,
+    scan_txlist_async,
+    scan_txlist_parallel,
+)
+from synthetic_uta import SyntheticUTA, reverse_complement
+from uta_cigar_to_vcf_synthetic_test import apply_records
+from vcf_writer import SortedVCFWriter, read_vcf
+
+TRANSCRIPTS = [
+    ("NM_1.1", "NC_1.1", ["20=", "10=1X9=", "5=2I20="], 1),
+    ("NM_2.1", "NC_1.1", ["30=", "3=1D30="], -1),
+    ("NM_3.1", "NC_2.1", ["10=1X10=1X10=", "40="], 1),
+    ("NM_4.1", "NC_2.1", ["50="], -1),
+    ("NM_5.1", "NC_1.1", ["7=1X7=", "12=", "1X20=3I5="], -1),
+]
+
+
+def synthetic_hdp():
+    hdp = SyntheticUTA(seed=1)
+    for tx_ac, chr_ac, cigars, alt_strand in TRANSCRIPTS:
+        hdp.add_transcript(tx_ac, chr_ac, cigars, alt_strand)
+        hdp.add_alignment(tx_ac, chr_ac, cigars, alt_strand, alt_aln_method="blat")
+    return hdp
+
+
+def synthetic_txlist():
+    rows = [
+        (f"G{i}|{tx}|{chr}", tx, chr) for i, (tx, chr, _, _) in enumerate(TRANSCRIPTS)
+    ]
+    # A transcript without an alignment to the requested chromosome
+    rows.append(("G9|NM_1.1|NC_2.1", "NM_1.1", "NC_2.1"))
+    return pd.DataFrame(rows, columns=["id", "tx_ac", "chr_ac"]).set_index("id")
+
+
+def test_scan_txlist():
+    has_aln, mm, _ = scan_txlist(synthetic_hdp(), synthetic_txlist())
+    assert has_aln == [True] * len(TRANSCRIPTS) + [False]
+    mmdf = mm.to_df()
+    # Events from both alignment methods, in input order
+    assert len(mmdf) == 2 * 8
+    assert list(mmdf.index.unique()) == [
+        id for i, id in enumerate(synthetic_txlist().index) if i in [0, 1, 2, 4]
+    ]
+
+
+def test_records_reproduce_transcripts():
+    hdp = synthetic_hdp()
+    mmdf = scan_txlist(hdp, synthetic_txlist())[1].to_df()
+    for tx_ac, chr_ac, _, alt_strand in TRANSCRIPTS:
+        for alt_aln_method in ["splign", "blat"]:
+            records = mmdf[
+                mmdf["INFO"].str.contains(
+                    f"tx_ac={tx_ac};.*;alt_aln_method={alt_aln_method};"
+                )
+            ]
+            assert (records["REF"] != records["ALT"]).all()
+            # Applying the records of an alignment to the genome yields the transcript's exons
+            expected = chr_seq = hdp.get_seq(chr_ac)
+            for r in reversed(hdp.get_tx_exons(tx_ac, chr_ac, alt_aln_method)):
+                tx_ex_seq = hdp.get_seq(tx_ac, r["tx_start_i"], r["tx_end_i"])
+                if alt_strand == -1:
+                    tx_ex_seq = reverse_complement(tx_ex_seq)
+                expected = (
+                    expected[: r["alt_start_i"]]
+                    + tx_ex_seq
+                    + expected[r["alt_end_i"] :]
+                )
+            assert apply_records(chr_seq, records) == expected
+
+
+def test_mismatch_summary():
+    summary = MismatchSummary()
+    for ords in [[2, 10, 2], [0, 2]]:
+        mm = MismatchBuffer()
+        for i, ord in enumerate(ords):
+            info = ("NM_1.1", "1X", "splign", ord, 1, 2, 0, 1, 0, 9, 10, 1)
+            mm.append(f"G{i % 2}", "NC_1.1", 10, f"ev{ord}", "A", "C", info)
+        summary.add(mm)
+    # Unique ordinals, sorted as strings
+    assert summary.mismatch_exons() == {"G0": "0;2", "G1": "10;2"}
+    assert summary.mismatches() == {"G0": "ev2;ev2;ev0", "G1": "ev10;ev2"}
+    assert MismatchSummary().mismatch_exons() == {}
+
+
+@pytest.mark.parametrize("shard_size", [1, 2, 10])
+def test_scan_txlist_parallel(shard_size):
+    txlist = synthetic_txlist()
+    has_aln, mm, _ = scan_txlist(synthetic_hdp(), txlist)
+    par_has_aln, par_mm, _ = scan_txlist_parallel(synthetic_hdp, txlist, 3, shard_size)
+    assert par_has_aln == has_aln
+    assert par_mm.to_df().to_csv(sep="\t") == mm.to_df().to_csv(sep="\t")
+
+
+@pytest.mark.parametrize("concurrency", [1, 4])
+@pytest.mark.parametrize("batch_size", [0, 2])
+def test_scan_txlist_async(concurrency, batch_size):
+    txlist = synthetic_txlist()
+    has_aln, mm, _ = scan_txlist(synthetic_hdp(), txlist, batch_size)
+    async_has_aln, async_mm, _ = scan_txlist_async(
+        synthetic_hdp, txlist, concurrency, batch_size
+    )
+    assert async_has_aln == has_aln
+    assert async_mm.to_df().to_csv(sep="\t") == mm.to_df().to_csv(sep="\t")
+
+
+@pytest.mark.parametrize("flush_events", [1, 10000])
+def test_scan_alignments(flush_events, tmp_path):
+    _, mm, _ = scan_txlist(synthetic_hdp(), synthetic_txlist())
+    with SortedVCFWriter(tmp_path / "out.vcf") as vcf:
+        stats = scan_alignments(
+            synthetic_hdp(),
+            ["NC_1.1", "NC_2.1"],
+            ["splign", "blat"],
+            vcf,
+            flush_events=flush_events,
+        )
+    assert stats["alignments"] == 2 * len(TRANSCRIPTS)
+    assert stats["events"] == len(mm)
+    vcf = read_vcf(tmp_path / "out.vcf")
+    assert sorted(vcf["ID"]) == sorted(mm.to_df()["ID"])
+    assert vcf["INFO"].str.contains("alt_aln_method=blat").any()
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "import find_mismatch_positions",
+        "import runpy; sys.argv = ['find_mismatch_positions.py', '--help']\n"
+        "try: runpy.run_module('find_mismatch_positions', run_name='__main__')\n"
+        "except SystemExit: pass",
+    ],
+)
+def test_startup_skips_heavy_imports(code):
+    """
+    Importing the module and --help must not load pandas, NumPy or PyArrow.
+    """
+    check = "print(sorted({'pandas', 'numpy', 'pyarrow'} & set(sys.modules)))"
+    out = subprocess.run(
+        [sys.executable, "-c", f"import sys\n{code}\n{check}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    assert out.splitlines()[-1] == "[]"
@@ -0,0 +1,116 @@
+"""
+Incremental runs of find_mismatch_positions.py against a new UTA release, given the results of a previous run.
+
+A run with --write-fingerprints writes the fingerprint of each alignment of its input transcripts (see
+uta_provider.aln_fingerprint()). With the previous run's fingerprints and results, only input rows whose alignments to
+the requested chromosome were added, removed or changed (CIGAR string or coordinates of any exon) are scanned again.
+The results of the other rows are reused.
+"""
+
+from uta_provider import uta_bulk_aln_fingerprints
+from vcf_writer import read_vcf
+
+FINGERPRINT_COLUMNS = ["tx_ac", "alt_ac", "alt_aln_method", "fingerprint", "exons"]
+
+
+def fetch_fingerprints(hdp, tx_acs, chunk_size=1000):
+    """
+    Get the fingerprints of all alignments of tx_acs from UTA as a DataFrame, chunk_size transcripts per query.
+    """
+    import pandas as pd
+
+    tx_acs = sorted(set(tx_acs))
+    rows = []
+    for i in range(0, len(tx_acs), chunk_size):
+        rows.extend(
+            list(r) for r in uta_bulk_aln_fingerprints(hdp, tx_acs[i : i + chunk_size])
+        )
+    return pd.DataFrame(rows, columns=FINGERPRINT_COLUMNS)
+
+
+def write_fingerprints(fingerprints, path):
+    fingerprints.to_csv(path, sep="\t", index=False)
+
+
+def read_fingerprints(path):
+    import pandas as pd
+
+    return pd.read_csv(path, sep="\t", dtype=str)
+
+
+def row_alignments(fingerprints):
+    """
+    Map (tx_ac, alt_ac) to the set of (alt_aln_method, fingerprint) of its alignments.
+    """
+    alignments = {}
+    for tx_ac, alt_ac, alt_aln_method, fingerprint in fingerprints[
+        ["tx_ac", "alt_ac", "alt_aln_method", "fingerprint"]
+    ].itertuples(index=False):
+        alignments.setdefault((tx_ac, alt_ac), set()).add((alt_aln_method, fingerprint))
+    return alignments
+
+
+def plan_rescan(txlist, fingerprints, previous_fingerprints, previous_txlist):
+    """
+    Decide which rows of txlist have to be scanned again. A row can be reused if the previous run had a row with the
+    same id, tx_ac and chr_ac, and the alignments of tx_ac to chr_ac have the same fingerprints as then.
+
+    Returns a boolean array of the rows to rescan and a DataFrame reporting, per rescanned row, each alignment that
+    was added, removed or changed, or that the row is new.
+    """
+    import numpy as np
+    import pandas as pd
+
+    new = row_alignments(fingerprints)
+    old = row_alignments(previous_fingerprints)
+    previous_rows = {
+        id: (tx_ac, chr_ac)
+        for id, tx_ac, chr_ac in previous_txlist[["tx_ac", "chr_ac"]].itertuples()
+    }
+    rescan = []
+    changes = []
+    for id, tx_ac, chr_ac in txlist[["tx_ac", "chr_ac"]].itertuples():
+        if previous_rows.get(id) != (tx_ac, chr_ac):
+            rescan.append(True)
+            changes.append((id, tx_ac, chr_ac, None, "new_row"))
+            continue
+        new_alns = dict(new.get((tx_ac, chr_ac), set()))
+        old_alns = dict(old.get((tx_ac, chr_ac), set()))
+        row_changes = [
+            (
+                id,
+                tx_ac,
+                chr_ac,
+                method,
+                (
+                    "added"
+                    if method not in old_alns
+                    else "removed" if method not in new_alns else "changed"
+                ),
+            )
+            for method in sorted(new_alns.keys() | old_alns.keys())
+            if new_alns.get(method) != old_alns.get(method)
+        ]
+        rescan.append(bool(row_changes))
+        changes.extend(row_changes)
+    return np.array(rescan, dtype=bool), pd.DataFrame(
+        changes, columns=["id", "tx_ac", "alt_ac", "alt_aln_method", "change"]
+    )
+
+
+def previous_records(previous_vcf, txlist):
+    """
+    Get the records of previous run's VCF belonging to the (tx_ac, chr_ac) pairs of the rows of txlist, as a
+    DataFrame indexed by input row id.
+    """
+    vcf = read_vcf(previous_vcf)
+    vcf["tx_ac"] = vcf["INFO"].str.extract("(?:^|;)tx_ac=([^;]+)", expand=False)
+    vcf = vcf.drop_duplicates(["#CHROM", "POS", "ID", "REF", "ALT", "INFO"])
+    rows = txlist[["tx_ac", "chr_ac"]].rename_axis("id").reset_index()
+    return (
+        rows.merge(
+            vcf, left_on=["tx_ac", "chr_ac"], right_on=["tx_ac", "#CHROM"], how="inner"
+        )
+        .set_index("id")
+        .drop(columns=["tx_ac", "chr_ac"])
+    )
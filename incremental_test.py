@@ -0,0 +1,127 @@
+import os
+
+import pandas as pd
+import pytest
+
+import find_mismatch_positions
+from find_mismatch_positions import main
+from find_mismatch_positions_test import TRANSCRIPTS, synthetic_txlist
+from incremental import fetch_fingerprints
+from synthetic_uta import SyntheticUTA
+
+
+def release_hdp(changed=False):
+    hdp = SyntheticUTA(seed=1)
+    for tx_ac, chr_ac, cigars, alt_strand in TRANSCRIPTS:
+        if changed and tx_ac == "NM_5.1":
+            # Same exon lengths, a mismatch replaced by a match
+            cigars = ["7=1X7=", "12=", "21=3I5="]
+        hdp.add_transcript(tx_ac, chr_ac, cigars, alt_strand)
+        hdp.add_alignment(tx_ac, chr_ac, cigars, alt_strand, alt_aln_method="blat")
+    return hdp
+
+
+def read_output(path):
+    with open(path) as f:
+        return [line for line in f if not line.startswith("##fileDate")]
+
+
+def test_fingerprints():
+    fingerprints = fetch_fingerprints(release_hdp(), ["NM_1.1", "NM_5.1"], 1)
+    assert len(fingerprints) == 4
+    changed = fetch_fingerprints(release_hdp(changed=True), ["NM_1.1", "NM_5.1"])
+    assert list(fingerprints["fingerprint"] == changed["fingerprint"]) == [
+        True,
+        True,
+        False,
+        False,
+    ]
+
+
+def test_incremental_run(tmp_path, monkeypatch):
+    for d in ["old", "new", "full"]:
+        (tmp_path / d).mkdir()
+        synthetic_txlist().to_csv(tmp_path / d / "txlist.tsv", sep="\t")
+    monkeypatch.chdir(tmp_path / "old")
+    monkeypatch.setattr(find_mismatch_positions, "make_hdp", lambda args: release_hdp())
+    main(["txlist.tsv"])
+    # Fingerprints are only fetched and written for runs meant as baselines
+    assert not os.path.exists("txlist.fingerprints.tsv")
+    with pytest.raises(SystemExit):
+        main(["--previous-run", "txlist", "txlist.tsv"])
+    main(["--write-fingerprints", "txlist.tsv"])
+
+    # Against the new release, a full run for comparison
+    monkeypatch.chdir(tmp_path / "full")
+    monkeypatch.setattr(
+        find_mismatch_positions, "make_hdp", lambda args: release_hdp(changed=True)
+    )
+    main(["--parquet", "--write-fingerprints", "txlist.tsv"])
+
+    # and an incremental one
+    monkeypatch.chdir(tmp_path / "new")
+    scan_transcript = find_mismatch_positions.scan_transcript
+    scanned = []
+    monkeypatch.setattr(
+        find_mismatch_positions,
+        "scan_transcript",
+        lambda hdp, id, *args: scanned.append(id) or scan_transcript(hdp, id, *args),
+    )
+    main(
+        [
+            "--parquet",
+            "--write-fingerprints",
+            "--previous-run",
+            "../old/txlist",
+            "txlist.tsv",
+        ]
+    )
+    assert scanned == ["G4|NM_5.1|NC_1.1"]
+    changes = pd.read_csv("txlist.changes.tsv", sep="\t")
+    assert list(changes["alt_aln_method"]) == ["blat", "splign"]
+    assert set(changes["change"]) == {"changed"}
+    for f in ["mismatches.tsv", "mismatches.vcf", "fingerprints.tsv"]:
+        assert read_output(f"txlist.{f}") == read_output(f"../full/txlist.{f}")
+    # Reused records are written to the Parquet dataset too
+    parquet = pd.read_parquet("txlist.mismatches.parquet")
+    expected = pd.read_parquet("../full/txlist.mismatches.parquet")
+    assert parquet.sort_values(["alt_ac", "pos", "vcf_id"], ignore_index=True).equals(
+        expected.sort_values(["alt_ac", "pos", "vcf_id"], ignore_index=True)
+    )
+    assert read_output("txlist.mismatches.vcf") != read_output(
+        "../old/txlist.mismatches.vcf"
+    )
+
+
+def test_incremental_single_exon_mismatches(tmp_path, monkeypatch):
+    def hdp(changed=False):
+        hdp = SyntheticUTA(seed=2)
+        for tx_ac, cigars in [
+            ("NM_1.1", ["20=", "10=1X9="]),
+            ("NM_2.1", ["5=1D5=", "30="]),
+            ("NM_3.1", ["30=", "3=1X3=" if changed else "7="]),
+        ]:
+            hdp.add_transcript(tx_ac, "NC_1.1", cigars)
+            hdp.add_alignment(tx_ac, "NC_1.1", cigars)
+        return hdp
+
+    txlist = pd.DataFrame(
+        [(f"G{i}", f"NM_{i}.1", "NC_1.1") for i in [1, 2, 3]],
+        columns=["id", "tx_ac", "chr_ac"],
+    ).set_index("id")
+    for d, changed in [("old", False), ("full", True), ("new", True)]:
+        (tmp_path / d).mkdir()
+        txlist.to_csv(tmp_path / d / "txlist.tsv", sep="\t")
+        monkeypatch.chdir(tmp_path / d)
+        monkeypatch.setattr(
+            find_mismatch_positions, "make_hdp", lambda args: hdp(changed)
+        )
+        main(
+            ["--write-fingerprints", "txlist.tsv"]
+            if d != "new"
+            else ["--previous-run", "../old/txlist", "txlist.tsv"]
+        )
+    # The reused rows have one mismatching exon each, written as in a full run
+    assert read_output("txlist.mismatches.tsv") == read_output(
+        "../full/txlist.mismatches.tsv"
+    )
@@ -0,0 +1,210 @@
+"""
+Instrumentation of find_mismatch_positions.py runs: wall times, call counts and bytes of sequence fetched per
+stage, the slowest transcripts, a periodic progress line and logging setup.
+
+Timings are kept in the `stats` Counter of an InstrumentedUTA, the outermost data provider wrapper, so they are
+collected and merged across worker processes and concurrent queries like all other data provider stats (see
+uta_provider.provider_stats()). Per stage, the Counter holds calls.<stage>, seconds.<stage> and histogram bucket
+counts hist.<stage>.<bound in ms>. The slowest transcripts are kept as tx_seconds.<id>.
+"""
+
+from collections import Counter
+from contextlib import contextmanager
+from datetime import timedelta
+import heapq
+import json
+import logging
+import sys
+import time
+
+from uta_provider import UTAProxy
+
+log = logging.getLogger("instrumentation")
+
+# Upper bounds, in milliseconds, of the histogram buckets of stage wall times; slower calls go to the "inf" bucket
+HISTOGRAM_BOUNDS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+
+
+def record_stage(stats, stage, seconds):
+    """
+    Count a call of stage that took seconds in Counter stats.
+    """
+    stats[f"calls.{stage}"] += 1
+    stats[f"seconds.{stage}"] += seconds
+    ms = seconds * 1000
+    bound = next((b for b in HISTOGRAM_BOUNDS_MS if ms <= b), "inf")
+    stats[f"hist.{stage}.{bound}"] += 1
+
+
+@contextmanager
+def stage(hdp, name, id=None):
+    """
+    Time the enclosed block as stage name (of input row id, if given) if data provider hdp, or one it wraps, is an
+    InstrumentedUTA. Otherwise this does nothing.
+    """
+    record = getattr(hdp, "record_stage", None)
+    if record is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - t0, id)
+
+
+class InstrumentedUTA(UTAProxy):
+    """
+    Data provider that times the UTA queries and get_seq() calls of the provider it wraps, counts the bytes of
+    sequence fetched and records the stages timed with stage(). The slowest transcripts (by their "transcript"
+    stage) are kept, up to slowest of them.
+    """
+
+    def __init__(self, hdp, slowest=20):
+        super().__init__(hdp)
+        self.stats = Counter()
+        self.slowest = slowest
+        self._slowest = []
+
+    def record_stage(self, stage, seconds, id=None):
+        record_stage(self.stats, stage, seconds)
+        if id is None:
+            return
+        key = f"tx_seconds.{id}"
+        if len(self._slowest) < self.slowest:
+            heapq.heappush(self._slowest, (seconds, key))
+        elif seconds > self._slowest[0][0]:
+            _, evicted = heapq.heappushpop(self._slowest, (seconds, key))
+            self.stats.pop(evicted, None)
+        else:
+            return
+        self.stats[key] = seconds
+
+    def _timed(self, method, *args):
+        t0 = time.perf_counter()
+        result = getattr(self.hdp, method)(*args)
+        record_stage(self.stats, method, time.perf_counter() - t0)
+        return result
+
+    def _fetchall(self, sql, *args):
+        return self._timed("_fetchall", sql, *args)
+
+    def get_tx_mapping_options(self, tx_ac):
+        return self._timed("get_tx_mapping_options", tx_ac)
+
+    def get_tx_exons(self, tx_ac, alt_ac, alt_aln_method):
+        return self._timed("get_tx_exons", tx_ac, alt_ac, alt_aln_method)
+
+    def get_tx_nonperfect_exons(self, tx_ac, alt_ac, alt_aln_method):
+        return self._timed("get_tx_nonperfect_exons", tx_ac, alt_ac, alt_aln_method)
+
+    def get_seq(self, ac, start_i=None, end_i=None):
+        seq = self._timed("get_seq", ac, start_i, end_i)
+        self.stats["seq_bytes"] += len(seq)
+        return seq
+
+
+def stats_report(stats, slowest=20):
+    """
+    Turn the instrumentation counters in stats into a JSON-serializable dict of per-stage call counts, wall times
+    and histograms, bytes of sequence fetched and the slowest transcripts.
+    """
+    stages = {}
+    for name in sorted(k.split(".", 1)[1] for k in stats if k.startswith("calls.")):
+        calls = stats[f"calls.{name}"]
+        seconds = stats[f"seconds.{name}"]
+        stages[name] = {
+            "calls": calls,
+            "seconds": round(seconds, 6),
+            "mean_ms": round(seconds * 1000 / calls, 3),
+            "histogram_ms": {
+                (
+                    f"<={bound}" if bound != "inf" else f">{HISTOGRAM_BOUNDS_MS[-1]}"
+                ): stats[f"hist.{name}.{bound}"]
+                for bound in HISTOGRAM_BOUNDS_MS + ["inf"]
+            },
+        }
+    transcripts = sorted(
+        (
+            (v, k.split(".", 1)[1])
+            for k, v in stats.items()
+            if k.startswith("tx_seconds.")
+        ),
+        reverse=True,
+    )[:slowest]
+    return {
+        "stages": stages,
+        "seq_bytes": stats["seq_bytes"],
+        "slowest_transcripts": [
+            {"id": id, "seconds": round(seconds, 6)} for seconds, id in transcripts
+        ],
+    }
+
+
+def write_stats_report(report, path):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+        f.write("\n")
+
+
+class Progress:
+    """
+    Logs a progress line with the rows per second and estimated time left at most every interval seconds, for a
+    run over total rows of which done are already finished. An interval of 0 disables it.
+    """
+
+    def __init__(self, total, interval, done=0):
+        self.total = total
+        self.interval = interval
+        self.done = self.start_done = done
+        self.t0 = self.last = time.monotonic()
+
+    def update(self, rows):
+        self.done += rows
+        now = time.monotonic()
+        if not self.interval or now - self.last < self.interval:
+            return
+        self.last = now
+        rate = (self.done - self.start_done) / max(now - self.t0, 1e-9)
+        eta = (self.total - self.done) / rate if rate > 0 else None
+        log.info(
+            f"Progress: {self.done}/{self.total} rows ({rate:.1f} rows/sec, ETA {timedelta(seconds=round(eta)) if eta is not None else 'unknown'})",
+            extra={
+                "event": "progress",
+                "rows_done": self.done,
+                "rows_total": self.total,
+                "rows_per_sec": rate,
+                "eta_seconds": eta,
+            },
+        )
+
+
+# Attributes of every LogRecord, which aren't structured fields passed with extra=
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Formats log records as one JSON object per line, with the fields passed with extra= as keys of their own.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update((k, v) for k, v in vars(record).items() if k not in _RECORD_ATTRS)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(log_format="plain"):
+    """
+    Log INFO and above to stdout, as plain messages (as the scripts used to print them) or as JSON lines.
+    """
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(
+        JSONFormatter() if log_format == "json" else logging.Formatter("%(message)s")
+    )
+    logging.basicConfig(level=logging.INFO, handlers=[handler], force=True)
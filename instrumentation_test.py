@@ -0,0 +1,53 @@
+import json
+import logging
+
+from checkpoint_test import snapshot_run  # noqa: F401
+from find_mismatch_positions import main, scan_txlist
+from find_mismatch_positions_test import synthetic_hdp, synthetic_txlist
+from instrumentation import (
+    InstrumentedUTA,
+    JSONFormatter,
+    Progress,
+    stats_report,
+)
+
+
+def test_instrumented_scan():
+    hdp = InstrumentedUTA(synthetic_hdp(), slowest=3)
+    txlist = synthetic_txlist()
+    _, mm, stats = scan_txlist(hdp, txlist)
+    report = stats_report(stats)
+    stages = report["stages"]
+    assert stages["transcript"]["calls"] == len(txlist)
+    assert stages["get_tx_mapping_options"]["calls"] == len(txlist)
+    assert sum(stages["get_seq"]["histogram_ms"].values()) == stages["get_seq"]["calls"]
+    assert report["seq_bytes"] > 0
+    # Only the slowest transcripts are kept
+    slowest = report["slowest_transcripts"]
+    assert len(slowest) == 3
+    assert [t["seconds"] for t in slowest] == sorted(
+        (t["seconds"] for t in slowest), reverse=True
+    )
+    assert {t["id"] for t in slowest} <= set(txlist.index)
+
+
+def test_progress_and_json_logs(caplog):
+    progress = Progress(100, interval=1e-9, done=10)
+    with caplog.at_level(logging.INFO):
+        progress.update(30)
+    record = caplog.records[-1]
+    assert record.message.startswith("Progress: 40/100 rows")
+    entry = json.loads(JSONFormatter().format(record))
+    assert entry["event"] == "progress"
+    assert entry["rows_done"] == 40
+    assert entry["eta_seconds"] > 0
+
+
+def test_main_stats(snapshot_run):  # noqa: F811
+    main(["--stats", "--log-format", "json"] + snapshot_run)
+    with open("txlist.stats.json") as f:
+        report = json.load(f)
+    assert report["rows"] == report["rows_scanned"] == len(synthetic_txlist())
+    assert {"transcript", "get_seq", "cigar_to_records", "write"} <= set(
+        report["stages"]
+    )
@@ -0,0 +1,69 @@
+"""
+Left-alignment and parsimonious trimming of indel records, as done by e.g. bcftools norm, so the VCF records of
+find_mismatch_positions.py need no separate normalization pass.
+
+Indels are derived at their position in the CIGAR string, which within a repeat is not necessarily the leftmost
+equivalent position. left_normalize() shifts them left base by base, reading the reference through a callback. The
+exon's genomic sequence is read from the window already fetched for it (see cigar_batch.cigar_batch_to_records());
+bases beyond it come from a ReferenceWindows cache, so normalization adds few get_seq() calls.
+"""
+
+from collections import OrderedDict
+
+
+def left_normalize(pos, ref, alt, get_ref):
+    """
+    Left-align and trim the VCF record (1-based pos, ref, alt) of an indel, where get_ref(start_i, end_i) returns
+    the reference sequence of 0-based interval [start_i, end_i). Records of substitutions are returned as they are,
+    as are indels that would have to be shifted past the start of the reference.
+    """
+    if len(ref) == len(alt):
+        return pos, ref, alt
+    new_pos, new_ref, new_alt = pos, ref, alt
+    # Trim the common last base, and extend both alleles with the preceding reference base while one is empty
+    while True:
+        if new_ref and new_alt and new_ref[-1] == new_alt[-1]:
+            new_ref, new_alt = new_ref[:-1], new_alt[:-1]
+        elif not new_ref or not new_alt:
+            if new_pos <= 1:
+                return pos, ref, alt
+            base = get_ref(new_pos - 2, new_pos - 1)
+            new_pos, new_ref, new_alt = new_pos - 1, base + new_ref, base + new_alt
+        else:
+            break
+    # Trim common first bases, keeping one anchor base
+    while len(new_ref) > 1 and len(new_alt) > 1 and new_ref[0] == new_alt[0]:
+        new_pos, new_ref, new_alt = new_pos + 1, new_ref[1:], new_alt[1:]
+    return new_pos, new_ref, new_alt
+
+
+class ReferenceWindows:
+    """
+    Least recently used cache of windows of reference sequences, fetched with hdp.get_seq() in aligned blocks of
+    window_size bases. Holds up to max_windows windows.
+    """
+
+    def __init__(self, hdp, window_size=1024, max_windows=256):
+        self.hdp = hdp
+        self.window_size = window_size
+        self.max_windows = max_windows
+        self._windows = OrderedDict()
+
+    def _window(self, ac, i):
+        key = (ac, i)
+        seq = self._windows.get(key)
+        if seq is not None:
+            self._windows.move_to_end(key)
+            return seq
+        seq = self.hdp.get_seq(ac, i * self.window_size, (i + 1) * self.window_size)
+        self._windows[key] = seq
+        if len(self._windows) > self.max_windows:
+            self._windows.popitem(last=False)
+        return seq
+
+    def get_seq(self, ac, start_i, end_i):
+        first = start_i // self.window_size
+        last = (end_i - 1) // self.window_size
+        seq = "".join(self._window(ac, i) for i in range(first, last + 1))
+        offset = start_i - first * self.window_size
+        return seq[offset : offset + end_i - start_i]
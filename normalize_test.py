@@ -0,0 +1,129 @@
+import random
+
+import pandas as pd
+import pytest
+
+from cigar_batch import cigar_batch_to_records
+from find_mismatch_positions import MismatchBuffer, uta_get_tx_exons_df
+from normalize import ReferenceWindows, left_normalize
+from synthetic_uta import SyntheticUTA
+from cigar_batch_test import random_cigar
+
+#        1234567890123
+REF = "GCAAAATCACACAG"
+
+
+def get_ref(start_i, end_i):
+    return REF[start_i:end_i]
+
+
+def apply(seq, pos, ref, alt):
+    assert seq[pos - 1 : pos - 1 + len(ref)] == ref
+    return seq[: pos - 1] + alt + seq[pos - 1 + len(ref) :]
+
+
+@pytest.mark.parametrize(
+    "record, expected",
+    [
+        # Homopolymer deletion and insertion, shifted to the start of the run
+        ((5, "AA", "A"), (2, "CA", "C")),
+        ((6, "A", "AA"), (2, "C", "CA")),
+        # Dinucleotide repeat
+        ((11, "ACA", "A"), (7, "TCA", "T")),
+        ((13, "A", "ACA"), (7, "T", "TCA")),
+        # Not in a repeat
+        ((7, "TC", "T"), (7, "TC", "T")),
+        # Trimmed to one anchor base
+        ((3, "AAAAT", "AAAT"), (2, "CA", "C")),
+        # Substitutions are left alone
+        ((3, "A", "G"), (3, "A", "G")),
+        ((3, "AA", "GG"), (3, "AA", "GG")),
+    ],
+)
+def test_left_normalize(record, expected):
+    assert left_normalize(*record, get_ref) == expected
+    assert apply(REF, *record) == apply(REF, *expected)
+
+
+def test_left_normalize_at_reference_start():
+    # Would have to be shifted past the first base of the reference
+    assert left_normalize(2, "AA", "A", lambda s, e: "AAAA"[s:e]) == (2, "AA", "A")
+
+
+class CountingSeqs:
+    def __init__(self, seq):
+        self.seq = seq
+        self.calls = 0
+
+    def get_seq(self, ac, start_i=None, end_i=None):
+        self.calls += 1
+        return self.seq[start_i:end_i]
+
+
+def test_reference_windows():
+    seq = "".join(random.Random(0).choice("ACGT") for _ in range(1000))
+    hdp = CountingSeqs(seq)
+    windows = ReferenceWindows(hdp, window_size=100, max_windows=2)
+    assert windows.get_seq("NC_1.1", 150, 160) == seq[150:160]
+    assert windows.get_seq("NC_1.1", 110, 190) == seq[110:190]
+    assert hdp.calls == 1
+    # Spans two windows
+    assert windows.get_seq("NC_1.1", 190, 210) == seq[190:210]
+    assert hdp.calls == 2
+    # Window 1 was used more recently than window 2, which is evicted
+    windows.get_seq("NC_1.1", 100, 101)
+    windows.get_seq("NC_1.1", 500, 501)
+    assert hdp.calls == 3
+    windows.get_seq("NC_1.1", 100, 101)
+    assert hdp.calls == 3
+    windows.get_seq("NC_1.1", 200, 201)
+    assert hdp.calls == 4
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_batch_normalized_records(seed):
+    rng = random.Random(seed)
+    hdp = SyntheticUTA(seed)
+    exons = []
+    for t in range(8):
+        cigars = [random_cigar(rng) for _ in range(rng.randint(1, 4))]
+        hdp.add_transcript(f"NM_{t}.1", "NC_1.1", cigars, rng.choice([1, -1]))
+        exons.append(uta_get_tx_exons_df(hdp, f"NM_{t}.1", "NC_1.1", "splign"))
+    exons = pd.concat(exons, ignore_index=True)
+    ids = [f"G{i}" for i in range(len(exons))]
+
+    records = cigar_batch_to_records(hdp, ids, exons, MismatchBuffer()).to_df()
+    calls = hdp.get_seq_calls
+    normalized = cigar_batch_to_records(
+        hdp, ids, exons, MismatchBuffer(), ReferenceWindows(hdp)
+    ).to_df()
+    # Bases beyond the exons come from at most a few cached windows
+    assert hdp.get_seq_calls - calls <= 2 * (calls + 1)
+
+    assert len(normalized) == len(records)
+    assert list(normalized.index) == list(records.index)
+    chr_seq = hdp.get_seq("NC_1.1")
+    shifted = 0
+    for (_, r), (_, n) in zip(records.iterrows(), normalized.iterrows()):
+        if len(r["REF"]) == len(r["ALT"]) or (n["POS"], n["REF"], n["ALT"]) == (
+            r["POS"],
+            r["REF"],
+            r["ALT"],
+        ):
+            continue
+        # Same change to the genome, in normal form
+        assert apply(chr_seq, n["POS"], n["REF"], n["ALT"]) == apply(
+            chr_seq, r["POS"], r["REF"], r["ALT"]
+        )
+        assert n["REF"][-1] != n["ALT"][-1]
+        # A common first base is only kept as the anchor of an allele that would be empty without it; delins of
+        # runs of adjacent events start at their first differing base
+        if n["REF"][0] == n["ALT"][0]:
+            assert min(len(n["REF"]), len(n["ALT"])) == 1
+        assert left_normalize(
+            n["POS"], n["REF"], n["ALT"], lambda s, e: chr_seq[s:e]
+        ) == (n["POS"], n["REF"], n["ALT"])
+        shifted += n["POS"] < r["POS"]
+        # tx_pos stays the position in the CIGAR string
+        assert n["INFO"] == r["INFO"]
+    assert shifted > 0
@@ -0,0 +1,129 @@
+"""
+Writer of the mismatch records found by find_mismatch_positions.py as a Parquet dataset, with one typed column per
+VCF column and INFO field, so they can be queried without parsing text.
+
+The dataset is a directory partitioned Hive-style by contig (<path>/alt_ac=<contig>/part-0.parquet), with one file
+per contig that is kept open while records come in. Records are buffered up to a fixed count and written as one
+row group per contig, sorted by position, so readers can skip row groups and contigs using filters on alt_ac and
+pos, e.g. pandas.read_parquet(path, filters=[("alt_ac", "=", "NC_000001.11"), ("pos", "<", 1000000)]).
+
+Requires pyarrow, which find_mismatch_positions.py only imports when Parquet output is requested.
+"""
+
+import os
+import shutil
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from vcf_writer import INFO_FIELDS, INFO_KEYS
+
+_TYPES = {"Integer": pa.int64(), "String": pa.string()}
+
+# Schema of the files; the contig is the alt_ac partition column
+SCHEMA = pa.schema(
+    [
+        ("id", pa.string()),
+        ("pos", pa.int64()),
+        ("vcf_id", pa.string()),
+        ("ref", pa.string()),
+        ("alt", pa.string()),
+    ]
+    + [(id, _TYPES[type]) for id, number, type, description in INFO_FIELDS]
+)
+
+
+class ParquetMismatchWriter:
+    """
+    Writes the records of find_mismatch_positions.MismatchBuffers to a Parquet dataset at path (a directory, which
+    is replaced if it exists), keeping at most row_group_size records in memory.
+    """
+
+    def __init__(self, path, row_group_size=100000):
+        self.path = str(path)
+        self.row_group_size = row_group_size
+        self.records = 0
+        self._columns = {name: [] for name in SCHEMA.names}
+        self._chroms = []
+        self._writers = {}
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        os.makedirs(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def write_records(self, mm):
+        """
+        Write all records of a find_mismatch_positions.MismatchBuffer.
+        """
+        c = mm.columns
+        # Input row ids are written as strings, whatever the type of the input's index
+        self._columns["id"].extend(str(id) for id in mm.index)
+        for name, column in [
+            ("pos", "POS"),
+            ("vcf_id", "ID"),
+            ("ref", "REF"),
+            ("alt", "ALT"),
+        ] + [(key, key) for key in INFO_KEYS]:
+            self._columns[name].extend(c[column])
+        self._chroms.extend(c["#CHROM"])
+        self.records += len(mm)
+        if len(self._chroms) >= self.row_group_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._chroms:
+            return
+        table = pa.Table.from_pydict(self._columns, schema=SCHEMA)
+        chroms = pa.array(self._chroms, pa.string())
+        for chrom in sorted(set(self._chroms)):
+            part = table.filter(pc.equal(chroms, chrom)).sort_by("pos")
+            if chrom not in self._writers:
+                part_dir = os.path.join(self.path, f"alt_ac={chrom}")
+                os.makedirs(part_dir)
+                self._writers[chrom] = pq.ParquetWriter(
+                    os.path.join(part_dir, "part-0.parquet"), SCHEMA
+                )
+            self._writers[chrom].write_table(part)
+        self._columns = {name: [] for name in SCHEMA.names}
+        self._chroms = []
+
+    def close(self):
+        try:
+            self._flush()
+        finally:
+            for writer in self._writers.values():
+                writer.close()
+            self._writers = {}
+
+
+def merge_datasets(paths, path):
+    """
+    Merge Parquet datasets written by ParquetMismatchWriters over parts of an input into one at path (which is
+    replaced if it exists), with one file per contig holding the row groups of all of them in the order of paths.
+    Row groups are copied one at a time, so the datasets are never held in memory.
+    """
+    path = str(path)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
+    partitions = sorted(
+        {name for p in paths for name in os.listdir(p) if name.startswith("alt_ac=")}
+    )
+    for partition in partitions:
+        os.makedirs(os.path.join(path, partition))
+        with pq.ParquetWriter(
+            os.path.join(path, partition, "part-0.parquet"), SCHEMA
+        ) as writer:
+            for p in paths:
+                part = os.path.join(p, partition, "part-0.parquet")
+                if not os.path.exists(part):
+                    continue
+                f = pq.ParquetFile(part)
+                for i in range(f.num_row_groups):
+                    writer.write_table(f.read_row_group(i))
@@ -0,0 +1,49 @@
+import pandas as pd
+
+from checkpoint_test import snapshot_run  # noqa: F401
+from find_mismatch_positions import MismatchBuffer, main
+from parquet_writer import ParquetMismatchWriter
+from vcf_writer import INFO_KEYS, read_vcf
+
+
+def test_partitions(tmp_path):
+    path = tmp_path / "out.parquet"
+    with ParquetMismatchWriter(path, row_group_size=3) as parquet:
+        for chrom, pos in [("NC_2.1", 30), ("NC_1.1", 20), ("NC_2.1", 10)] * 3:
+            mm = MismatchBuffer()
+            info = ("NM_1.1", "5=1X", "splign", 0, 1, 2, 0, 6, 5, pos - 6, pos, -1)
+            mm.append(7, chrom, pos, f"{chrom}|{pos}", "A", "C", info)
+            parquet.write_records(mm)
+    assert parquet.records == 9
+
+    assert sorted(p.name for p in path.iterdir()) == ["alt_ac=NC_1.1", "alt_ac=NC_2.1"]
+    df = pd.read_parquet(path, filters=[("alt_ac", "=", "NC_2.1"), ("pos", "<", 20)])
+    assert list(df["vcf_id"]) == ["NC_2.1|10"] * 3
+    assert df["id"].iloc[0] == "7"
+    assert df["strand"].dtype == "int64"
+    assert df["uta_tx_exon_ord"].dtype == "int64"
+    # One row group, sorted by position, per contig and flush
+    df = pd.read_parquet(path / "alt_ac=NC_2.1")
+    assert list(df["pos"]) == [10, 30, 10, 30, 10, 30]
+
+
+def test_main_parquet(snapshot_run):  # noqa: F811
+    main(["--parquet"] + snapshot_run)
+    vcf = read_vcf("txlist.mismatches.vcf")
+    df = pd.read_parquet("txlist.mismatches.parquet")
+    assert len(df) == len(vcf) > 0
+    df = df.sort_values(["alt_ac", "pos"], kind="stable", ignore_index=True)
+    assert list(df["vcf_id"]) == list(vcf["ID"])
+    assert list(df["alt_ac"]) == list(vcf["#CHROM"])
+    # Typed columns hold the values of the INFO fields
+    mm = MismatchBuffer()
+    mm.extend_columns(
+        df["id"],
+        df["alt_ac"],
+        df["pos"],
+        df["vcf_id"],
+        df["ref"],
+        df["alt"],
+        [df[key] for key in INFO_KEYS],
+    )
+    assert mm.to_df()["INFO"].tolist() == vcf["INFO"].tolist()
@@ -0,0 +1,158 @@
+"""
+Local sequence sources for find_mismatch_positions.py, so get_seq() calls are served from files on disk instead of
+the (often remote) sequence source configured for hgvs.dataproviders.uta.connect().
+
+Supported sources are faidx-indexed FASTA files (plain text, read through a memory map, or bgzip-compressed, read
+through pysam) and local seqrepo directories. Each source has a fetch(ac, start_i, end_i) method with the same
+slicing semantics as hdp.get_seq() for non-negative coordinates, raising KeyError for accessions it does not contain.
+"""
+
+import mmap
+import os
+
+from uta_provider import UTAProxy, data_not_available
+
+
+def _is_bgzipped(path):
+    with open(path, "rb") as f:
+        return f.read(2) == b"\x1f\x8b"
+
+
+def _clip(start_i, end_i, length):
+    start_i = 0 if start_i is None else min(max(start_i, 0), length)
+    end_i = length if end_i is None else min(max(end_i, start_i), length)
+    return start_i, end_i
+
+
+class MmapFastaFile:
+    """
+    Uncompressed, faidx-indexed FASTA file read through a read-only memory map.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.exists(f"{path}.fai"):
+            import pysam
+
+            pysam.faidx(str(path))
+        self.index = {}
+        with open(f"{path}.fai") as fai:
+            for line in fai:
+                name, length, offset, linebases, linewidth = line.split("\t")[:5]
+                self.index[name] = (
+                    int(length),
+                    int(offset),
+                    int(linebases),
+                    int(linewidth),
+                )
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @property
+    def references(self):
+        return list(self.index)
+
+    def _offset(self, offset, linebases, linewidth, i):
+        return offset + (i // linebases) * linewidth + i % linebases
+
+    def fetch(self, ac, start_i=None, end_i=None):
+        length, offset, linebases, linewidth = self.index[ac]
+        start_i, end_i = _clip(start_i, end_i, length)
+        if start_i == end_i:
+            return ""
+        b0 = self._offset(offset, linebases, linewidth, start_i)
+        b1 = self._offset(offset, linebases, linewidth, end_i - 1) + 1
+        return self._mm[b0:b1].replace(b"\n", b"").replace(b"\r", b"").decode("ascii")
+
+
+class BgzipFastaFile:
+    """
+    bgzip-compressed, faidx-indexed FASTA file (.fai and .gzi alongside) read through pysam.
+    """
+
+    def __init__(self, path):
+        import pysam
+
+        self.path = path
+        self._fa = pysam.FastaFile(str(path))
+        self._lengths = dict(zip(self._fa.references, self._fa.lengths))
+
+    @property
+    def references(self):
+        return list(self._lengths)
+
+    def fetch(self, ac, start_i=None, end_i=None):
+        start_i, end_i = _clip(start_i, end_i, self._lengths[ac])
+        if start_i == end_i:
+            return ""
+        return self._fa.fetch(ac, start_i, end_i)
+
+
+def open_fasta(path):
+    """
+    Open a faidx-indexed FASTA file, choosing the reader from whether it is bgzip-compressed.
+    """
+    return BgzipFastaFile(path) if _is_bgzipped(path) else MmapFastaFile(path)
+
+
+class SeqRepoDir:
+    """
+    Local seqrepo directory (e.g. /usr/local/share/seqrepo/2021-01-29) read through biocommons.seqrepo.
+    """
+
+    def __init__(self, root_dir):
+        from biocommons.seqrepo import SeqRepo
+
+        self.root_dir = root_dir
+        # Keep bgzip file handles open between fetches rather than reopening them for every call
+        self._sr = SeqRepo(root_dir, fd_cache_size=64)
+
+    def fetch(self, ac, start_i=None, end_i=None):
+        return self._sr.fetch(ac, start_i, end_i)
+
+
+class LocalSeqUTA(UTAProxy):
+    """
+    Data provider that serves get_seq() from local sequence sources, trying them in order. Accessions not found in
+    any source are fetched from the wrapped provider, unless fallback is False, in which case
+    HGVSDataNotAvailableError is raised. Sequences are uppercased, as those of soft-masked genome FASTA files
+    (e.g. NCBI's) are lowercase in repeats while the hgvs sequence source's are not.
+    """
+
+    def __init__(self, hdp, sources, fallback=True):
+        super().__init__(hdp)
+        self.sources = sources
+        self.fallback = fallback
+        self._ac_source = {}
+        for src in sources:
+            for ac in getattr(src, "references", []):
+                self._ac_source.setdefault(ac, src)
+
+    def _find_source(self, ac):
+        if ac not in self._ac_source:
+            self._ac_source[ac] = None
+            for src in self.sources:
+                if getattr(src, "references", None) is not None:
+                    continue
+                try:
+                    src.fetch(ac, 0, 0)
+                except KeyError:
+                    continue
+                self._ac_source[ac] = src
+                break
+        return self._ac_source[ac]
+
+    def get_seq(self, ac, start_i=None, end_i=None):
+        src = self._find_source(ac)
+        if src is not None:
+            return src.fetch(ac, start_i, end_i).upper()
+        if not self.fallback:
+            raise data_not_available(f"{ac} not found in any local sequence source")
+        return self.hdp.get_seq(ac, start_i, end_i)
+
+
+def open_seq_sources(fasta_paths=(), seqrepo_dirs=()):
+    """
+    Open the FASTA files and seqrepo directories given on the command line, in that order.
+    """
+    return [open_fasta(p) for p in fasta_paths] + [SeqRepoDir(d) for d in seqrepo_dirs]
@@ -0,0 +1,65 @@
+import pysam
+import pytest
+
+from hgvs.exceptions import HGVSDataNotAvailableError
+
+from seq_providers import BgzipFastaFile, LocalSeqUTA, MmapFastaFile, open_fasta
+from synthetic_uta import SyntheticUTA
+
+SEQS = {
+    "NC_000001.11": "ACGTTGCA" * 20 + "GGA",
+    "NM_000001.1": "TTTAAACCCGGG",
+    # Soft-masked repeats
+    "NC_000002.12": "ACGTacgtacgtNNACGT",
+}
+
+
+@pytest.fixture(params=["plain", "bgzip"])
+def fasta_path(request, tmp_path):
+    path = tmp_path / "seqs.fa"
+    with open(path, "w") as f:
+        for ac, seq in SEQS.items():
+            f.write(f">{ac} description\n")
+            for i in range(0, len(seq), 60):
+                f.write(seq[i : i + 60] + "\n")
+    if request.param == "bgzip":
+        pysam.tabix_compress(str(path), str(path) + ".gz")
+        path = tmp_path / "seqs.fa.gz"
+    pysam.faidx(str(path))
+    return path
+
+
+def test_fasta_fetch(fasta_path):
+    fa = open_fasta(fasta_path)
+    assert isinstance(
+        fa, BgzipFastaFile if fasta_path.suffix == ".gz" else MmapFastaFile
+    )
+    assert sorted(fa.references) == sorted(SEQS)
+    for ac, seq in SEQS.items():
+        assert fa.fetch(ac) == seq
+        for start_i, end_i in [
+            (0, 1),
+            (58, 63),
+            (59, 121),
+            (5, len(seq) + 10),
+            (len(seq), None),
+        ]:
+            assert fa.fetch(ac, start_i, end_i) == seq[start_i:end_i]
+    with pytest.raises(KeyError):
+        fa.fetch("NC_000003.12", 0, 10)
+
+
+def test_local_seq_uta(fasta_path):
+    hdp = SyntheticUTA()
+    hdp.add_transcript("NM_999.1", "NC_999.1", ["10="])
+    lhdp = LocalSeqUTA(hdp, [open_fasta(fasta_path)])
+    assert lhdp.get_seq("NM_000001.1", 3, 6) == "AAA"
+    assert lhdp.get_seq("NC_000002.12", 2, 10) == "GTACGTAC"
+    assert hdp.get_seq_calls == 0
+    # Accessions not available locally fall back to the wrapped provider
+    assert lhdp.get_seq("NM_999.1", 0, 10) == hdp.get_seq("NM_999.1", 0, 10)
+    # ... unless fallback is disabled
+    with pytest.raises(HGVSDataNotAvailableError):
+        LocalSeqUTA(hdp, [open_fasta(fasta_path)], fallback=False).get_seq("NM_999.1")
+    # Other provider methods pass through
+    assert lhdp.get_tx_exons("NM_999.1", "NC_999.1", "splign")[0]["cigar"] == "10="
@@ -0,0 +1,222 @@
+"""
+Sharding of a find_mismatch_positions.py run across the nodes of a cluster (--shard i/N), and merging of the shards'
+outputs (merge subcommand).
+
+Every shard computes the same assignment of input rows to shards: rows are grouped by transcript, so each
+transcript's data is fetched by one shard only, and the transcripts are dealt out heaviest first to the least
+loaded shard. A row weighs the number of exons of its alignments, as returned with the alignment fingerprints of the
+run (see incremental.fetch_fingerprints()); ties are broken by a stable hash of tx_ac.
+
+A shard writes its outputs as <infile stem>.shard-<i>-of-<N>.*, and last a manifest,
+<infile stem>.shard-<i>-of-<N>.json, recording the input row positions it scanned and the options its outputs
+depend on. merge_shards() checks that the manifests of all N shards agree and merges the shards' outputs
+line by line, or row group by row group for Parquet: the per-row TSV in input order, the sorted VCF, the Parquet
+dataset and the alignment fingerprints.
+"""
+
+import argparse as ap
+import heapq
+import json
+import os
+import zlib
+
+from incremental import read_fingerprints, write_fingerprints
+from vcf_writer import merge_vcfs
+
+MANIFEST_VERSION = 1
+# Options that all shards of a run must have been run with
+MANIFEST_OPTIONS = ["assemblies", "bgzip", "parquet", "normalize"]
+
+
+def parse_shard(value):
+    """
+    Parse the argument of --shard, "i/N" for the i-th (1-based) of N shards, into (i, N).
+    """
+    try:
+        i, n = (int(v) for v in value.split("/"))
+    except ValueError:
+        raise ap.ArgumentTypeError(f"invalid shard {value!r}, expected i/N")
+    if not 1 <= i <= n:
+        raise ap.ArgumentTypeError(f"invalid shard {value!r}, i must be in 1..N")
+    return i, n
+
+
+def shard_name(stem, i, n):
+    return f"{stem}.shard-{i}-of-{n}"
+
+
+def row_weights(txlist, fingerprints):
+    """
+    Weigh each row of txlist by 1 plus the number of exons of the alignments of its tx_ac to its chr_ac, from the
+    fingerprints DataFrame (see incremental.fetch_fingerprints()), or by 1 if fingerprints is None.
+    """
+    import numpy as np
+
+    if fingerprints is None:
+        return np.ones(len(txlist), dtype=np.int64)
+    exons = (
+        fingerprints.assign(exons=fingerprints["exons"].astype(np.int64))
+        .groupby(["tx_ac", "alt_ac"])["exons"]
+        .sum()
+        .to_dict()
+    )
+    return np.array(
+        [
+            1 + exons.get((tx_ac, chr_ac), 0)
+            for tx_ac, chr_ac in txlist[["tx_ac", "chr_ac"]].itertuples(index=False)
+        ],
+        dtype=np.int64,
+    )
+
+
+def assign_shards(txlist, weights, n):
+    """
+    Assign the rows of txlist, weighing weights, to n shards, keeping the rows of a transcript together. Returns the
+    0-based shard of each row.
+    """
+    import pandas as pd
+
+    tx_weights = pd.Series(weights).groupby(txlist["tx_ac"].to_numpy()).sum()
+    order = sorted(
+        tx_weights.items(),
+        key=lambda item: (-item[1], zlib.crc32(item[0].encode()), item[0]),
+    )
+    loads = [(0, k) for k in range(n)]
+    shard_of = {}
+    for tx_ac, weight in order:
+        load, k = heapq.heappop(loads)
+        shard_of[tx_ac] = k
+        heapq.heappush(loads, (load + weight, k))
+    return txlist["tx_ac"].map(shard_of).to_numpy()
+
+
+def write_manifest(path, shard, rows, **options):
+    """
+    Write the manifest of shard (i, N), which scanned the input rows at positions rows with the MANIFEST_OPTIONS
+    options.
+    """
+    i, n = shard
+    with open(path, "w") as f:
+        json.dump(
+            {
+                "manifest": MANIFEST_VERSION,
+                "shard": i,
+                "shards": n,
+                "rows": [int(r) for r in rows],
+                **{k: options[k] for k in MANIFEST_OPTIONS},
+            },
+            f,
+        )
+        f.write("\n")
+
+
+def read_manifests(stem, shard_dir):
+    """
+    Read the manifests of the shards of the run over input file stem stem from shard_dir, checking that all of them
+    are there and were run with the same options. Returns them in shard order.
+    """
+    manifests = {}
+    for name in sorted(os.listdir(shard_dir)):
+        if not (name.startswith(f"{stem}.shard-") and name.endswith(".json")):
+            continue
+        with open(os.path.join(shard_dir, name)) as f:
+            manifest = json.load(f)
+        if name != shard_name(stem, manifest["shard"], manifest["shards"]) + ".json":
+            continue
+        manifests[manifest["shard"]] = manifest
+    if not manifests:
+        raise ValueError(f"No shard manifests of {stem} in {shard_dir}")
+    n = manifests[min(manifests)]["shards"]
+    if any(m["shards"] != n for m in manifests.values()):
+        raise ValueError(
+            f"Manifests of {stem} in {shard_dir} are of different numbers of shards"
+        )
+    missing = [i for i in range(1, n + 1) if i not in manifests]
+    if missing:
+        raise ValueError(
+            f"Manifests of shards {', '.join(map(str, missing))} of {n} of {stem} are missing in {shard_dir}"
+        )
+    for manifest in manifests.values():
+        for k in MANIFEST_OPTIONS:
+            if manifest[k] != manifests[1][k]:
+                raise ValueError(
+                    f"Shard {manifest['shard']} of {stem} was run with {k}={manifest[k]}, shard 1 with {manifests[1][k]}"
+                )
+    return [manifests[i] for i in range(1, n + 1)]
+
+
+def merge_tsvs(paths, rows, path):
+    """
+    Merge the per-row TSVs of the shards at paths, which hold the input rows at positions rows, into one at path in
+    input order. Returns the position of the first row of each tx_ac.
+    """
+    import numpy as np
+
+    total = sum(len(r) for r in rows)
+    shard_of = np.full(total, -1)
+    for k, positions in enumerate(rows):
+        shard_of[positions] = k
+    if (shard_of < 0).any():
+        raise ValueError(f"Shards don't cover all {total} input rows")
+    files = [open(p) for p in paths]
+    try:
+        header = [f.readline() for f in files][0]
+        tx_order = {}
+        with open(path, "w") as out:
+            out.write(header)
+            for pos, k in enumerate(shard_of.tolist()):
+                line = files[k].readline()
+                tx_order.setdefault(line.split("\t", 2)[1], pos)
+                out.write(line)
+    finally:
+        for f in files:
+            f.close()
+    return tx_order
+
+
+def merge_shards(stem, shard_dir, out_base):
+    """
+    Merge the outputs of all shards of the run over input file stem stem in shard_dir into out_base.* (see the
+    module docstring). Returns the manifests of the shards.
+    """
+    import pandas as pd
+
+    manifests = read_manifests(stem, shard_dir)
+    bases = [
+        os.path.join(shard_dir, shard_name(stem, m["shard"], m["shards"]))
+        for m in manifests
+    ]
+    rows = [m["rows"] for m in manifests]
+    options = manifests[0]
+    vcf_suffix = ".mismatches.vcf" + (".gz" if options["bgzip"] else "")
+    for suffix in [f".{a}" for a in options["assemblies"] or []] or [""]:
+        tx_order = merge_tsvs(
+            [b + suffix + ".mismatches.tsv" for b in bases],
+            rows,
+            out_base + suffix + ".mismatches.tsv",
+        )
+
+        # Records at the same position are ordered by their transcript's first input row, as in a single run
+        def tx_first_row(line):
+            info = line.rsplit("\t", 1)[1]
+            return tx_order.get(info.split(";", 1)[0][len("tx_ac=") :], -1)
+
+        merge_vcfs(
+            [b + suffix + vcf_suffix for b in bases],
+            out_base + suffix + vcf_suffix,
+            tx_first_row,
+        )
+        if options["parquet"]:
+            from parquet_writer import merge_datasets
+
+            merge_datasets(
+                [b + suffix + ".mismatches.parquet" for b in bases],
+                out_base + suffix + ".mismatches.parquet",
+            )
+    fingerprints = [b + ".fingerprints.tsv" for b in bases]
+    if all(os.path.exists(p) for p in fingerprints):
+        write_fingerprints(
+            pd.concat([read_fingerprints(p) for p in fingerprints], ignore_index=True),
+            out_base + ".fingerprints.tsv",
+        )
+    return manifests
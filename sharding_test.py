@@ -0,0 +1,116 @@
+import argparse as ap
+
+import pandas as pd
+import pytest
+
+import find_mismatch_positions
+from assemblies_test import CHR_ACS, two_assembly_hdp
+from find_mismatch_positions import main
+from find_mismatch_positions_test import synthetic_txlist
+from incremental import FINGERPRINT_COLUMNS, read_fingerprints
+from incremental_test import read_output
+from sharding import assign_shards, parse_shard, row_weights
+
+
+def test_parse_shard():
+    assert parse_shard("2/3") == (2, 3)
+    for value in ["0/3", "4/3", "1", "a/b"]:
+        with pytest.raises(ap.ArgumentTypeError):
+            parse_shard(value)
+
+
+def test_assign_shards():
+    txlist = pd.DataFrame(
+        {"tx_ac": ["A", "B", "C", "A", "D", "E"], "chr_ac": ["NC_1"] * 6}
+    )
+    weights = [5, 4, 3, 2, 2, 1]
+    shards = assign_shards(txlist, weights, 2)
+    # A (7) to shard 0, B (4) and C (3) to shard 1, D (2) to shard 0 on a tie, E (1) to shard 1
+    assert shards.tolist() == [0, 1, 1, 0, 0, 1]
+    # Independent of the order of the input
+    assert assign_shards(txlist.iloc[::-1], weights[::-1], 2).tolist() == list(
+        shards[::-1]
+    )
+
+
+def test_assign_shards_by_exons():
+    txlist = pd.DataFrame(
+        {"tx_ac": ["A", "B", "C", "D"], "chr_ac": ["NC_1", "NC_1", "NC_1", "NC_2"]}
+    )
+    fingerprints = pd.DataFrame(
+        [
+            ("A", "NC_1", "splign", "f1", "40"),
+            ("A", "NC_1", "blat", "f2", "38"),
+            ("B", "NC_1", "splign", "f3", "1"),
+            ("C", "NC_1", "splign", "f4", "30"),
+            ("D", "NC_1", "splign", "f5", "20"),
+        ],
+        columns=FINGERPRINT_COLUMNS,
+    )
+    weights = row_weights(txlist, fingerprints)
+    # D has no alignment to NC_2
+    assert weights.tolist() == [79, 2, 31, 1]
+    # A (79) outweighs all the others together (34)
+    assert assign_shards(txlist, weights, 2).tolist() == [0, 1, 1, 1]
+
+
+@pytest.mark.parametrize(
+    "args, suffixes",
+    [
+        (["--parquet", "--write-fingerprints"], [""]),
+        (
+            ["--write-fingerprints", "--assembly", "A1", "--assembly", "A2"],
+            [".A1", ".A2"],
+        ),
+    ],
+)
+def test_sharded_run(tmp_path, monkeypatch, args, suffixes):
+    monkeypatch.setattr(
+        find_mismatch_positions, "UTAMismatchProvider", lambda conn: two_assembly_hdp()
+    )
+    monkeypatch.setattr(
+        find_mismatch_positions, "assembly_chr_acs", lambda assemblies: CHR_ACS
+    )
+    for d in ["full", "shards"]:
+        (tmp_path / d).mkdir()
+        synthetic_txlist().to_csv(tmp_path / d / "txlist.tsv", sep="\t")
+    monkeypatch.chdir(tmp_path / "full")
+    main(args + ["txlist.tsv"])
+
+    monkeypatch.chdir(tmp_path / "shards")
+    for i in [3, 1]:
+        main(args + ["--shard", f"{i}/3", "txlist.tsv"])
+    # Not all shards are finished
+    with pytest.raises(SystemExit):
+        main(["merge", "txlist.tsv"])
+    main(args + ["--shard", "2/3", "txlist.tsv"])
+    shard_rows = [
+        len(pd.read_csv(f"txlist.shard-{i}-of-3{suffixes[0]}.mismatches.tsv", sep="\t"))
+        for i in [1, 2, 3]
+    ]
+    assert sum(shard_rows) == len(synthetic_txlist()) and min(shard_rows) > 0
+
+    (tmp_path / "merged").mkdir()
+    monkeypatch.chdir(tmp_path / "merged")
+    main(["merge", "--shard-dir", "../shards", "txlist.tsv"])
+    for suffix in suffixes:
+        for f in ["mismatches.tsv", "mismatches.vcf"]:
+            assert read_output(f"txlist{suffix}.{f}") == read_output(
+                f"../full/txlist{suffix}.{f}"
+            )
+    pd.testing.assert_frame_equal(
+        read_fingerprints("txlist.fingerprints.tsv")
+        .sort_values(["tx_ac", "alt_ac", "alt_aln_method"])
+        .reset_index(drop=True),
+        read_fingerprints("../full/txlist.fingerprints.tsv")
+        .sort_values(["tx_ac", "alt_ac", "alt_aln_method"])
+        .reset_index(drop=True),
+    )
+    if "--parquet" in args:
+        columns = ["alt_ac", "pos", "vcf_id"]
+        merged = pd.read_parquet("txlist.mismatches.parquet")
+        full = pd.read_parquet("../full/txlist.mismatches.parquet")
+        assert (
+            merged.sort_values(columns)[columns].values.tolist()
+            == full.sort_values(columns)[columns].values.tolist()
+        )
@@ -0,0 +1,402 @@
+"""
+In-memory stand-in for the hgvs UTA data provider, populated with synthetic transcripts whose
+sequences are consistent with arbitrary exon CIGAR strings. Used by the tests and benchmarks so
+they can exercise the mismatch extraction logic without a live UTA database or sequence source.
+"""
+
+import random
+import re
+
+from hgvs.exceptions import HGVSDataNotAvailableError
+
+from uta_provider import Row, _queries, aln_fingerprint
+
+TX_EXON_COLUMNS = [
+    "hgnc",
+    "tx_ac",
+    "alt_ac",
+    "alt_aln_method",
+    "alt_strand",
+    "ord",
+    "tx_start_i",
+    "tx_end_i",
+    "alt_start_i",
+    "alt_end_i",
+    "cigar",
+    "tx_aseq",
+    "alt_aseq",
+    "tx_exon_set_id",
+    "alt_exon_set_id",
+    "tx_exon_id",
+    "alt_exon_id",
+    "exon_aln_id",
+]
+
+_COMPLEMENT = str.maketrans("ACGTacgt", "TGCAtgca")
+
+
+def reverse_complement(seq):
+    return seq.translate(_COMPLEMENT)[::-1]
+
+
+def _parse_cigars(cigars):
+    return [
+        [(int(n), op) for n, op in re.findall(r"([0-9]+)([A-Z=])", cigar)]
+        for cigar in cigars
+    ]
+
+
+class SyntheticUTA:
+    """
+    Data provider serving get_tx_mapping_options(), get_tx_exons() and get_seq() from synthetic alignments
+    added with add_transcript() and add_alignment(), plus the uta_provider queries through _fetchall() and stream_nonperfect_exons().
+    Counts get_seq() calls in get_seq_calls.
+    """
+
+    def __init__(self, seed=0):
+        self._rng = random.Random(seed)
+        self._chr_chunks = {}
+        self._chr_len = {}
+        self._seqs = {}
+        self._tx_exons = {}
+        self._similar = set()
+        self._next_id = 1
+        self.get_seq_calls = 0
+
+    def _random_seq(self, n):
+        return "".join(self._rng.choice("ACGT") for _ in range(n))
+
+    def _append_chr(self, alt_ac, seq):
+        start = self._chr_len.get(alt_ac, 0)
+        self._chr_chunks.setdefault(alt_ac, []).append(seq)
+        self._chr_len[alt_ac] = start + len(seq)
+        self._seqs.pop(alt_ac, None)
+        return start
+
+    def add_transcript(
+        self,
+        tx_ac,
+        alt_ac,
+        cigars,
+        alt_strand=1,
+        alt_aln_method="splign",
+        intron_len=50,
+        flank_len=100,
+        gene="GENE",
+    ):
+        """
+        Add a transcript aligned to alt_ac with one exon per CIGAR string (given in transcript order) and return its exon rows.
+
+        UTA CIGAR semantics are followed: "=" and "X" consume both sequences, "I" consumes only the genome and "D" consumes only the transcript.
+        """
+        parsed = _parse_cigars(cigars)
+        alt_lens = [sum(n for n, op in ops if op in "=MXI") for ops in parsed]
+        region, offset, rel_starts = self._add_region(
+            alt_ac,
+            lambda ex: self._random_seq(alt_lens[ex]),
+            len(cigars),
+            alt_strand,
+            intron_len,
+            flank_len,
+        )
+
+        # Derive the transcript sequence by walking each CIGAR over the genomic exon in transcript orientation
+        tx_seq = []
+        for ex, ops in enumerate(parsed):
+            alt_seq = region[rel_starts[ex] : rel_starts[ex] + alt_lens[ex]]
+            if alt_strand == -1:
+                alt_seq = reverse_complement(alt_seq)
+            i = 0
+            ex_seq = []
+            for n, op in ops:
+                if op in "=M":
+                    ex_seq.append(alt_seq[i : i + n])
+                    i += n
+                elif op == "X":
+                    ex_seq.append(self._substitute(alt_seq[i : i + n]))
+                    i += n
+                elif op == "I":
+                    i += n
+                elif op == "D":
+                    ex_seq.append(self._random_seq(n))
+            tx_seq.append("".join(ex_seq))
+        self._seqs[tx_ac] = "".join(tx_seq)
+        return self._add_exon_rows(
+            tx_ac,
+            alt_ac,
+            alt_aln_method,
+            alt_strand,
+            gene,
+            cigars,
+            [len(ex_seq) for ex_seq in tx_seq],
+            alt_lens,
+            offset,
+            rel_starts,
+        )
+
+    def add_alignment(
+        self,
+        tx_ac,
+        alt_ac,
+        cigars,
+        alt_strand=1,
+        alt_aln_method="blat",
+        intron_len=50,
+        flank_len=100,
+        gene="GENE",
+    ):
+        """
+        Add another alignment of transcript tx_ac, added before, to a new region of alt_ac with one exon per CIGAR
+        string, and return its exon rows. The genomic exons are derived from the transcript sequence, which is kept,
+        so the CIGAR strings must cover all of it.
+        """
+        parsed = _parse_cigars(cigars)
+        tx_lens = [sum(n for n, op in ops if op in "=MXD") for ops in parsed]
+        tx_seq = self._seqs[tx_ac]
+        if sum(tx_lens) != len(tx_seq):
+            raise ValueError(
+                f"CIGAR strings cover {sum(tx_lens)} of the {len(tx_seq)} bases of {tx_ac}"
+            )
+        # Derive the genomic exons by walking each CIGAR over the transcript exon, in transcript orientation
+        alt_seqs = []
+        tx_start_i = 0
+        for ex, ops in enumerate(parsed):
+            ex_seq = tx_seq[tx_start_i : tx_start_i + tx_lens[ex]]
+            tx_start_i += tx_lens[ex]
+            i = 0
+            alt_seq = []
+            for n, op in ops:
+                if op in "=M":
+                    alt_seq.append(ex_seq[i : i + n])
+                    i += n
+                elif op == "X":
+                    alt_seq.append(self._substitute(ex_seq[i : i + n]))
+                    i += n
+                elif op == "I":
+                    alt_seq.append(self._random_seq(n))
+                elif op == "D":
+                    i += n
+            alt_seq = "".join(alt_seq)
+            alt_seqs.append(
+                reverse_complement(alt_seq) if alt_strand == -1 else alt_seq
+            )
+        _, offset, rel_starts = self._add_region(
+            alt_ac,
+            alt_seqs.__getitem__,
+            len(cigars),
+            alt_strand,
+            intron_len,
+            flank_len,
+        )
+        return self._add_exon_rows(
+            tx_ac,
+            alt_ac,
+            alt_aln_method,
+            alt_strand,
+            gene,
+            cigars,
+            tx_lens,
+            [len(alt_seq) for alt_seq in alt_seqs],
+            offset,
+            rel_starts,
+        )
+
+    def _substitute(self, seq):
+        return "".join(
+            self._rng.choice([b for b in "ACGT" if b != base]) for base in seq
+        )
+
+    def _add_region(self, alt_ac, exon_seq, n_exons, alt_strand, intron_len, flank_len):
+        """
+        Append a region to alt_ac with the genomic sequences exon_seq(ex) of exons 0..n_exons-1 laid out in genome
+        order, separated by introns and surrounded by flanking sequence. Returns the region, its offset on alt_ac
+        and the start of each exon in it.
+        """
+        genome_order = list(range(n_exons))
+        if alt_strand == -1:
+            genome_order.reverse()
+        region = [self._random_seq(flank_len)]
+        rel_starts = {}
+        pos = flank_len
+        for k, ex in enumerate(genome_order):
+            if k > 0:
+                region.append(self._random_seq(intron_len))
+                pos += intron_len
+            rel_starts[ex] = pos
+            seq = exon_seq(ex)
+            region.append(seq)
+            pos += len(seq)
+        region.append(self._random_seq(flank_len))
+        region = "".join(region)
+        return region, self._append_chr(alt_ac, region), rel_starts
+
+    def _add_exon_rows(
+        self,
+        tx_ac,
+        alt_ac,
+        alt_aln_method,
+        alt_strand,
+        gene,
+        cigars,
+        tx_lens,
+        alt_lens,
+        offset,
+        rel_starts,
+    ):
+        tx_start_i = 0
+        rows = []
+        for ex, cigar in enumerate(cigars):
+            alt_start_i = offset + rel_starts[ex]
+            exon_id = self._next_id
+            self._next_id += 1
+            rows.append(
+                Row(
+                    TX_EXON_COLUMNS,
+                    [
+                        gene,
+                        tx_ac,
+                        alt_ac,
+                        alt_aln_method,
+                        alt_strand,
+                        ex,
+                        tx_start_i,
+                        tx_start_i + tx_lens[ex],
+                        alt_start_i,
+                        alt_start_i + alt_lens[ex],
+                        cigar,
+                        None,
+                        None,
+                        1,
+                        2,
+                        exon_id,
+                        exon_id + 1,
+                        exon_id + 2,
+                    ],
+                )
+            )
+            tx_start_i += tx_lens[ex]
+        rows.sort(key=lambda r: r["alt_start_i"])
+        self._tx_exons[(tx_ac, alt_ac, alt_aln_method)] = rows
+        return rows
+
+    def add_equivalent_transcript(self, tx_ac, like_tx_ac):
+        """
+        Add a transcript with the same sequence and alignments as like_tx_ac, but exon ids of its own, and report
+        the two as similar.
+        """
+        self._seqs[tx_ac] = self._seqs[like_tx_ac]
+        for (tx, alt_ac, alt_aln_method), rows in list(self._tx_exons.items()):
+            if tx != like_tx_ac:
+                continue
+            new_rows = []
+            for r in rows:
+                values = dict(zip(TX_EXON_COLUMNS, r))
+                values["tx_ac"] = tx_ac
+                for c in ["tx_exon_id", "alt_exon_id", "exon_aln_id"]:
+                    values[c] = self._next_id
+                    self._next_id += 1
+                new_rows.append(Row(TX_EXON_COLUMNS, list(values.values())))
+            self._tx_exons[(tx_ac, alt_ac, alt_aln_method)] = new_rows
+        self.add_similar_transcripts(tx_ac, like_tx_ac)
+
+    def copy_chromosome(self, alt_ac, new_alt_ac, offset):
+        """
+        Add chromosome new_alt_ac with the sequence of alt_ac after offset bases of its own, like the same
+        chromosome in another assembly, and the alignments of all transcripts to alt_ac shifted onto it.
+        """
+        self._append_chr(new_alt_ac, self._random_seq(offset))
+        for chunk in self._chr_chunks[alt_ac]:
+            self._append_chr(new_alt_ac, chunk)
+        for (tx_ac, ac, alt_aln_method), rows in list(self._tx_exons.items()):
+            if ac != alt_ac:
+                continue
+            new_rows = []
+            for r in rows:
+                values = dict(zip(TX_EXON_COLUMNS, r))
+                values["alt_ac"] = new_alt_ac
+                values["alt_start_i"] += offset
+                values["alt_end_i"] += offset
+                new_rows.append(Row(TX_EXON_COLUMNS, list(values.values())))
+            self._tx_exons[(tx_ac, new_alt_ac, alt_aln_method)] = new_rows
+
+    def add_similar_transcripts(self, tx_ac1, tx_ac2):
+        """
+        Report tx_ac1 and tx_ac2 as having the same exon structure in tx_similarity_v. The bulk_similar_transcripts
+        query only returns them if their sequences are identical too.
+        """
+        self._similar |= {(tx_ac1, tx_ac2), (tx_ac2, tx_ac1)}
+
+    def get_seq(self, ac, start_i=None, end_i=None):
+        self.get_seq_calls += 1
+        if ac not in self._seqs:
+            self._seqs[ac] = "".join(self._chr_chunks[ac])
+        return self._seqs[ac][start_i:end_i]
+
+    def get_tx_mapping_options(self, tx_ac):
+        return [
+            Row(["tx_ac", "alt_ac", "alt_aln_method"], list(k))
+            for k in self._tx_exons
+            if k[0] == tx_ac
+        ]
+
+    def get_tx_exons(self, tx_ac, alt_ac, alt_aln_method):
+        rows = self._tx_exons.get((tx_ac, alt_ac, alt_aln_method))
+        if not rows:
+            raise HGVSDataNotAvailableError(
+                f"No tx_exons for (tx_ac={tx_ac},alt_ac={alt_ac},alt_aln_method={alt_aln_method})"
+            )
+        return rows
+
+    def get_tx_nonperfect_exons(self, tx_ac, alt_ac, alt_aln_method):
+        return [
+            r
+            for r in self.get_tx_exons(tx_ac, alt_ac, alt_aln_method)
+            if r["tx_start_i"] == 0 or not re.fullmatch("^[0-9]+=$", r["cigar"])
+        ]
+
+    def stream_nonperfect_exons(self, alt_acs, alt_aln_methods, itersize=10000):
+        for k in sorted(self._tx_exons):
+            if k[1] in alt_acs and k[2] in alt_aln_methods:
+                yield from self.get_tx_nonperfect_exons(*k)
+
+    def _fetchall(self, sql, args):
+        if sql == _queries["bulk_tx_mapping_options"]:
+            return [
+                Row(["tx_ac", "alt_ac", "alt_aln_method"], list(k))
+                for k in sorted(self._tx_exons)
+                if k[0] in args[0]
+            ]
+        if sql in (_queries["bulk_tx_exons"], _queries["bulk_tx_nonperfect_exons"]):
+            pairs = set(zip(*args))
+            rows = [
+                r
+                for k in sorted(self._tx_exons)
+                if k[:2] in pairs
+                for r in (
+                    self.get_tx_nonperfect_exons(*k)
+                    if sql == _queries["bulk_tx_nonperfect_exons"]
+                    else self._tx_exons[k]
+                )
+            ]
+            return rows
+        if sql == _queries["bulk_aln_fingerprints"]:
+            return [
+                Row(
+                    ["tx_ac", "alt_ac", "alt_aln_method", "fingerprint", "exons"],
+                    list(k)
+                    + [aln_fingerprint(self._tx_exons[k]), len(self._tx_exons[k])],
+                )
+                for k in sorted(self._tx_exons)
+                if k[0] in args[0]
+            ]
+        if sql == _queries["bulk_similar_transcripts"]:
+            return [
+                Row(["tx_ac1", "tx_ac2"], [tx_ac1, tx_ac2])
+                for tx_ac1, tx_ac2 in sorted(self._similar)
+                if tx_ac1 in args[0]
+                and tx_ac2 in args[1]
+                and self._seqs.get(tx_ac1) == self._seqs.get(tx_ac2)
+            ]
+        if sql == _queries["tx_nonperfect_exons"]:
+            return self.get_tx_nonperfect_exons(*args)
+        raise NotImplementedError(sql)
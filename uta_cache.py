@@ -0,0 +1,193 @@
+"""
+Persistent on-disk cache of UTA query results and sequences, so repeated runs against the same UTA release
+don't touch the network.
+
+Results are stored in a SQLite database keyed by the UTA schema name (e.g. uta_20210129b), the data provider
+method and its arguments. The database has a size cap; when it is exceeded, the least recently used entries
+are evicted.
+"""
+
+from collections import Counter
+import pickle
+import sqlite3
+import time
+
+from uta_provider import Row, UTAProxy
+
+
+class SQLiteCache:
+    """
+    Size-capped key/value store in a SQLite database with least-recently-used eviction.
+    """
+
+    def __init__(self, path, max_bytes=2 * 1024**3):
+        self.path = path
+        self.max_bytes = max_bytes
+        # Autocommit, so that entries written by worker processes are never lost; with WAL journaling and
+        # synchronous = normal, commits don't fsync
+        self._conn = sqlite3.connect(
+            path, timeout=60, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("pragma journal_mode = wal")
+        self._conn.execute("pragma synchronous = normal")
+        self._conn.execute(
+            "create table if not exists cache (key text primary key, value blob not null, size integer not null, atime real not null)"
+        )
+        self._conn.execute("create index if not exists cache_atime on cache (atime)")
+        self._size = self._conn.execute(
+            "select coalesce(sum(size), 0) from cache"
+        ).fetchone()[0]
+        self.evictions = 0
+
+    def get(self, key):
+        row = self._conn.execute(
+            "select value from cache where key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        self._conn.execute(
+            "update cache set atime = ? where key = ?", (time.time(), key)
+        )
+        return pickle.loads(row[0])
+
+    def put(self, key, value):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        old = self._conn.execute(
+            "select size from cache where key = ?", (key,)
+        ).fetchone()
+        self._conn.execute(
+            "insert or replace into cache (key, value, size, atime) values (?, ?, ?, ?)",
+            (key, blob, len(blob), time.time()),
+        )
+        self._size += len(blob) - (old[0] if old else 0)
+        if self._size > self.max_bytes:
+            self.evict(int(self.max_bytes * 0.9))
+
+    def evict(self, target_bytes):
+        """
+        Delete least recently used entries until the cache holds at most target_bytes.
+        """
+        while self._size > target_bytes:
+            rows = self._conn.execute(
+                "select key, size from cache order by atime limit 100"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self._size <= target_bytes:
+                    break
+                self._conn.execute("delete from cache where key = ?", (key,))
+                self._size -= size
+                self.evictions += 1
+
+    def close(self):
+        self._conn.close()
+
+
+def _pack_rows(rows):
+    """
+    Convert DictRows to plain (columns, values) tuples that can be pickled without psycopg2.
+    """
+    if not rows:
+        return (None, [])
+    return (list(rows[0].keys()), [list(r) for r in rows])
+
+
+def _unpack_rows(packed):
+    columns, values = packed
+    return [Row(columns, v) for v in values]
+
+
+class CachedUTA(UTAProxy):
+    """
+    Data provider that caches the results of the UTA queries and get_seq() calls made by find_mismatch_positions.py
+    in a SQLiteCache. Keys include the UTA schema name, so caches for different releases never mix; it is given
+    rather than asked of hdp, which would connect to the database. Hit and miss counts per method are kept in stats.
+    """
+
+    def __init__(self, hdp, cache, schema):
+        super().__init__(hdp)
+        self.cache = cache
+        self.schema = schema
+        self.stats = Counter()
+
+    def data_version(self):
+        return self.schema
+
+    def _cached(self, method, args, pack=None, unpack=None):
+        # str() rather than repr(), so that e.g. numpy and Python integers give the same key
+        key = "\t".join([self.schema, method] + [str(a) for a in args])
+        value = self.cache.get(key)
+        if value is not None:
+            self.stats[f"cache_hits.{method}"] += 1
+            return unpack(value) if unpack else value
+        self.stats[f"cache_misses.{method}"] += 1
+        # The method is only looked up on a miss, so that e.g. a DeferredUTA underneath doesn't connect for hits
+        result = getattr(self.hdp, method)(*args)
+        self.cache.put(key, pack(result) if pack else result)
+        return result
+
+    def _fetchall(self, sql, *args):
+        # Used by the set-based queries in uta_provider
+        return self._cached(
+            "_fetchall",
+            (sql,) + tuple(args),
+            _pack_rows,
+            _unpack_rows,
+        )
+
+    def get_tx_mapping_options(self, tx_ac):
+        return self._cached(
+            "get_tx_mapping_options",
+            (tx_ac,),
+            _pack_rows,
+            _unpack_rows,
+        )
+
+    def get_similar_transcripts(self, tx_ac):
+        return self._cached(
+            "get_similar_transcripts",
+            (tx_ac,),
+            _pack_rows,
+            _unpack_rows,
+        )
+
+    def get_tx_exons(self, tx_ac, alt_ac, alt_aln_method):
+        return self._cached(
+            "get_tx_exons",
+            (tx_ac, alt_ac, alt_aln_method),
+            _pack_rows,
+            _unpack_rows,
+        )
+
+    def get_tx_nonperfect_exons(self, tx_ac, alt_ac, alt_aln_method):
+        return self._cached(
+            "get_tx_nonperfect_exons",
+            (tx_ac, alt_ac, alt_aln_method),
+            _pack_rows,
+            _unpack_rows,
+        )
+
+    def get_seq(self, ac, start_i=None, end_i=None):
+        return self._cached("get_seq", (ac, start_i, end_i))
+
+
+def format_cache_stats(stats):
+    """
+    Summarize the cache hit/miss counters in stats as one line per method.
+    """
+    methods = sorted(
+        {
+            k.split(".", 1)[1]
+            for k in stats
+            if k.startswith(("cache_hits.", "cache_misses."))
+        }
+    )
+    lines = []
+    for method in methods:
+        hits = stats[f"cache_hits.{method}"]
+        misses = stats[f"cache_misses.{method}"]
+        lines.append(
+            f"Cache {method}: {hits} hits, {misses} misses ({hits / (hits + misses):.1%} hit rate)"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,81 @@
+import numpy as np
+
+import find_mismatch_positions
+from find_mismatch_positions import main, scan_txlist
+from find_mismatch_positions_test import synthetic_hdp, synthetic_txlist
+from uta_cache import CachedUTA, SQLiteCache, format_cache_stats
+
+
+def test_cached_scan(tmp_path):
+    path = tmp_path / "cache.sqlite"
+    txlist = synthetic_txlist()
+    hdp = synthetic_hdp()
+    has_aln, mm, _ = scan_txlist(hdp, txlist)
+
+    # First run populates the cache
+    chdp = CachedUTA(synthetic_hdp(), SQLiteCache(path), schema="uta_test")
+    cached_has_aln, cached_mm, first_stats = scan_txlist(chdp, txlist)
+    assert cached_has_aln == has_aln
+    assert cached_mm.to_df().equals(mm.to_df())
+    assert first_stats["cache_misses.get_seq"] > 0
+    chdp.cache.close()
+
+    # Second run is served entirely from the cache
+    chdp = CachedUTA(synthetic_hdp(), SQLiteCache(path), schema="uta_test")
+    chdp.hdp.get_seq_calls = 0
+    cached_has_aln, cached_mm, stats = scan_txlist(chdp, txlist)
+    assert cached_has_aln == has_aln
+    assert cached_mm.to_df().to_csv() == mm.to_df().to_csv()
+    assert not any(k.startswith("cache_misses.") for k in stats)
+    assert chdp.hdp.get_seq_calls == 0
+    assert "get_seq" in format_cache_stats(stats)
+
+    # A different UTA schema doesn't share entries
+    chdp = CachedUTA(synthetic_hdp(), SQLiteCache(path), schema="uta_other")
+    assert scan_txlist(chdp, txlist)[2] == first_stats
+
+
+def test_cached_run_does_not_connect(tmp_path, monkeypatch):
+    connections = []
+    monkeypatch.setattr(
+        find_mismatch_positions,
+        "connect_uta",
+        lambda: connections.append(1) or synthetic_hdp(),
+    )
+    monkeypatch.setenv("UTA_DB_URL", "postgresql://localhost/uta/uta_test")
+    monkeypatch.chdir(tmp_path)
+    synthetic_txlist().to_csv("txlist.tsv", sep="\t")
+    main(["--cache", "cache.sqlite", "txlist.tsv"])
+    assert connections == [1]
+    with open("txlist.mismatches.tsv") as f:
+        first = f.read()
+    # The second run against the same UTA release is served from the cache alone
+    main(["--cache", "cache.sqlite", "--stats", "txlist.tsv"])
+    assert connections == [1]
+    with open("txlist.mismatches.tsv") as f:
+        assert f.read() == first
+
+
+def test_cache_keys_and_rows(tmp_path):
+    chdp = CachedUTA(synthetic_hdp(), SQLiteCache(tmp_path / "c.sqlite"), "uta_test")
+    assert chdp.get_seq("NM_1.1", 1, 5) == chdp.get_seq(
+        "NM_1.1", np.int64(1), np.int64(5)
+    )
+    assert chdp.stats["cache_hits.get_seq"] == 1
+    rows = chdp.get_tx_exons("NM_1.1", "NC_1.1", "splign")
+    cached_rows = chdp.get_tx_exons("NM_1.1", "NC_1.1", "splign")
+    assert [r["cigar"] for r in cached_rows] == [r["cigar"] for r in rows]
+    assert [list(r) for r in cached_rows] == [list(r) for r in rows]
+
+
+def test_eviction(tmp_path):
+    cache = SQLiteCache(tmp_path / "c.sqlite", max_bytes=10_000)
+    for i in range(100):
+        cache.put(f"k{i}", "A" * 500)
+        # Keep the first key recently used
+        assert cache.get("k0") is not None
+    assert cache.evictions > 0
+    assert cache.get("k1") is None
+    assert cache.get("k99") is not None
+    cache.close()
+    assert SQLiteCache(tmp_path / "c.sqlite", max_bytes=10_000)._size <= 10_000
@@ -0,0 +1,137 @@
+import pytest
+
+from Bio.Seq import Seq
+
+from cigar_reference import SeqWindow
+from find_mismatch_positions import (
+    MISMATCH_COLUMNS,
+    uta_cigar_to_mismatch_vcf,
+    uta_get_tx_exons_df,
+)
+from synthetic_uta import SyntheticUTA, reverse_complement
+
+CIGARS = [
+    "47=1X195=",
+    "21=1X116=1X54=1X79=2X27=1X54=1X6=1X13=1X2=1X34=1X69=1X7=1X3=2X216=1X50=1X9=1X32=1X83=",
+    "980=1D2=",
+    "4=9D149=",
+    "459=14D1318=",
+    "136=1I129=",
+    "14=1X11=6I26=",
+    "52=6I14=",
+    "666=1I39=1X404=",
+    "498=1D37=3I1809=",
+    "3=1X" * 300 + "3=",
+]
+
+
+def get_exon(hdp, tx_ac, chr_ac, ex_ord):
+    exdf = uta_get_tx_exons_df(hdp, tx_ac, chr_ac, "splign")
+    return exdf.loc[exdf["ord"] == ex_ord].squeeze()
+
+
+def apply_records(seq, resultdf):
+    """
+    Apply VCF records (1-based POS, REF, ALT) to a sequence, checking that each REF matches.
+    """
+    for _, rec in resultdf.sort_values("POS", ascending=False).iterrows():
+        start = rec["POS"] - 1
+        assert seq[start : start + len(rec["REF"])] == rec["REF"]
+        seq = seq[:start] + rec["ALT"] + seq[start + len(rec["REF"]) :]
+    return seq
+
+
+@pytest.mark.parametrize("alt_strand", [1, -1])
+@pytest.mark.parametrize("cigar", CIGARS)
+def test_records_reproduce_transcript(cigar, alt_strand):
+    """
+    Applying the derived VCF records to the genome must yield the transcript's exon sequence.
+    """
+    hdp = SyntheticUTA()
+    hdp.add_transcript("NM_1.1", "NC_1.1", ["20=", cigar, "20="], alt_strand)
+    row = get_exon(hdp, "NM_1.1", "NC_1.1", 1)
+    resultdf = uta_cigar_to_mismatch_vcf(hdp, "ABC", row)
+
+    assert list(resultdf.columns) == MISMATCH_COLUMNS
+    assert (resultdf.index == "ABC").all()
+    assert len(resultdf) == cigar.count("X") + cigar.count("I") + cigar.count("D")
+
+    chr_seq = hdp.get_seq("NC_1.1")
+    tx_ex_seq = hdp.get_seq("NM_1.1", row["tx_start_i"], row["tx_end_i"])
+    if alt_strand == -1:
+        tx_ex_seq = reverse_complement(tx_ex_seq)
+    assert (
+        apply_records(chr_seq, resultdf)
+        == chr_seq[: row["alt_start_i"]] + tx_ex_seq + chr_seq[row["alt_end_i"] :]
+    )
+
+
+@pytest.mark.parametrize("alt_strand", [1, -1])
+def test_one_seq_fetch_per_exon(alt_strand):
+    hdp = SyntheticUTA()
+    hdp.add_transcript("NM_1.1", "NC_1.1", ["20=", CIGARS[1], "20="], alt_strand)
+    row = get_exon(hdp, "NM_1.1", "NC_1.1", 1)
+    hdp.get_seq_calls = 0
+    resultdf = uta_cigar_to_mismatch_vcf(hdp, "ABC", row)
+    assert len(resultdf) == CIGARS[1].count("X")
+    assert hdp.get_seq_calls == 2
+
+
+def test_seq_window_matches_get_seq():
+    """
+    Local slices (and their reverse complements) must match hdp.get_seq(), including past the ends of the window and sequence.
+    """
+    hdp = SyntheticUTA()
+    hdp.add_transcript("NM_1.1", "NC_1.1", ["30="], flank_len=0)
+    n = len(hdp.get_seq("NM_1.1"))
+    for start_i, end_i in [(0, 10), (-1, 12), (20, n + 1), (n - 3, n + 5)]:
+        win = SeqWindow(hdp, "NM_1.1", start_i, end_i)
+        for a in range(start_i - 1, end_i + 2):
+            for b in range(a, end_i + 2):
+                expect = hdp.get_seq("NM_1.1", a, b)
+                assert win.get_seq(a, b) == expect
+                assert win.get_seq_rc(a, b) == str(Seq(expect).reverse_complement())
+
+
+@pytest.mark.parametrize("alt_strand", [1, -1])
+@pytest.mark.parametrize(
+    "cigar, records",
+    [
+        ("10=2I1X10=1X5=", 2),
+        ("5=1X1I2D3=", 1),
+        ("4=2D1I1X6=1D3X1=", 2),
+        ("3X1D4=", 1),
+    ],
+)
+def test_contiguous_events_make_one_delins(cigar, records, alt_strand):
+    """
+    A run of adjacent mismatches and indels is merged into a single delins record, anchored on the preceding base,
+    and the rest of the exon is still processed.
+    """
+    hdp = SyntheticUTA()
+    hdp.add_transcript("NM_1.1", "NC_1.1", ["20=", cigar, "20="], alt_strand)
+    row = get_exon(hdp, "NM_1.1", "NC_1.1", 1)
+    resultdf = uta_cigar_to_mismatch_vcf(hdp, "ABC", row)
+    assert len(resultdf) == records
+    for _, rec in resultdf.iterrows():
+        if len(rec["REF"]) != len(rec["ALT"]):
+            assert rec["REF"][0] == rec["ALT"][0]
+
+    chr_seq = hdp.get_seq("NC_1.1")
+    tx_ex_seq = hdp.get_seq("NM_1.1", row["tx_start_i"], row["tx_end_i"])
+    if alt_strand == -1:
+        tx_ex_seq = reverse_complement(tx_ex_seq)
+    assert (
+        apply_records(chr_seq, resultdf)
+        == chr_seq[: row["alt_start_i"]] + tx_ex_seq + chr_seq[row["alt_end_i"] :]
+    )
+
+
+def test_no_events():
+    hdp = SyntheticUTA()
+    hdp.add_transcript("NM_1.1", "NC_1.1", ["20="])
+    resultdf = uta_cigar_to_mismatch_vcf(
+        hdp, "ABC", get_exon(hdp, "NM_1.1", "NC_1.1", 0)
+    )
+    assert resultdf.empty
+    assert list(resultdf.columns) == MISMATCH_COLUMNS
@@ -1,13 +1,51 @@
-# import pytest
-from find_mismatch_positions_v2 import uta_cigar_to_mismatch_vcf, uta_get_tx_exons_df
+import os
 
-import hgvs.dataproviders.uta
+import psycopg2
+import pytest
+from find_mismatch_positions import (
+    connect_uta,
+    uta_cigar_to_mismatch_vcf,
+    uta_get_tx_exons_df,
+)
 
-# Initialize UTA connection
-hdp = hgvs.dataproviders.uta.connect()  # uta_20210129b used in development
+from uta_snapshot import RecordingUTA, SnapshotUTA
 
+# Snapshot the tests run from by default, recorded with UTA_SNAPSHOT set to this path
+DEFAULT_SNAPSHOT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "uta_cigar_to_vcf_test.snapshot.json.gz"
+)
 
-def test_single_mismatch_pos_strand():
+
+def connect():
+    """
+    Data provider for these tests. If UTA_SNAPSHOT (by default DEFAULT_SNAPSHOT) names an existing snapshot file,
+    the tests run from it without database access. Otherwise UTA is connected to (uta_20210129b used in
+    development), and if UTA_SNAPSHOT is set, everything fetched is recorded and written to it when the tests
+    finish. Without a snapshot, the tests are skipped if the database is unreachable, except in CI (CI set), where
+    they fail.
+    """
+    snapshot = os.environ.get("UTA_SNAPSHOT")
+    if os.path.exists(snapshot or DEFAULT_SNAPSHOT):
+        return SnapshotUTA(snapshot or DEFAULT_SNAPSHOT)
+    try:
+        hdp = connect_uta()
+    except psycopg2.OperationalError as e:
+        message = f"No UTA snapshot at {snapshot or DEFAULT_SNAPSHOT} and UTA is unreachable: {e}"
+        if os.environ.get("CI"):
+            pytest.fail(message)
+        pytest.skip(message)
+    return RecordingUTA(hdp) if snapshot else hdp
+
+
+@pytest.fixture(scope="module")
+def hdp():
+    hdp = connect()
+    yield hdp
+    if isinstance(hdp, RecordingUTA):
+        hdp.save(os.environ["UTA_SNAPSHOT"], hdp.data_version())
+
+
+def test_single_mismatch_pos_strand(hdp):
     """
     Scenario: Single mismatch
     CIGAR: 47=1X195=
@@ -31,7 +69,7 @@ def test_single_mismatch_pos_strand():
     assert resultdf["ALT"] == expect_alt
 
 
-def test_single_mismatch_pos_strand_2():
+def test_single_mismatch_pos_strand_2(hdp):
     """
     Scenario: Single mismatch
     CIGAR: 389=1X38=
@@ -55,7 +93,7 @@ def test_single_mismatch_pos_strand_2():
     assert resultdf["ALT"] == expect_alt
 
 
-def test_single_mismatch_min_strand():
+def test_single_mismatch_min_strand(hdp):
     """
     Scenario: Single mismatch
     CIGAR: 2720=1X4851=
@@ -79,7 +117,7 @@ def test_single_mismatch_min_strand():
     assert resultdf["ALT"] == expect_alt
 
 
-def test_single_mismatch_min_strand_2():
+def test_single_mismatch_min_strand_2(hdp):
     """
     Scenario: Single mismatch
     CIGAR: 204=1X10=
@@ -103,7 +141,7 @@ def test_single_mismatch_min_strand_2():
     assert resultdf["ALT"] == expect_alt
 
 
-def test_two_contig_mismatches_pos_strand():
+def test_two_contig_mismatches_pos_strand(hdp):
     """
     Scenario: Two contiguous single bp events
     CIGAR: 21=1X116=1X54=1X79=2X27=1X54=1X6=1X13=1X2=1X34=1X69=1X7=1X3=2X216=1X50=1X9=1X32=1X83=
@@ -130,7 +168,7 @@ def test_two_contig_mismatches_pos_strand():
     assert resultdf.iloc[0]["ALT"] == expect_mm_alt
 
 
-def test_two_contig_mismatches_min_strand():
+def test_two_contig_mismatches_min_strand(hdp):
     """
     Scenario: Two contiguous single bp events
     CIGAR: 21=1X116=1X54=1X79=2X27=1X54=1X6=1X13=1X2=1X34=1X69=1X7=1X3=2X216=1X50=1X9=1X32=1X83=
@@ -157,7 +195,7 @@ def test_two_contig_mismatches_min_strand():
     assert resultdf.iloc[0]["ALT"] == expect_mm_alt
 
 
-def test_single_bp_del_pos_strand():
+def test_single_bp_del_pos_strand(hdp):
     """
     Scenario: Single mismatch
     CIGAR: 980=1D2=
@@ -181,7 +219,7 @@ def test_single_bp_del_pos_strand():
     assert resultdf["ALT"] == expect_alt
 
 
-def test_single_bp_del_min_strand():
+def test_single_bp_del_min_strand(hdp):
     """
     # Scenario: Single bp deletion
     # CIGAR: 2410=1D2=
@@ -205,7 +243,7 @@ def test_single_bp_del_min_strand():
     assert resultdf["ALT"] == expect_alt
 
 
-def test_multi_bp_del_pos_strand():
+def test_multi_bp_del_pos_strand(hdp):
     """
     Scenario: Multiple bp deletion
     CIGAR: 4=9D149=
@@ -231,7 +269,7 @@ def test_multi_bp_del_pos_strand():
     assert resultdf["ALT"] == expect_alt
 
 
-def test_multi_bp_del_pos_strand_2():
+def test_multi_bp_del_pos_strand_2(hdp):
     """
     Scenario: Another multiple bp deletion
     CIGAR: 1453=3D2=
@@ -255,7 +293,7 @@ def test_multi_bp_del_pos_strand_2():
     assert resultdf["ALT"] == expect_alt
 
 
-def test_multi_bp_del_min_strand():
+def test_multi_bp_del_min_strand(hdp):
     """
     Scenario: Multiple bp deletion
     CIGAR: 459=14D1318=
@@ -281,7 +319,7 @@ def test_multi_bp_del_min_strand():
     assert resultdf["ALT"] == expect_alt
 
 
-def test_single_bp_ins_pos_strand():
+def test_single_bp_ins_pos_strand(hdp):
     """
     Scenario: Single bp insertion
     CIGAR: 136=1I129=
@@ -307,7 +345,7 @@ def test_single_bp_ins_pos_strand():
     assert resultdf["ALT"] == expect_alt
 
 
-def test_multi_bp_ins_pos_strand():
+def test_multi_bp_ins_pos_strand(hdp):
     """
     Scenario: Multiple bp insertion
     CIGAR: 14=1X11=6I26=
@@ -333,7 +371,7 @@ def test_multi_bp_ins_pos_strand():
     assert resultdf["ALT"] == expect_alt
 
 
-def test_multi_bp_ins_pos_strand_2():
+def test_multi_bp_ins_pos_strand_2(hdp):
     """
     Scenario: Another multiple bp insertion
     CIGAR: 284=3I1=
@@ -357,7 +395,7 @@ def test_multi_bp_ins_pos_strand_2():
     assert resultdf["ALT"] == expect_alt
 
 
-def test_single_bp_ins_neg_strand():
+def test_single_bp_ins_neg_strand(hdp):
     """
     Scenario: Single bp insertion
     CIGAR: 428=1I76=
@@ -381,7 +419,7 @@ def test_single_bp_ins_neg_strand():
     assert resultdf["ALT"] == expect_alt
 
 
-def test_multi_bp_ins_neg_strand():
+def test_multi_bp_ins_neg_strand(hdp):
     """
     Scenario: Multiple bp insertion
     CIGAR: 52=6I14=
@@ -405,7 +443,7 @@ def test_multi_bp_ins_neg_strand():
     assert resultdf["ALT"] == expect_alt
 
 
-def test_two_noncontig_single_bp_events():
+def test_two_noncontig_single_bp_events(hdp):
     """
     Scenario: Two non-contiguous events, an insertion and a mismatch
     CIGAR: 666=1I39=1X404=
@@ -436,7 +474,7 @@ def test_two_noncontig_single_bp_events():
     assert resultdf.iloc[1]["ALT"] == expect_mm_alt
 
 
-def test_multiple_indels_min_strand():
+def test_multiple_indels_min_strand(hdp):
     """
     Scenario: Multiple indels
     CIGAR: 498=1D37=3I1809=
@@ -470,4 +508,4 @@ def test_multiple_indels_min_strand():
 
 
 if __name__ == "__main__":
-    test_multiple_indels_min_strand()
+    test_multiple_indels_min_strand(connect())
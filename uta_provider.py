@@ -0,0 +1,349 @@
+"""
+Set-based UTA queries and data provider wrappers used by find_mismatch_positions.py.
+
+The wrappers in this module expose the same methods as the hgvs UTA data provider
+returned by hgvs.dataproviders.uta.connect() (get_tx_mapping_options, get_tx_exons,
+get_seq, ...), so they can be passed anywhere an `hdp` is expected.
+"""
+
+from collections import Counter
+import hashlib
+import re
+
+PERFECT_CIGAR_RE = re.compile("^[0-9]+=$")
+
+_queries = {
+    "bulk_tx_mapping_options": """
+        select distinct tx_ac, alt_ac, alt_aln_method
+        from tx_exon_aln_v
+        where tx_ac = any(%s) and exon_aln_id is not NULL
+        order by tx_ac, alt_ac, alt_aln_method
+        """,
+    "bulk_tx_exons": """
+        select *
+        from tx_exon_aln_v
+        where (tx_ac, alt_ac) in (select * from unnest(%s::text[], %s::text[]))
+        order by tx_ac, alt_ac, alt_aln_method, alt_start_i
+        """,
+    # The non-perfect exon queries also return the first exon in transcript order (tx_start_i = 0)
+    # so that the same alignment completeness check as hdp.get_tx_exons() can be applied
+    "tx_nonperfect_exons": """
+        select *
+        from tx_exon_aln_v
+        where tx_ac = %s and alt_ac = %s and alt_aln_method = %s
+        and (cigar !~ '^[0-9]+=$' or tx_start_i = 0)
+        order by alt_start_i
+        """,
+    "bulk_tx_nonperfect_exons": """
+        select *
+        from tx_exon_aln_v
+        where (tx_ac, alt_ac) in (select * from unnest(%s::text[], %s::text[]))
+        and (cigar !~ '^[0-9]+=$' or tx_start_i = 0)
+        order by tx_ac, alt_ac, alt_aln_method, alt_start_i
+        """,
+    # One fingerprint per alignment of its exons' coordinates and CIGAR strings, for the alignments that are
+    # mapping options (see aln_fingerprint())
+    "bulk_aln_fingerprints": """
+        select tx_ac, alt_ac, alt_aln_method, md5(string_agg(
+            concat_ws(',', ord, alt_strand, tx_start_i, tx_end_i, alt_start_i, alt_end_i, cigar),
+            ';' order by ord
+        )) as fingerprint, count(*) as exons
+        from tx_exon_aln_v
+        where tx_ac = any(%s) and exon_aln_id is not NULL
+        group by tx_ac, alt_ac, alt_aln_method
+        order by tx_ac, alt_ac, alt_aln_method
+        """,
+    # Pairs of input transcripts with the same exon structure and the same sequence (seq_id is the sequence's MD5),
+    # used to group equivalent transcripts (see equivalence.py)
+    "bulk_similar_transcripts": """
+        select s.tx_ac1, s.tx_ac2
+        from tx_similarity_v s
+        join seq_anno a1 on a1.ac = s.tx_ac1
+        join seq_anno a2 on a2.ac = s.tx_ac2
+        where s.tx_ac1 = any(%s) and s.tx_ac2 = any(%s) and s.tx_ac1 != s.tx_ac2
+        and s.es_fp_eq and s.cds_es_fp_eq is not false and a1.seq_id = a2.seq_id
+        order by s.tx_ac1, s.tx_ac2
+        """,
+    "stream_nonperfect_exons": """
+        select *
+        from tx_exon_aln_v
+        where alt_ac = any(%s) and alt_aln_method = any(%s)
+        and (cigar !~ '^[0-9]+=$' or tx_start_i = 0)
+        order by tx_ac, alt_ac, alt_aln_method, alt_start_i
+        """,
+}
+
+
+def uta_bulk_tx_mapping_options(hdp, tx_acs):
+    """
+    Get the mapping options for many transcript accessions with a single query.
+
+    Rows have the same layout as those returned by hdp.get_tx_mapping_options(), i.e. [tx_ac, alt_ac, alt_aln_method].
+    """
+    return hdp._fetchall(_queries["bulk_tx_mapping_options"], [list(tx_acs)])
+
+
+def uta_bulk_tx_exons(hdp, tx_alt_acs, nonperfect_only=False):
+    """
+    Get all tx_exon_aln_v rows for many (tx_ac, alt_ac) pairs with a single query.
+    If nonperfect_only is set, exons whose CIGAR is a single match run (e.g. "243=") are filtered out server-side.
+
+    Rows have the same layout as those returned by hdp.get_tx_exons() and are ordered by
+    (tx_ac, alt_ac, alt_aln_method, alt_start_i), so grouping them preserves the per-alignment exon order.
+    """
+    tx_acs = [tx_ac for tx_ac, _ in tx_alt_acs]
+    alt_acs = [alt_ac for _, alt_ac in tx_alt_acs]
+    query = "bulk_tx_nonperfect_exons" if nonperfect_only else "bulk_tx_exons"
+    return hdp._fetchall(_queries[query], [tx_acs, alt_acs])
+
+
+def uta_bulk_aln_fingerprints(hdp, tx_acs):
+    """
+    Get the fingerprint of every alignment of many transcript accessions with a single query, computed by the
+    database so that only the fingerprints are transferred.
+
+    Rows are [tx_ac, alt_ac, alt_aln_method, fingerprint, exons], with the number of exons of the alignment, ordered
+    by (tx_ac, alt_ac, alt_aln_method).
+    """
+    return hdp._fetchall(_queries["bulk_aln_fingerprints"], [list(tx_acs)])
+
+
+def uta_bulk_similar_transcripts(hdp, tx_acs1, tx_acs2):
+    """
+    Get the pairs of a transcript of tx_acs1 and one of tx_acs2 that tx_similarity_v reports to have the same exon
+    structure (es_fp_eq and, for coding transcripts, cds_es_fp_eq) and that have the same sequence, with a single
+    query.
+
+    Rows are [tx_ac1, tx_ac2], ordered by (tx_ac1, tx_ac2).
+    """
+    return hdp._fetchall(
+        _queries["bulk_similar_transcripts"], [list(tx_acs1), list(tx_acs2)]
+    )
+
+
+def aln_fingerprint(rows):
+    """
+    Compute the fingerprint of an alignment from its exon rows, as the bulk_aln_fingerprints query does.
+    """
+    return hashlib.md5(
+        ";".join(
+            ",".join(
+                str(r[c])
+                for c in [
+                    "ord",
+                    "alt_strand",
+                    "tx_start_i",
+                    "tx_end_i",
+                    "alt_start_i",
+                    "alt_end_i",
+                    "cigar",
+                ]
+            )
+            for r in sorted(rows, key=lambda r: r["ord"])
+        ).encode()
+    ).hexdigest()
+
+
+def data_not_available(message):
+    """
+    An hgvs HGVSDataNotAvailableError with message, to raise. hgvs is only imported once one is raised.
+    """
+    from hgvs.exceptions import HGVSDataNotAvailableError
+
+    return HGVSDataNotAvailableError(message)
+
+
+def check_tx_exons(rows, tx_ac, alt_ac, alt_aln_method):
+    """
+    Apply the same sanity checks to a set of exon rows as hdp.get_tx_exons() does, raising HGVSDataNotAvailableError on failure.
+    """
+    if len(rows) == 0:
+        raise data_not_available(
+            f"No tx_exons for (tx_ac={tx_ac},alt_ac={alt_ac},alt_aln_method={alt_aln_method})"
+        )
+    ex0 = 0 if (rows[0]["alt_strand"] == 1) else -1
+    if rows[ex0]["tx_start_i"] != 0:
+        raise data_not_available(
+            "Alignment is incomplete; cannot use transcript for mapping"
+            f"(tx_ac={tx_ac},alt_ac={alt_ac},alt_aln_method={alt_aln_method})"
+        )
+    return rows
+
+
+class Row(list):
+    """
+    Minimal stand-in for psycopg2.extras.DictRow: indexable by position or by column name.
+    """
+
+    def __init__(self, columns, values):
+        super().__init__(values)
+        self._columns = columns
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key = self._columns.index(key)
+        return super().__getitem__(key)
+
+    def keys(self):
+        return list(self._columns)
+
+
+def provider_stats(hdp):
+    """
+    Sum the `stats` Counters of a data provider and all of the providers it wraps.
+    """
+    stats = Counter()
+    while hdp is not None:
+        stats.update(vars(hdp).get("stats", {}))
+        hdp = vars(hdp).get("hdp")
+    return stats
+
+
+class UTAProxy:
+    """
+    Base class for data provider wrappers. Any attribute not overridden by a subclass is looked up on the wrapped provider.
+    """
+
+    def __init__(self, hdp):
+        self.hdp = hdp
+
+    def __getattr__(self, name):
+        # Guard against infinite recursion when hdp itself is not set yet (e.g. while unpickling)
+        if name == "hdp":
+            raise AttributeError(name)
+        return getattr(self.hdp, name)
+
+
+class DeferredUTA(UTAProxy):
+    """
+    Data provider that creates the wrapped provider, e.g. opens the UTA connection, by calling connect() on first
+    use, so runs that never query the database don't connect at all.
+    """
+
+    # Optional hooks that wrappers look up on the providers they wrap (see instrumentation.stage() and
+    # cigar_batch), which a UTA provider never has
+    WRAPPER_HOOKS = ("record_stage", "lookup_events")
+
+    def __init__(self, connect):
+        super().__init__(None)
+        self._connect = connect
+
+    def __getattr__(self, name):
+        if name in ("hdp", "_connect") + self.WRAPPER_HOOKS:
+            raise AttributeError(name)
+        if self.hdp is None:
+            self.hdp = self._connect()
+        return getattr(self.hdp, name)
+
+
+class UTAMismatchProvider(UTAProxy):
+    """
+    Wraps an hgvs UTA data provider to add the queries find_mismatch_positions.py needs beyond the hgvs interface.
+    """
+
+    def get_tx_nonperfect_exons(self, tx_ac, alt_ac, alt_aln_method):
+        """
+        Like get_tx_exons(), but only returns exons whose CIGAR string is not a single match run (plus the first exon
+        in transcript order), filtering on the server so transfer volume scales with the number of discrepancies.
+        """
+        rows = self.hdp._fetchall(
+            _queries["tx_nonperfect_exons"], [tx_ac, alt_ac, alt_aln_method]
+        )
+        return check_tx_exons(rows, tx_ac, alt_ac, alt_aln_method)
+
+    def stream_nonperfect_exons(self, alt_acs, alt_aln_methods, itersize=10000):
+        """
+        Yield the non-perfect exons (plus the first exon in transcript order) of every alignment to one of alt_acs with
+        one of alt_aln_methods, ordered by (tx_ac, alt_ac, alt_aln_method, alt_start_i).
+
+        Rows are read through a server-side cursor, itersize at a time, on a connection of their own, so memory use
+        doesn't grow with the number of alignments and the provider's own connection stays available.
+        """
+        import psycopg2
+        import psycopg2.extras
+
+        url = self.hdp.url
+        conn = psycopg2.connect(
+            host=url.hostname,
+            port=url.port,
+            database=url.database,
+            user=url.username,
+            password=url.password,
+            application_name="find_mismatch_positions/stream",
+        )
+        try:
+            # Named cursors live in a transaction, which the search path is set for too
+            with conn.cursor() as cur:
+                cur.execute(f"set local search_path = {url.schema}, public")
+            with conn.cursor(
+                name="stream_nonperfect_exons",
+                cursor_factory=psycopg2.extras.DictCursor,
+            ) as cur:
+                cur.itersize = itersize
+                cur.execute(
+                    _queries["stream_nonperfect_exons"],
+                    [list(alt_acs), list(alt_aln_methods)],
+                )
+                yield from cur
+        finally:
+            conn.rollback()
+            conn.close()
+
+
+class UTABatchPrefetch(UTAProxy):
+    """
+    Data provider that answers get_tx_mapping_options() and get_tx_exons() for a batch of
+    (tx_ac, alt_ac) pairs from two set-based queries issued up front, instead of one round trip per call.
+
+    Calls for transcripts or alignments outside of the prefetched batch fall through to the wrapped provider.
+    If nonperfect_only is set, only the rows get_tx_nonperfect_exons() needs are prefetched and
+    get_tx_exons() always falls through.
+    """
+
+    def __init__(self, hdp, tx_acs, alt_acs, nonperfect_only=False):
+        super().__init__(hdp)
+        tx_alt_acs = sorted(set(zip(tx_acs, alt_acs)))
+        self._tx_acs = {tx_ac for tx_ac, _ in tx_alt_acs}
+        self._tx_alt_acs = set(tx_alt_acs)
+        self._nonperfect_only = nonperfect_only
+        self._mapopts = {}
+        for r in uta_bulk_tx_mapping_options(hdp, sorted(self._tx_acs)):
+            self._mapopts.setdefault(r["tx_ac"], []).append(r)
+        self._tx_exons = {}
+        for r in uta_bulk_tx_exons(hdp, tx_alt_acs, nonperfect_only):
+            self._tx_exons.setdefault(
+                (r["tx_ac"], r["alt_ac"], r["alt_aln_method"]), []
+            ).append(r)
+
+    def bind(self, hdp):
+        """
+        Return a view of the same prefetched data whose fall-through calls go to hdp instead.
+        """
+        other = object.__new__(type(self))
+        other.__dict__.update(self.__dict__)
+        other.hdp = hdp
+        return other
+
+    def get_tx_mapping_options(self, tx_ac):
+        if tx_ac not in self._tx_acs:
+            return self.hdp.get_tx_mapping_options(tx_ac)
+        return self._mapopts.get(tx_ac, [])
+
+    def get_tx_exons(self, tx_ac, alt_ac, alt_aln_method):
+        if (tx_ac, alt_ac) not in self._tx_alt_acs or self._nonperfect_only:
+            return self.hdp.get_tx_exons(tx_ac, alt_ac, alt_aln_method)
+        rows = self._tx_exons.get((tx_ac, alt_ac, alt_aln_method), [])
+        return check_tx_exons(rows, tx_ac, alt_ac, alt_aln_method)
+
+    def get_tx_nonperfect_exons(self, tx_ac, alt_ac, alt_aln_method):
+        if (tx_ac, alt_ac) not in self._tx_alt_acs:
+            return self.hdp.get_tx_nonperfect_exons(tx_ac, alt_ac, alt_aln_method)
+        rows = self._tx_exons.get((tx_ac, alt_ac, alt_aln_method), [])
+        check_tx_exons(rows, tx_ac, alt_ac, alt_aln_method)
+        if self._nonperfect_only:
+            return rows
+        return [
+            r
+            for r in rows
+            if r["tx_start_i"] == 0 or not PERFECT_CIGAR_RE.fullmatch(r["cigar"])
+        ]
@@ -0,0 +1,136 @@
+import pytest
+
+from hgvs.exceptions import HGVSDataNotAvailableError
+
+from uta_provider import (
+    PERFECT_CIGAR_RE,
+    DeferredUTA,
+    Row,
+    UTABatchPrefetch,
+    UTAMismatchProvider,
+    _queries,
+)
+from synthetic_uta import TX_EXON_COLUMNS
+
+
+def exon_row(tx_ac, alt_ac, method, ord, tx_start_i, cigar):
+    return Row(
+        TX_EXON_COLUMNS,
+        ["GENE", tx_ac, alt_ac, method, 1, ord, tx_start_i, tx_start_i + 10]
+        + [1000 + tx_start_i, 1010 + tx_start_i, cigar, None, None]
+        + [1, 2, 100 + ord, 200 + ord, 300 + ord],
+    )
+
+
+def nonperfect(r):
+    # Mirrors the server-side predicate "cigar !~ '^[0-9]+=$' or tx_start_i = 0"
+    return not PERFECT_CIGAR_RE.fullmatch(r["cigar"]) or r["tx_start_i"] == 0
+
+
+class FakeUTA:
+    def __init__(self, exons):
+        self.exons = exons
+        self.queries = []
+
+    def _fetchall(self, sql, args):
+        self.queries.append(sql)
+        if sql == _queries["bulk_tx_mapping_options"]:
+            opts = sorted(
+                {(r["tx_ac"], r["alt_ac"], r["alt_aln_method"]) for r in self.exons}
+            )
+            return [
+                Row(["tx_ac", "alt_ac", "alt_aln_method"], list(o))
+                for o in opts
+                if o[0] in args[0]
+            ]
+        if sql == _queries["bulk_tx_exons"]:
+            pairs = set(zip(*args))
+            return [r for r in self.exons if (r["tx_ac"], r["alt_ac"]) in pairs]
+        if sql == _queries["bulk_tx_nonperfect_exons"]:
+            pairs = set(zip(*args))
+            return [
+                r
+                for r in self.exons
+                if (r["tx_ac"], r["alt_ac"]) in pairs and nonperfect(r)
+            ]
+        if sql == _queries["tx_nonperfect_exons"]:
+            return [
+                r
+                for r in self.exons
+                if [r["tx_ac"], r["alt_ac"], r["alt_aln_method"]] == args
+                and nonperfect(r)
+            ]
+        raise AssertionError(sql)
+
+    def get_tx_mapping_options(self, tx_ac):
+        raise AssertionError("unexpected per-transcript query")
+
+    def get_tx_exons(self, tx_ac, alt_ac, alt_aln_method):
+        return [("passthrough", tx_ac, alt_ac, alt_aln_method)]
+
+
+def test_batch_prefetch():
+    hdp = FakeUTA(
+        [
+            exon_row("NM_1.1", "NC_1.1", "splign", 0, 0, "10="),
+            exon_row("NM_1.1", "NC_1.1", "splign", 1, 10, "4=1X5="),
+            exon_row("NM_1.1", "NC_1.1", "blat", 0, 0, "10="),
+            exon_row("NM_2.1", "NC_1.1", "splign", 1, 10, "10="),
+        ]
+    )
+    bhdp = UTABatchPrefetch(hdp, ["NM_1.1", "NM_2.1", "NM_3.1"], ["NC_1.1"] * 3)
+    assert len(hdp.queries) == 2
+
+    assert [tuple(r) for r in bhdp.get_tx_mapping_options("NM_1.1")] == [
+        ("NM_1.1", "NC_1.1", "blat"),
+        ("NM_1.1", "NC_1.1", "splign"),
+    ]
+    assert bhdp.get_tx_mapping_options("NM_3.1") == []
+    assert [r["ord"] for r in bhdp.get_tx_exons("NM_1.1", "NC_1.1", "splign")] == [0, 1]
+    # Same errors as hdp.get_tx_exons() for missing and incomplete alignments
+    with pytest.raises(HGVSDataNotAvailableError):
+        bhdp.get_tx_exons("NM_3.1", "NC_1.1", "splign")
+    with pytest.raises(HGVSDataNotAvailableError):
+        bhdp.get_tx_exons("NM_2.1", "NC_1.1", "splign")
+    # Pairs outside of the batch fall through to the wrapped provider
+    assert bhdp.get_tx_exons("NM_1.1", "NC_2.1", "splign")[0][0] == "passthrough"
+    assert len(hdp.queries) == 2
+
+
+def test_nonperfect_exons():
+    hdp = FakeUTA(
+        [
+            exon_row("NM_1.1", "NC_1.1", "splign", 0, 0, "10="),
+            exon_row("NM_1.1", "NC_1.1", "splign", 1, 10, "4=1X5="),
+            exon_row("NM_1.1", "NC_1.1", "splign", 2, 20, "10="),
+            exon_row("NM_2.1", "NC_1.1", "splign", 1, 10, "3=1I6="),
+        ]
+    )
+    uhdp = UTAMismatchProvider(hdp)
+    expect_ords = [0, 1]
+    assert [
+        r["ord"] for r in uhdp.get_tx_nonperfect_exons("NM_1.1", "NC_1.1", "splign")
+    ] == expect_ords
+    with pytest.raises(HGVSDataNotAvailableError):
+        uhdp.get_tx_nonperfect_exons("NM_2.1", "NC_1.1", "splign")
+
+    # Prefetching everything or only non-perfect exons gives the same rows
+    for nonperfect_only in [False, True]:
+        bhdp = UTABatchPrefetch(uhdp, ["NM_1.1"], ["NC_1.1"], nonperfect_only)
+        assert [
+            r["ord"] for r in bhdp.get_tx_nonperfect_exons("NM_1.1", "NC_1.1", "splign")
+        ] == expect_ords
+
+
+def test_deferred_connection():
+    connections = []
+    hdp = UTAMismatchProvider(
+        DeferredUTA(
+            lambda: connections.append(1)
+            or FakeUTA([exon_row("NM_1.1", "NC_1.1", "splign", 0, 0, "1X9=")])
+        )
+    )
+    assert connections == []
+    assert len(hdp.get_tx_nonperfect_exons("NM_1.1", "NC_1.1", "splign")) == 1
+    hdp.get_tx_nonperfect_exons("NM_1.1", "NC_1.1", "splign")
+    assert connections == [1]
@@ -0,0 +1,170 @@
+"""
+Portable snapshots of everything find_mismatch_positions.py needs from UTA and the sequence source for a given
+input list: mapping options, (non-perfect) exon alignments and the exact sequence windows fetched. A snapshot is
+recorded by running the scan through RecordingUTA and replayed with SnapshotUTA, which needs no database or
+network access.
+
+Snapshots are gzip-compressed JSON files.
+"""
+
+import bisect
+import gzip
+import json
+
+from uta_provider import Row, UTAProxy, data_not_available
+
+SNAPSHOT_FORMAT = "identify_gt_discreps.snapshot"
+SNAPSHOT_VERSION = 1
+
+# Data provider methods whose results are recorded, by the name they are stored under
+RECORDED_METHODS = [
+    "get_tx_mapping_options",
+    "get_similar_transcripts",
+    "get_tx_exons",
+    "get_tx_nonperfect_exons",
+]
+
+
+def _key(args):
+    return "|".join(str(a) for a in args)
+
+
+def _add_window(windows, start_i, end_i, seq):
+    """
+    Add sequence window [start_i, end_i) to windows (start_i -> (end_i, seq)), unless a window at the same start
+    reaching at least as far is there already. An end_i of None is the end of the sequence.
+    """
+    old = windows.get(start_i)
+    if old is None or (old[0] is not None and (end_i is None or end_i > old[0])):
+        windows[start_i] = (end_i, seq)
+
+
+class RecordingUTA(UTAProxy):
+    """
+    Data provider that records the results of the calls made through it, to be saved with save().
+    """
+
+    def __init__(self, hdp):
+        super().__init__(hdp)
+        self.records = {method: {} for method in RECORDED_METHODS}
+        self.seqs = {}
+
+    def _record(self, method, args):
+        result = getattr(self.hdp, method)(*args)
+        self.records[method][_key(args)] = {
+            "columns": list(result[0].keys()) if result else [],
+            "rows": [list(r) for r in result],
+        }
+        return result
+
+    def get_tx_mapping_options(self, tx_ac):
+        return self._record("get_tx_mapping_options", (tx_ac,))
+
+    def get_similar_transcripts(self, tx_ac):
+        return self._record("get_similar_transcripts", (tx_ac,))
+
+    def get_tx_exons(self, tx_ac, alt_ac, alt_aln_method):
+        return self._record("get_tx_exons", (tx_ac, alt_ac, alt_aln_method))
+
+    def get_tx_nonperfect_exons(self, tx_ac, alt_ac, alt_aln_method):
+        return self._record("get_tx_nonperfect_exons", (tx_ac, alt_ac, alt_aln_method))
+
+    def get_seq(self, ac, start_i=None, end_i=None):
+        seq = self.hdp.get_seq(ac, start_i, end_i)
+        start_i = 0 if start_i is None else int(start_i)
+        end_i = None if end_i is None else int(end_i)
+        # Keep the requested end as well, since seq is shorter than requested at the end of the sequence
+        _add_window(self.seqs.setdefault(ac, {}), start_i, end_i, seq)
+        return seq
+
+    def merge(self, other):
+        """
+        Add the records of another RecordingUTA, e.g. one used by a different worker.
+        """
+        for method in RECORDED_METHODS:
+            self.records[method].update(other.records[method])
+        for ac, windows in other.seqs.items():
+            own = self.seqs.setdefault(ac, {})
+            for start_i, (end_i, seq) in windows.items():
+                _add_window(own, start_i, end_i, seq)
+
+    def save(self, path, uta_schema=None):
+        snapshot = {
+            "format": SNAPSHOT_FORMAT,
+            "version": SNAPSHOT_VERSION,
+            "uta_schema": uta_schema,
+            "records": self.records,
+            "seqs": {
+                ac: [
+                    [start_i, end_i, seq]
+                    for start_i, (end_i, seq) in sorted(windows.items())
+                ]
+                for ac, windows in self.seqs.items()
+            },
+        }
+        with gzip.open(path, "wt") as f:
+            json.dump(snapshot, f, separators=(",", ":"))
+
+
+class SnapshotUTA:
+    """
+    Data provider that answers the calls recorded in a snapshot file, without any database or network access.
+    Calls that weren't recorded raise HGVSDataNotAvailableError. get_seq() is answered from any recorded window
+    containing the requested interval, with the same truncation at the end of the sequence.
+    """
+
+    def __init__(self, path):
+        with gzip.open(path, "rt") as f:
+            snapshot = json.load(f)
+        if snapshot.get("format") != SNAPSHOT_FORMAT:
+            raise ValueError(f"{path} is not a snapshot file")
+        if snapshot["version"] > SNAPSHOT_VERSION:
+            raise ValueError(
+                f"{path} has snapshot version {snapshot['version']}; this version of the tool reads up to {SNAPSHOT_VERSION}"
+            )
+        self.path = path
+        self.uta_schema = snapshot["uta_schema"]
+        self.records = snapshot["records"]
+        # Windows per accession, sorted by start
+        self._seq_starts = {}
+        self._seq_windows = {}
+        for ac, windows in snapshot["seqs"].items():
+            self._seq_starts[ac] = [start_i for start_i, _, _ in windows]
+            self._seq_windows[ac] = windows
+
+    def data_version(self):
+        return self.uta_schema
+
+    def _replay(self, method, args):
+        record = self.records[method].get(_key(args))
+        if record is None:
+            raise data_not_available(
+                f"No {method} result for {args} in snapshot {self.path}"
+            )
+        return [Row(record["columns"], values) for values in record["rows"]]
+
+    def get_tx_mapping_options(self, tx_ac):
+        return self._replay("get_tx_mapping_options", (tx_ac,))
+
+    def get_similar_transcripts(self, tx_ac):
+        return self._replay("get_similar_transcripts", (tx_ac,))
+
+    def get_tx_exons(self, tx_ac, alt_ac, alt_aln_method):
+        return self._replay("get_tx_exons", (tx_ac, alt_ac, alt_aln_method))
+
+    def get_tx_nonperfect_exons(self, tx_ac, alt_ac, alt_aln_method):
+        return self._replay("get_tx_nonperfect_exons", (tx_ac, alt_ac, alt_aln_method))
+
+    def get_seq(self, ac, start_i=None, end_i=None):
+        starts = self._seq_starts.get(ac, [])
+        start_i = 0 if start_i is None else start_i
+        # Windows are few per accession and may overlap, so check every window starting at or before start_i
+        for k in range(bisect.bisect_right(starts, start_i) - 1, -1, -1):
+            window_start, window_end, seq = self._seq_windows[ac][k]
+            if window_end is None or (end_i is not None and end_i <= window_end):
+                # A window recorded to the end of the sequence serves requests to the end of it
+                end = None if end_i is None else end_i - window_start
+                return seq[start_i - window_start : end]
+        raise data_not_available(
+            f"No sequence for {ac}[{start_i}:{end_i}] in snapshot {self.path}"
+        )
@@ -0,0 +1,82 @@
+import pytest
+from hgvs.exceptions import HGVSDataNotAvailableError
+
+from find_mismatch_positions import main, scan_txlist
+from find_mismatch_positions_test import synthetic_hdp, synthetic_txlist
+from uta_snapshot import RecordingUTA, SnapshotUTA
+from vcf_writer import read_vcf
+
+
+def record_snapshot(path):
+    hdp = RecordingUTA(synthetic_hdp())
+    result = scan_txlist(hdp, synthetic_txlist())
+    hdp.save(path, "uta_test")
+    return result
+
+
+def test_snapshot_scan(tmp_path):
+    path = tmp_path / "snapshot.json.gz"
+    has_aln, mm, _ = record_snapshot(path)
+
+    snap = SnapshotUTA(path)
+    assert snap.data_version() == "uta_test"
+    snap_has_aln, snap_mm, _ = scan_txlist(snap, synthetic_txlist())
+    assert snap_has_aln == has_aln
+    assert snap_mm.to_df().to_csv(sep="\t") == mm.to_df().to_csv(sep="\t")
+
+    # Sub-windows of recorded windows are served; anything else wasn't recorded
+    seq = synthetic_hdp().get_seq("NC_1.1")
+    start_i, end_i, _ = snap._seq_windows["NC_1.1"][0]
+    assert (
+        snap.get_seq("NC_1.1", start_i + 1, start_i + 5)
+        == seq[start_i + 1 : start_i + 5]
+    )
+    with pytest.raises(HGVSDataNotAvailableError):
+        snap.get_seq("NC_1.1", start_i, end_i + 1)
+    with pytest.raises(HGVSDataNotAvailableError):
+        snap.get_tx_nonperfect_exons("NM_1.1", "NC_1.1", "other")
+
+
+def test_overlapping_windows(tmp_path):
+    seq = synthetic_hdp().get_seq("NM_1.1")
+    hdp = RecordingUTA(synthetic_hdp())
+    other = RecordingUTA(synthetic_hdp())
+    # Shorter windows at the same start, recorded later or by another worker, don't replace longer ones
+    hdp.get_seq("NM_1.1", 10, 40)
+    hdp.get_seq("NM_1.1", 10, 20)
+    hdp.get_seq("NM_1.1", 0, 5)
+    other.get_seq("NM_1.1", 0, 30)
+    other.get_seq("NM_1.1", 10, 15)
+    hdp.merge(other)
+    hdp.save(tmp_path / "snapshot.json.gz")
+    snap = SnapshotUTA(tmp_path / "snapshot.json.gz")
+    assert snap.get_seq("NM_1.1", 10, 40) == seq[10:40]
+    assert snap.get_seq("NM_1.1", 0, 30) == seq[0:30]
+
+
+def test_full_sequence(tmp_path):
+    seq = synthetic_hdp().get_seq("NM_1.1")
+    hdp = RecordingUTA(synthetic_hdp())
+    hdp.get_seq("NM_1.1")
+    hdp.save(tmp_path / "snapshot.json.gz")
+    snap = SnapshotUTA(tmp_path / "snapshot.json.gz")
+    assert snap.get_seq("NM_1.1") == seq
+    assert snap.get_seq("NM_1.1", 5) == seq[5:]
+    assert snap.get_seq("NM_1.1", 5, 10) == seq[5:10]
+
+
+def test_main_from_snapshot(tmp_path, monkeypatch):
+    path = tmp_path / "snapshot.json.gz"
+    _, mm, _ = record_snapshot(path)
+    txlist = synthetic_txlist()
+    txlist.to_csv(tmp_path / "txlist.tsv", sep="\t")
+    monkeypatch.chdir(tmp_path)
+
+    main(["--snapshot", str(path), "--batch-size", "2", "txlist.tsv"])
+    vcf = read_vcf("txlist.mismatches.vcf")
+    assert sorted(vcf["ID"]) == sorted(mm.to_df()["ID"])
+
+    # A snapshot exported from a snapshot has everything needed for the same input
+    main(["export-snapshot", "--snapshot", str(path), "txlist.tsv", "copy.json.gz"])
+    _, copy_mm, _ = scan_txlist(SnapshotUTA("copy.json.gz"), txlist)
+    assert copy_mm.to_df().to_csv() == mm.to_df().to_csv()
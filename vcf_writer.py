@@ -0,0 +1,258 @@
+"""
+Streaming writer of the mismatch records found by find_mismatch_positions.py as a sorted VCF file.
+
+Records are buffered in memory up to a fixed count, then sorted and spilled to a temporary run file. When the writer
+is closed, the runs are merge-sorted by (#CHROM, POS) into the output file behind a VCF 4.2 header, so memory use
+doesn't grow with the number of records. Output paths ending in .gz are bgzip-compressed and tabix-indexed.
+"""
+
+from datetime import date
+import gzip
+import heapq
+import os
+import tempfile
+
+VCF_VERSION = "VCFv4.2"
+
+# (ID, Number, Type, Description) of the INFO fields written by cigar_batch.cigar_batch_to_records(), in INFO order
+INFO_FIELDS = [
+    ("tx_ac", "1", "String", "Transcript accession"),
+    (
+        "cigar",
+        "1",
+        "String",
+        "UTA CIGAR string of the exon alignment, with = percent-encoded as %3D",
+    ),
+    ("alt_aln_method", "1", "String", "UTA alignment method"),
+    ("uta_tx_exon_ord", "1", "Integer", "0-based exon ordinal in the transcript"),
+    ("uta_tx_exon_id", "1", "Integer", "UTA transcript exon id"),
+    ("uta_alt_exon_id", "1", "Integer", "UTA genomic exon id"),
+    ("uta_tx_start_i", "1", "Integer", "0-based start of the exon in the transcript"),
+    ("uta_tx_end_i", "1", "Integer", "0-based end of the exon in the transcript"),
+    ("tx_pos", "1", "Integer", "0-based transcript position of the event"),
+    ("uta_alt_start_i", "1", "Integer", "0-based start of the exon on the contig"),
+    ("uta_alt_end_i", "1", "Integer", "0-based end of the exon on the contig"),
+    ("strand", "1", "Integer", "Strand of the transcript on the contig (1 or -1)"),
+]
+INFO_KEYS = [id for id, *_ in INFO_FIELDS]
+_INFO_FORMAT = ";".join(f"{id}={{}}" for id in INFO_KEYS)
+
+
+def format_info(columns):
+    """
+    Render the INFO strings of records whose INFO fields are given as a dict of columns keyed by INFO_KEYS, e.g. the
+    columns of a find_mismatch_positions.MismatchBuffer.
+    """
+    # "=" is reserved in INFO values, and is a CIGAR operation
+    columns = {
+        **columns,
+        "cigar": [cigar.replace("=", "%3D") for cigar in columns["cigar"]],
+    }
+    return [
+        _INFO_FORMAT.format(*values) for values in zip(*(columns[k] for k in INFO_KEYS))
+    ]
+
+
+def parse_info(infos):
+    """
+    Parse a Series of INFO strings rendered by format_info() back into a list of typed columns, in INFO_KEYS order.
+    """
+    fields = infos.str.extract(
+        "^" + ";".join(f"{id}=([^;]*)" for id in INFO_KEYS) + "$"
+    )
+    fields[INFO_KEYS.index("cigar")] = fields[INFO_KEYS.index("cigar")].str.replace(
+        "%3D", "=", regex=False
+    )
+    return [
+        (
+            fields[i].astype("int64") if type == "Integer" else fields[i].astype(object)
+        ).tolist()
+        for i, (id, number, type, description) in enumerate(INFO_FIELDS)
+    ]
+
+
+def read_vcf(path):
+    """
+    Read the records of a VCF file written by SortedVCFWriter (plain or bgzip-compressed) into a DataFrame.
+    """
+    import pandas as pd
+
+    path = str(path)
+    with gzip.open(path, "rt") if path.endswith(".gz") else open(path) as f:
+        header_lines = 0
+        for line in f:
+            if not line.startswith("##"):
+                break
+            header_lines += 1
+    return pd.read_csv(
+        path, sep="\t", skiprows=header_lines, dtype={"#CHROM": str, "POS": int}
+    )
+
+
+def _sort_key(line):
+    chrom, pos, _ = line.split("\t", 2)
+    return chrom, int(pos)
+
+
+def _write_vcf(path, header, lines):
+    """
+    Write the header and record lines to path, bgzip-compressed and tabix-indexed if it ends in .gz.
+    """
+    if path.endswith(".gz"):
+        import pysam
+
+        with pysam.BGZFile(path, "wb") as out:
+            out.write(header.encode())
+            for line in lines:
+                out.write(line.encode())
+        pysam.tabix_index(path, preset="vcf", force=True)
+    else:
+        with open(path, "w") as out:
+            out.write(header)
+            out.writelines(lines)
+
+
+def _contig_id(line):
+    return line[len("##contig=<ID=") :].split(",")[0].rstrip(">\n")
+
+
+def merge_vcfs(paths, path, tie_key=None):
+    """
+    Merge VCF files sorted by (#CHROM, POS), e.g. written by SortedVCFWriters over parts of an input, into one at
+    path, streaming their records. Records at the same position are ordered by tie_key(line), if given, then by
+    the order of paths. The header is the first file's, with the ##contig lines of all of them.
+    """
+    key = (
+        _sort_key if tie_key is None else lambda line: (*_sort_key(line), tie_key(line))
+    )
+    files = [
+        gzip.open(str(p), "rt") if str(p).endswith(".gz") else open(p) for p in paths
+    ]
+    try:
+        headers = []
+        for f in files:
+            header = []
+            for line in f:
+                header.append(line)
+                if line.startswith("#CHROM"):
+                    break
+            headers.append(header)
+        contigs = {
+            _contig_id(line): line
+            for header in headers
+            for line in header
+            if line.startswith("##contig=")
+        }
+        others = [line for line in headers[0] if not line.startswith("##contig=")]
+        at = next(
+            i
+            for i, line in enumerate(others)
+            if line.startswith("##INFO") or line.startswith("#CHROM")
+        )
+        header = others[:at] + [contigs[c] for c in sorted(contigs)] + others[at:]
+        _write_vcf(str(path), "".join(header), heapq.merge(*files, key=key))
+    finally:
+        for f in files:
+            f.close()
+
+
+class SortedVCFWriter:
+    """
+    Writes VCF records to path sorted by (#CHROM, POS), keeping at most run_size records in memory. Records with
+    the same position keep the order they were written in. Temporary runs are kept in tmp_dir (default: the
+    directory of path). contig_lengths optionally maps contig accessions to their lengths for the ##contig lines.
+    """
+
+    def __init__(
+        self,
+        path,
+        run_size=100000,
+        tmp_dir=None,
+        contig_lengths=None,
+        source="find_mismatch_positions.py",
+    ):
+        self.path = str(path)
+        self.run_size = run_size
+        self.contig_lengths = contig_lengths or {}
+        self.source = source
+        self.records = 0
+        self._lines = []
+        self._contigs = set()
+        self._tmp = tempfile.TemporaryDirectory(
+            dir=tmp_dir or os.path.dirname(os.path.abspath(self.path)),
+            prefix=".vcf_runs.",
+        )
+        self._runs = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._tmp.cleanup()
+
+    def write(self, chrom, pos, id, ref, alt, info):
+        self._lines.append(f"{chrom}\t{pos}\t{id}\t{ref}\t{alt}\t.\t.\t{info}\n")
+        self._contigs.add(chrom)
+        self.records += 1
+        if len(self._lines) >= self.run_size:
+            self._spill()
+
+    def write_records(self, mm):
+        """
+        Write all records of a find_mismatch_positions.MismatchBuffer, rendering their INFO strings.
+        """
+        c = mm.columns
+        for record in zip(
+            c["#CHROM"], c["POS"], c["ID"], c["REF"], c["ALT"], format_info(c)
+        ):
+            self.write(*record)
+
+    def _spill(self):
+        # list.sort() is stable, so records at the same position keep their order within and across runs
+        self._lines.sort(key=_sort_key)
+        path = os.path.join(self._tmp.name, f"run{len(self._runs)}.txt")
+        with open(path, "w") as f:
+            f.writelines(self._lines)
+        self._runs.append(path)
+        self._lines = []
+
+    def header(self):
+        lines = [
+            f"##fileformat={VCF_VERSION}",
+            f"##fileDate={date.today():%Y%m%d}",
+            f"##source={self.source}",
+        ]
+        for contig in sorted(self._contigs | set(self.contig_lengths)):
+            length = self.contig_lengths.get(contig)
+            lines.append(
+                f"##contig=<ID={contig}>"
+                if length is None
+                else f"##contig=<ID={contig},length={length}>"
+            )
+        for id, number, type, description in INFO_FIELDS:
+            lines.append(
+                f'##INFO=<ID={id},Number={number},Type={type},Description="{description}">'
+            )
+        lines.append("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO")
+        return "".join(f"{line}\n" for line in lines)
+
+    def close(self):
+        """
+        Merge the runs into the output file, then bgzip-compress and tabix-index it if its path ends in .gz.
+        """
+        self._lines.sort(key=_sort_key)
+        files = [open(path) for path in self._runs]
+        try:
+            _write_vcf(
+                self.path,
+                self.header(),
+                heapq.merge(*files, self._lines, key=_sort_key),
+            )
+        finally:
+            for f in files:
+                f.close()
+            self._tmp.cleanup()
+        self._lines = []
@@ -0,0 +1,121 @@
+import random
+
+import pysam
+
+from find_mismatch_positions import MismatchBuffer
+from vcf_writer import (
+    INFO_KEYS,
+    SortedVCFWriter,
+    format_info,
+    merge_vcfs,
+    parse_info,
+    read_vcf,
+)
+
+
+def random_records(n, seed=0):
+    rng = random.Random(seed)
+    return [
+        (
+            rng.choice(["NC_000001.11", "NC_000002.12", "NC_000010.11"]),
+            rng.randint(1, 1000),
+            f"ev{i}",
+            "A",
+            "C",
+            f"tx_ac=NM_{i}.1;strand=1",
+        )
+        for i in range(n)
+    ]
+
+
+def test_sorted_runs(tmp_path):
+    records = random_records(1000)
+    path = tmp_path / "out.vcf"
+    with SortedVCFWriter(path, run_size=64, contig_lengths={"NC_000003.12": 5}) as vcf:
+        for record in records:
+            vcf.write(*record)
+        assert len(vcf._runs) == 1000 // 64
+
+    header = [line for line in open(path) if line.startswith("##")]
+    assert header[0] == "##fileformat=VCFv4.2\n"
+    assert "##contig=<ID=NC_000003.12,length=5>\n" in header
+    df = read_vcf(path)
+    # Sorted by (#CHROM, POS), ties in the order written
+    expected = sorted(records, key=lambda r: (r[0], r[1]))
+    assert list(df["ID"]) == [r[2] for r in expected]
+    assert list(df["QUAL"].astype(str).unique()) == ["."]
+    assert not list(tmp_path.glob(".vcf_runs.*"))
+
+
+def test_bgzip_tabix(tmp_path):
+    mm = MismatchBuffer()
+    for i, record in enumerate(random_records(200)):
+        info = (f"NM_{i}.1", "10=1X", "splign", 0, 1, 2, 0, 11, 10, 90, 101, 1)
+        mm.append("id", *record[:5], info)
+    path = tmp_path / "out.vcf.gz"
+    with SortedVCFWriter(path, run_size=50) as vcf:
+        vcf.write_records(mm)
+
+    assert (tmp_path / "out.vcf.gz.tbi").exists()
+    with pysam.VariantFile(str(path)) as vf:
+        assert "tx_ac" in vf.header.info
+        region = list(vf.fetch("NC_000002.12", 99, 500))
+    df = read_vcf(path)
+    assert df["INFO"].iloc[0].startswith("tx_ac=NM_")
+    assert ";cigar=10%3D1X;" in df["INFO"].iloc[0]
+    assert all(r.info["cigar"] == "10%3D1X" for r in region)
+    expected = df[(df["#CHROM"] == "NC_000002.12") & df["POS"].between(100, 500)]
+    assert [r.id for r in region] == list(expected["ID"])
+
+
+def test_merge_vcfs(tmp_path):
+    records = random_records(300)
+    paths = [tmp_path / f"part{k}.vcf.gz" for k in range(3)]
+    for k, path in enumerate(paths):
+        with SortedVCFWriter(path, contig_lengths={f"NC_00000{k}.1": k}) as vcf:
+            for record in records[k::3]:
+                vcf.write(*record)
+    merge_vcfs(
+        paths, tmp_path / "merged.vcf", lambda line: int(line.split("\t")[2][2:]) // 100
+    )
+
+    header = [line for line in open(tmp_path / "merged.vcf") if line.startswith("##")]
+    contigs = [line for line in header if line.startswith("##contig")]
+    # Those of all parts, sorted
+    assert contigs == sorted(contigs)
+    assert {f"##contig=<ID=NC_00000{k}.1,length={k}>\n" for k in range(3)} <= set(
+        contigs
+    )
+    assert "##contig=<ID=NC_000010.11>\n" in contigs
+    df = read_vcf(tmp_path / "merged.vcf")
+    # Sorted by (#CHROM, POS), ties by the tie key and then by part
+    expected = sorted(
+        ((r, i % 3) for i, r in enumerate(records)),
+        key=lambda r: (r[0][0], r[0][1], int(r[0][2][2:]) // 100, r[1]),
+    )
+    assert list(df["ID"]) == [r[2] for r, _ in expected]
+
+
+def test_parse_info():
+    mm = MismatchBuffer()
+    mm.append(
+        "id",
+        "NC_1.1",
+        5,
+        "ev",
+        "A",
+        "AC",
+        ("NM_1.1", "3=1I2=", "splign", 4, 1, 2, 0, 5, 3, 0, 6, 1),
+    )
+    mm.append(
+        "id",
+        "NC_1.1",
+        9,
+        "ev",
+        "C",
+        "G",
+        ("NM_2.1", "6=1X", "blat", 0, 3, 4, 7, 14, 13, 2, 9, -1),
+    )
+    columns = parse_info(mm.to_df()["INFO"])
+    assert columns == [mm.columns[key] for key in INFO_KEYS]
+    assert format_info(dict(zip(INFO_KEYS, columns))) == mm.to_df()["INFO"].tolist()